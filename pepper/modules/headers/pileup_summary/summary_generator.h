@@ -15,6 +15,7 @@ using namespace std;
 
 namespace ImageOptions {
     static constexpr int MAX_COLOR_VALUE = 254;
+    static constexpr int IMAGE_FEATURES = 10;
 };
 
 class SummaryGenerator {
@@ -23,15 +24,32 @@ class SummaryGenerator {
     string chromosome_name;
     string reference_sequence;
 
-    map< pair< pair<long long, int>, int>, double> insert_summaries;
-    map< pair<long long, int>, double> base_summaries;
-    map<long long, long long> longest_insert_count;
-    map<long long, double> coverage;
+    // all counts are kept in arrays indexed by the offset of a position from ref_start. Insert bases of a position
+    // are stored together, starting at insert_offset of the position, and have room for the longest insert.
+    vector<int> base_summaries;
+    vector<int> coverage;
+    vector<int> longest_insert_count;
+    vector<long long> insert_offset;
+    vector<int> insert_summaries;
 
-    map< pair<long long, int>, char> insert_labels;
-    map< long long, char> base_labels;
+    vector<char> insert_labels;
+    vector<char> base_labels;
+
+    bool in_reference(long long position) const {
+        return position >= ref_start && position <= ref_end;
+    }
+    int get_longest_insert(long long position) const {
+        return in_reference(position) ? longest_insert_count[position - ref_start] : 0;
+    }
+    double get_coverage(long long position) const {
+        return in_reference(position) ? coverage[position - ref_start] : 0.0;
+    }
+    char get_base_label(long long position) const {
+        return in_reference(position) ? base_labels[position - ref_start] : 0;
+    }
 public:
-    vector< vector<uint8_t> > image;
+    // row major image, IMAGE_FEATURES values per row
+    vector<uint8_t> image;
     vector<uint8_t> labels;
     vector<pair<long long, int> > genomic_pos;
     vector<int> bad_label_positions;
@@ -49,9 +67,10 @@ public:
                                 long long end_pos,
                                 type_read truth_read);
 
-    void iterate_over_read(type_read read, long long region_start, long long region_end);
+    void count_inserts(const vector <type_read> &reads, long long region_end);
+    void iterate_over_read(const type_read &read, long long region_start, long long region_end);
     int get_sequence_length(long long start_pos, long long end_pos);
-    void generate_labels(type_read truth_reads, long long region_start, long long region_end);
+    void generate_labels(const type_read &truth_reads, long long region_start, long long region_end);
     void generate_ref_features();
     void debug_print(long long start_pos, long long end_pos);
     void generate_image(long long start_pos, long long end_pos);
@@ -11,6 +11,7 @@
 #include "pileup_summary/summary_generator.h"
 #include <pybind11/pybind11.h>
 #include <pybind11/stl.h>
+#include <pybind11/numpy.h>
 #include <pybind11/operators.h>
 namespace py = pybind11;
 
@@ -19,8 +20,29 @@ PYBIND11_MODULE(PEPPER, m) {
             .def(py::init<const string &, const string &, long long &, long long &>())
             .def_readwrite("genomic_pos", &SummaryGenerator::genomic_pos)
             .def_readwrite("labels", &SummaryGenerator::labels)
-            .def_readwrite("image", &SummaryGenerator::image)
             .def_readwrite("bad_label_positions", &SummaryGenerator::bad_label_positions)
+            // the region is returned as numpy arrays so python never builds a list per base
+            .def("get_image", [](const SummaryGenerator &summary) {
+                ssize_t rows = summary.image.size() / ImageOptions::IMAGE_FEATURES;
+                py::array_t<uint8_t> image(std::vector<ssize_t>{rows, (ssize_t) ImageOptions::IMAGE_FEATURES});
+                std::copy(summary.image.begin(), summary.image.end(), image.mutable_data());
+                return image;
+            })
+            .def("get_labels", [](const SummaryGenerator &summary) {
+                py::array_t<uint8_t> labels(std::vector<ssize_t>{(ssize_t) summary.labels.size()});
+                std::copy(summary.labels.begin(), summary.labels.end(), labels.mutable_data());
+                return labels;
+            })
+            .def("get_genomic_positions", [](const SummaryGenerator &summary) {
+                // one row of (position, index) per image row
+                py::array_t<int64_t> genomic_positions(std::vector<ssize_t>{(ssize_t) summary.genomic_pos.size(), 2});
+                int64_t* data = genomic_positions.mutable_data();
+                for (size_t i = 0; i < summary.genomic_pos.size(); i++) {
+                    data[2 * i] = summary.genomic_pos[i].first;
+                    data[2 * i + 1] = summary.genomic_pos[i].second;
+                }
+                return genomic_positions;
+            })
             .def("generate_train_summary", &SummaryGenerator::generate_train_summary)
             .def("generate_summary", &SummaryGenerator::generate_summary);
 
@@ -60,6 +82,11 @@ PYBIND11_MODULE(PEPPER, m) {
             .def(py::init<const int &, const int &, const string &>())
             .def("align_reads_to_reference", &ReadAligner::align_reads_to_reference);
 
+        // overlap aligner used to stitch polished chunks
+        py::class_<OverlapAligner>(m, "OverlapAligner")
+            .def(py::init<const int &, const int &, const int &, const int &, const int &>())
+            .def("align_overlaps", &OverlapAligner::align_overlaps);
+
         // data structure for sequence name and their length
         py::class_<type_sequence>(m, "type_sequence")
             .def_readwrite("sequence_length", &type_sequence::sequence_length)
@@ -14,6 +14,7 @@
 #include <string>
 #include <sstream>
 #include <memory>
+#include <stdexcept>
 using namespace StripedSmithWaterman;
 
 namespace Aligner_options {
@@ -22,6 +23,8 @@ namespace Aligner_options {
     static constexpr int gap_open_penalty = 8;
     static constexpr int gap_extend_penalty = 2;
     static constexpr int max_number_of_mismatches = 2;
+    // reference bases past the end of a read's original alignment it can be realigned to
+    static constexpr int reference_window_padding = 20;
 };
 
 class LibSSWPairwiseAligner {
@@ -29,8 +32,20 @@ class LibSSWPairwiseAligner {
     Aligner* ssw_aligner;
 public:
     LibSSWPairwiseAligner();
-    void set_reference(string reference);
-    Alignment align(string query);
+    void set_reference(const string& reference);
+    bool align(const string& query, int reference_offset, int reference_length, Alignment& alignment);
+};
+
+// aligns the overlapping ends of consecutive polished chunks to find where they can be joined
+class OverlapAligner {
+    Filter filter;
+    Aligner ssw_aligner;
+    int min_match_length;
+    pair<int, int> get_join_positions(const Alignment& alignment);
+public:
+    OverlapAligner(const int& match, const int& mismatch, const int& gap_open_penalty, const int& gap_extend_penalty,
+                   const int& min_match_length);
+    vector<pair<int, int> > align_overlaps(const vector<pair<string, string> >& overlaps);
 };
 
 class ReadAligner {
@@ -41,7 +56,7 @@ class ReadAligner {
     list<CigarOp> CigarStringToVector(const string& cigar);
 public:
     ReadAligner(int ref_start, int ref_end, string ref_seq);
-    vector<type_read> align_reads_to_reference(vector<type_read> reads);
+    vector<type_read> align_reads_to_reference(const vector<type_read>& reads);
 };
 
 #endif //PEPPER_SIMPLE_ALIGNER_H
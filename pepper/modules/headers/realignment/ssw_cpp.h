@@ -138,6 +138,24 @@ class Aligner {
   // =========
   bool Align_cpp(const char* query, const Filter& filter, Alignment* alignment, const int32_t maskLen) const;
 
+  // =========
+  // @function Align the query againt ref_len bases of the reference, that is
+  //             set by SetReferenceSequence, starting at ref_offset. The
+  //             reference is translated once, so many queries can be aligned
+  //             to parts of it.
+  // @param    query      The query sequence.
+  // @param    ref_offset Start of the reference window. Positions in the
+  //                      alignment are relative to this offset.
+  // @param    ref_len    Length of the reference window, it is clipped to the
+  //                      end of the reference.
+  // @param    filter     The filter for the alignment.
+  // @param    alignment  The container contains the result.
+  // @param    maskLen    Same as Align_cpp.
+  // @return   True: succeed; false: fail.
+  // =========
+  bool AlignAtReferenceOffset(const char* query, const int32_t& ref_offset, const int32_t& ref_len,
+                              const Filter& filter, Alignment* alignment, const int32_t maskLen) const;
+
   // =========
   // @function Align the query againt the reference.
   //           [NOTICE] The reference won't replace the reference
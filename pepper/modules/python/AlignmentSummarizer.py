@@ -1,5 +1,6 @@
 from pepper.build import PEPPER
 import itertools
+import heapq
 import time
 import sys
 import numpy as np
@@ -16,55 +17,49 @@ class AlignmentSummarizer:
         self.region_end_position = region_end
 
     @staticmethod
-    def chunk_images(summary, chunk_size, chunk_overlap):
-        chunk_start = 0
-        chunk_id = 0
-        chunk_end = min(len(summary.genomic_pos), chunk_size)
-        images = []
-        labels = []
-        positions = []
-        chunk_ids = []
-
-        while True:
-            image_chunk = summary.image[chunk_start:chunk_end]
-            pos_chunk = summary.genomic_pos[chunk_start:chunk_end]
-            label_chunk = [0] * (chunk_end - chunk_start)
-
-            # assert (len(image_chunk) == len(pos_chunk) == len(label_chunk))
-            # print(len(image_chunk), len(pos_chunk), len(label_chunk))
-
-            padding_required = chunk_size - len(image_chunk)
-            if padding_required > 0:
-                label_chunk = label_chunk + [0] * padding_required
-                pos_chunk = pos_chunk + [(-1, -1)] * padding_required
-                image_chunk = image_chunk + [[0.0] * ImageSizeOptions.IMAGE_HEIGHT] * padding_required
+    def get_chunk_views(array, total_chunks, chunk_step, chunk_size):
+        """
+        Return overlapping chunks of an array as a read-only strided view, chunk i covers rows
+        [i * chunk_step, i * chunk_step + chunk_size). The array must be long enough to hold the last chunk.
+        :param array: Array to chunk along the first axis
+        :param total_chunks: Number of chunks
+        :param chunk_step: Rows between the starts of two chunks
+        :param chunk_size: Rows in a chunk
+        :return: A view of shape (total_chunks, chunk_size) + array.shape[1:]
+        """
+        return np.lib.stride_tricks.as_strided(array,
+                                               shape=(total_chunks, chunk_size) + array.shape[1:],
+                                               strides=(chunk_step * array.strides[0],) + array.strides,
+                                               writeable=False)
 
-            # assert (len(image_chunk) == len(pos_chunk) == len(label_chunk) == ImageSizeOptions.SEQ_LENGTH)
+    @staticmethod
+    def chunk_images(summary, chunk_size, chunk_overlap):
+        image = summary.get_image()
+        genomic_positions = summary.get_genomic_positions()
+        sequence_length = genomic_positions.shape[0]
 
-            images.append(image_chunk)
-            labels.append(label_chunk)
-            positions.append(pos_chunk)
-            chunk_ids.append(chunk_id)
-            chunk_id += 1
+        chunk_step = chunk_size - chunk_overlap
+        total_chunks = 1 + max(0, -(-(sequence_length - chunk_size) // chunk_step))
 
-            if chunk_end == len(summary.genomic_pos):
-                break
+        # pad the region once so the last chunk is a view like all others
+        padded_length = (total_chunks - 1) * chunk_step + chunk_size
+        padded_image = np.zeros((padded_length, ImageSizeOptions.IMAGE_HEIGHT), dtype=np.uint8)
+        padded_image[:sequence_length] = image
+        padded_positions = np.full((padded_length, 2), -1, dtype=np.int64)
+        padded_positions[:sequence_length] = genomic_positions
 
-            chunk_start = chunk_end - chunk_overlap
-            chunk_end = min(len(summary.genomic_pos), chunk_start + chunk_size)
+        images = AlignmentSummarizer.get_chunk_views(padded_image, total_chunks, chunk_step, chunk_size)
+        positions = AlignmentSummarizer.get_chunk_views(padded_positions, total_chunks, chunk_step, chunk_size)
+        labels = np.zeros((total_chunks, chunk_size), dtype=np.uint8)
+        chunk_ids = np.arange(total_chunks, dtype=np.int64)
 
-        return images, labels, positions, chunk_ids
+        return images, labels, positions[:, :, 0], positions[:, :, 1], chunk_ids
 
     @staticmethod
     def chunk_images_train(summary, chunk_size, chunk_overlap):
-        images = []
-        labels = []
-        positions = []
-        chunk_ids = []
-
         bad_indices = summary.bad_label_positions
         chunk_start = 0
-        chunk_id = 0
+        chunk_starts = []
 
         for i in range(len(bad_indices)):
             chunk_end = min(chunk_start + chunk_size, bad_indices[i])
@@ -78,17 +73,7 @@ class AlignmentSummarizer:
                     if i > 0 and chunk_start < bad_indices[i-1]:
                         break
 
-                image_chunk = summary.image[chunk_start:chunk_end]
-                pos_chunk = summary.genomic_pos[chunk_start:chunk_end]
-                label_chunk = summary.labels[chunk_start:chunk_end]
-
-                # assert (len(image_chunk) == len(pos_chunk) == len(label_chunk) == chunk_size)
-
-                images.append(image_chunk)
-                labels.append(label_chunk)
-                positions.append(pos_chunk)
-                chunk_ids.append(chunk_id)
-                chunk_id += 1
+                chunk_starts.append(chunk_start)
 
                 if chunk_end == bad_indices[i]:
                     break
@@ -98,9 +83,34 @@ class AlignmentSummarizer:
 
             chunk_start = chunk_end + 1
 
-        # assert(len(images) == len(labels) == len(positions) == len(chunk_ids))
+        # chunks do not cross bad labels so they are not evenly spaced, gather all of them with one index
+        chunk_rows = np.array(chunk_starts, dtype=np.int64).reshape(-1, 1) + np.arange(chunk_size)
+        genomic_positions = summary.get_genomic_positions()
+
+        images = summary.get_image()[chunk_rows]
+        labels = summary.get_labels()[chunk_rows]
+        positions = genomic_positions[chunk_rows, 0]
+        indices = genomic_positions[chunk_rows, 1]
+        chunk_ids = np.arange(len(chunk_starts), dtype=np.int64)
 
-        return images, labels, positions, chunk_ids
+        return images, labels, positions, indices, chunk_ids
+
+    @staticmethod
+    def concatenate_chunks(chunk_sets):
+        """
+        Concatenate the chunks of several summaries. A single set of chunks is returned as it is.
+        :param chunk_sets: List of (images, labels, positions, indices, chunk_ids) tuples
+        :return: Images, labels, positions, indices and chunk ids of all chunks
+        """
+        if not chunk_sets:
+            return np.empty((0, ImageSizeOptions.SEQ_LENGTH, ImageSizeOptions.IMAGE_HEIGHT), dtype=np.uint8), \
+                np.empty((0, ImageSizeOptions.SEQ_LENGTH), dtype=np.uint8), \
+                np.empty((0, ImageSizeOptions.SEQ_LENGTH), dtype=np.int64), \
+                np.empty((0, ImageSizeOptions.SEQ_LENGTH), dtype=np.int64), \
+                np.empty(0, dtype=np.int64)
+        if len(chunk_sets) == 1:
+            return chunk_sets[0]
+        return tuple(np.concatenate(arrays) for arrays in zip(*chunk_sets))
 
     @staticmethod
     def overlap_length_between_ranges(range_a, range_b):
@@ -113,10 +123,38 @@ class AlignmentSummarizer:
         else:
             return None
 
+    @staticmethod
+    def get_candidate_region_pairs(regions):
+        """
+        Return the index pairs (i, j), i < j, of regions that can overlap while conflicts are resolved, in the order
+        itertools.combinations visits them. Resolving a conflict only moves starts right and ends left without
+        inverting a region, so two regions can only overlap if their original closed intervals intersect. The
+        intersecting pairs are found by sweeping over the regions sorted by start.
+        :param regions: List of [start, end, read, is_kept] regions
+        :return: Sorted list of index pairs
+        """
+        if any(region[0] > region[1] for region in regions):
+            # inverted regions break the argument above, compare every pair
+            return list(itertools.combinations(range(len(regions)), 2))
+
+        candidate_pairs = []
+        active_regions = []
+        for i in sorted(range(len(regions)), key=lambda index: regions[index][0]):
+            # drop regions ending before this one starts
+            while active_regions and active_regions[0][0] < regions[i][0]:
+                heapq.heappop(active_regions)
+            for _, j in active_regions:
+                candidate_pairs.append((min(i, j), max(i, j)))
+            heapq.heappush(active_regions, (regions[i][1], i))
+
+        candidate_pairs.sort()
+        return candidate_pairs
+
     def remove_conflicting_regions(self, regions, min_length=ImageSizeOptions.MIN_SEQUENCE_LENGTH,
                                    length_ratio=2.0, overlap_fraction=0.5):
         # reused from medaka's filter_alignments method.
-        for reg_a, reg_b in itertools.combinations(regions, 2):
+        for i, j in self.get_candidate_region_pairs(regions):
+            reg_a, reg_b = regions[i], regions[j]
             el1, el2 = sorted((reg_a, reg_b), key=itemgetter(0))
             overlap = self.get_overlap_between_ranges(el1, el2)
 
@@ -179,10 +217,7 @@ class AlignmentSummarizer:
     def create_summary(self, truth_bam_handler, train_mode, downsample_rate, realignment_flag=True):
         log_prefix = "[" + self.chromosome_name + ":" + str(self.region_start_position) + "-" \
                      + str(self.region_end_position) + "]"
-        all_images = []
-        all_labels = []
-        all_positions = []
-        all_image_chunk_ids = []
+        chunk_sets = []
 
         if train_mode:
             # get the reads from the bam file
@@ -214,7 +249,7 @@ class AlignmentSummarizer:
             if not truth_regions:
                 # sys.stderr.write(TextColor.GREEN + "INFO: " + log_prefix + " NO TRAINING REGION FOUND.\n"
                 #                  + TextColor.END)
-                return [], [], [], []
+                return self.concatenate_chunks(chunk_sets)
 
             for region in truth_regions:
                 region_start, region_end, truth_read, is_kept = tuple(region)
@@ -284,14 +319,9 @@ class AlignmentSummarizer:
                                                          region_end,
                                                          truth_read)
 
-                images, labels, positions, chunk_ids = self.chunk_images_train(summary_generator,
-                                                                               chunk_size=ImageSizeOptions.SEQ_LENGTH,
-                                                                               chunk_overlap=ImageSizeOptions.SEQ_OVERLAP)
-
-                all_images.extend(images)
-                all_labels.extend(labels)
-                all_positions.extend(positions)
-                all_image_chunk_ids.extend(chunk_ids)
+                chunk_sets.append(self.chunk_images_train(summary_generator,
+                                                          chunk_size=ImageSizeOptions.SEQ_LENGTH,
+                                                          chunk_overlap=ImageSizeOptions.SEQ_OVERLAP))
         else:
             # HERE REALIGN THE READS TO THE REFERENCE THEN GENERATE THE SUMMARY TO GET A POLISHED HAPLOTYPE
             read_start = max(0, self.region_start_position)
@@ -306,7 +336,7 @@ class AlignmentSummarizer:
             total_reads = len(all_reads)
 
             if total_reads == 0:
-                return [], [], [], []
+                return self.concatenate_chunks(chunk_sets)
 
             if total_reads > AlingerOptions.MAX_READS_IN_REGION:
                 # https://github.com/google/nucleus/blob/master/nucleus/util/utils.py
@@ -347,16 +377,8 @@ class AlignmentSummarizer:
                                                self.region_start_position,
                                                self.region_end_position)
 
-            images, labels, positions, chunk_ids = \
-                self.chunk_images(summary_generator,
-                                  chunk_size=ImageSizeOptions.SEQ_LENGTH,
-                                  chunk_overlap=ImageSizeOptions.SEQ_OVERLAP)
-
-            all_images.extend(images)
-            all_labels.extend(labels)
-            all_positions.extend(positions)
-            all_image_chunk_ids.extend(chunk_ids)
-
-        # assert(len(all_images) == len(all_labels) == len(all_image_chunk_ids))
+            chunk_sets.append(self.chunk_images(summary_generator,
+                                                chunk_size=ImageSizeOptions.SEQ_LENGTH,
+                                                chunk_overlap=ImageSizeOptions.SEQ_OVERLAP))
 
-        return all_images, all_labels, all_positions, all_image_chunk_ids
+        return self.concatenate_chunks(chunk_sets)
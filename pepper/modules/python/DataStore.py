@@ -50,18 +50,39 @@ class DataStore(object):
         self._meta = self.meta
         self._meta.update(meta)
 
-    def write_summary(self, region, image, label, position, index, chunk_id, summary_name):
+    def write_summaries(self, region, images, labels, positions, indices, chunk_ids):
+        """
+        Write all image chunks of a region to one group. Images are stored in a dataset chunked by image, so a single
+        image can be read without reading the rest of the region.
+        :param region: Contig name, start and end of the region
+        :param images: Images of shape (chunks, SEQ_LENGTH, IMAGE_HEIGHT)
+        :param labels: Labels of every image
+        :param positions: Positions of every image
+        :param indices: Indices of every image
+        :param chunk_ids: Chunk id of every image
+        :return:
+        """
         contig_name, region_start, region_end = region
+        summary_name = str(contig_name) + "_" + str(region_start) + "_" + str(region_end)
         if 'summaries' not in self.meta:
             self.meta['summaries'] = set()
 
-        if summary_name not in self.meta['summaries']:
-            self.meta['summaries'].add(summary_name)
-            self.file_handler['{}/{}/{}'.format(self._summary_path_, summary_name, 'image')] = np.array(image, dtype=np.uint8)
-            self.file_handler['{}/{}/{}'.format(self._summary_path_, summary_name, 'label')] = np.array(label, dtype=np.uint8)
-            self.file_handler['{}/{}/{}'.format(self._summary_path_, summary_name, 'position')] = position
-            self.file_handler['{}/{}/{}'.format(self._summary_path_, summary_name, 'index')] = index
-            self.file_handler['{}/{}/{}'.format(self._summary_path_, summary_name, 'contig')] = contig_name
-            self.file_handler['{}/{}/{}'.format(self._summary_path_, summary_name, 'region_start')] = region_start
-            self.file_handler['{}/{}/{}'.format(self._summary_path_, summary_name, 'region_end')] = region_end
-            self.file_handler['{}/{}/{}'.format(self._summary_path_, summary_name, 'chunk_id')] = chunk_id
+        if summary_name in self.meta['summaries'] or len(chunk_ids) == 0:
+            return
+        self.meta['summaries'].add(summary_name)
+
+        # a chunk id is written once per region, later chunks with the same id are dropped
+        chunk_ids, unique_chunks = np.unique(chunk_ids, return_index=True)
+        if len(unique_chunks) == len(images):
+            unique_chunks = slice(None)
+
+        summary_group = self.file_handler.create_group('{}/{}'.format(self._summary_path_, summary_name))
+        images = np.asarray(images[unique_chunks], dtype=np.uint8)
+        summary_group.create_dataset('images', data=images, chunks=(1,) + images.shape[1:])
+        summary_group['labels'] = np.asarray(labels[unique_chunks], dtype=np.uint8)
+        summary_group['positions'] = np.asarray(positions[unique_chunks], dtype=np.int64)
+        summary_group['indices'] = np.asarray(indices[unique_chunks], dtype=np.int64)
+        summary_group['chunk_ids'] = chunk_ids
+        summary_group['contig'] = contig_name
+        summary_group['region_start'] = region_start
+        summary_group['region_end'] = region_end
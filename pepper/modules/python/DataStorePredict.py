@@ -1,6 +1,9 @@
 import h5py
+import json
 import yaml
 import numpy as np
+from collections import defaultdict
+from pepper.modules.python.Options import StitchOptions
 
 
 class DataStore(object):
@@ -16,12 +19,24 @@ class DataStore(object):
         self.file_handler = h5py.File(self.filename, self.mode)
 
         self._meta = None
+        # (contig, chunk name, contig start, contig end) of every chunk written to this file
+        self.chunk_index = []
 
     def __exit__(self, *args):
         if self.mode != 'r' and self._meta is not None:
             self._write_metadata(self.meta)
         self.file_handler.close()
 
+    def close(self):
+        """
+        Close the file and save the list of its chunks next to it, so stitching does not need to scan the file.
+        """
+        # the metadata is only kept in memory here, writing it would replace the predictions group
+        self.file_handler.close()
+        if self.mode != 'r':
+            with open(self.filename + StitchOptions.CHUNK_INDEX_SUFFIX, 'w') as chunk_index_file:
+                json.dump(self.chunk_index, chunk_index_file)
+
     def _write_metadata(self, data):
         """Save a data structure to file within a yml str."""
         for group, d in data.items():
@@ -46,33 +61,52 @@ class DataStore(object):
         self._meta = self.meta
         self._meta.update(meta)
 
-    def write_prediction(self, contig, contig_start, contig_end, chunk_id, position, index, predicted_bases, phred_score):
-        chunk_name_prefix = str(contig) + "-" + str(contig_start.item()) + "-" + str(contig_end.item())
-        chunk_name_suffix = str(chunk_id.item())
-
-        name = contig + chunk_name_prefix + chunk_name_suffix
+    def write_predictions(self, contigs, contig_starts, contig_ends, chunk_ids, positions, indices, predicted_bases,
+                          phred_scores):
+        """
+        Write the predictions of a batch of images. Images of the same chunk are written together as one group of
+        two dimensional datasets, named after the first chunk id of the group, with one row per image.
+        :param contigs: Contig name of each image
+        :param contig_starts: Start of the chunk of each image
+        :param contig_ends: End of the chunk of each image
+        :param chunk_ids: Chunk id of each image
+        :param positions: Positions of each image
+        :param indices: Indices of each image
+        :param predicted_bases: Predicted base labels of each image
+        :param phred_scores: Phred scores of each image
+        :return:
+        """
+        contig_starts = np.asarray(contig_starts).ravel()
+        contig_ends = np.asarray(contig_ends).ravel()
+        chunk_ids = np.asarray(chunk_ids).ravel()
 
         if 'predictions' not in self.meta:
             self.meta['predictions'] = set()
         if 'predictions_contig' not in self.meta:
             self.meta['predictions_contig'] = set()
 
-        if chunk_name_prefix not in self.meta['predictions_contig']:
-            self.meta['predictions_contig'].add(chunk_name_prefix)
-            self.file_handler['{}/{}/{}/{}'.format(self._prediction_path_, contig, chunk_name_prefix, 'contig_start')] \
-                = contig_start.item()
-            self.file_handler['{}/{}/{}/{}'.format(self._prediction_path_, contig, chunk_name_prefix, 'contig_end')] \
-                = contig_end.item()
-
-        if name not in self.meta['predictions']:
-            self.meta['predictions'].add(name)
-            self.file_handler['{}/{}/{}/{}/{}'.format(self._prediction_path_, contig, chunk_name_prefix,
-                                                      chunk_name_suffix, 'position')] = position
-            self.file_handler['{}/{}/{}/{}/{}'.format(self._prediction_path_, contig, chunk_name_prefix,
-                                                      chunk_name_suffix, 'index')] = index
-            self.file_handler['{}/{}/{}/{}/{}'.format(self._prediction_path_, contig, chunk_name_prefix,
-                                                      chunk_name_suffix, 'bases')] = predicted_bases.astype(np.uint8)
-            self.file_handler['{}/{}/{}/{}/{}'.format(self._prediction_path_, contig, chunk_name_prefix,
-                                                      chunk_name_suffix, 'phred_score')] = phred_score.astype(np.uint8)
-
-
+        chunk_images = defaultdict(list)
+        for i in range(len(contigs)):
+            chunk_name_prefix = str(contigs[i]) + "-" + str(contig_starts[i]) + "-" + str(contig_ends[i])
+            name = str(contigs[i]) + chunk_name_prefix + str(chunk_ids[i])
+            if name not in self.meta['predictions']:
+                self.meta['predictions'].add(name)
+                chunk_images[(str(contigs[i]), chunk_name_prefix, int(contig_starts[i]), int(contig_ends[i]))].append(i)
+
+        for (contig, chunk_name_prefix, contig_start, contig_end), image_ids in chunk_images.items():
+            if chunk_name_prefix not in self.meta['predictions_contig']:
+                self.meta['predictions_contig'].add(chunk_name_prefix)
+                self.file_handler['{}/{}/{}/{}'.format(self._prediction_path_, contig, chunk_name_prefix, 'contig_start')] \
+                    = contig_start
+                self.file_handler['{}/{}/{}/{}'.format(self._prediction_path_, contig, chunk_name_prefix, 'contig_end')] \
+                    = contig_end
+                self.chunk_index.append((contig, chunk_name_prefix, contig_start, contig_end))
+
+            image_ids = sorted(image_ids, key=lambda image_id: chunk_ids[image_id])
+            chunk_group = self.file_handler.create_group('{}/{}/{}/{}'.format(self._prediction_path_, contig, chunk_name_prefix,
+                                                                              str(chunk_ids[image_ids[0]])))
+            chunk_group['chunk_id'] = chunk_ids[image_ids]
+            chunk_group['position'] = np.asarray(positions)[image_ids]
+            chunk_group['index'] = np.asarray(indices)[image_ids]
+            chunk_group['bases'] = np.asarray(predicted_bases)[image_ids].astype(np.uint8)
+            chunk_group['phred_score'] = np.asarray(phred_scores)[image_ids].astype(np.uint8)
@@ -53,11 +53,11 @@ class UserInterfaceView:
                                                    start_position,
                                                    end_position)
 
-        images, lables, positions, image_chunk_ids = alignment_summarizer.create_summary(self.truth_bam_handler,
-                                                                                         self.train_mode,
-                                                                                         downsample_rate)
+        images, labels, positions, indices, image_chunk_ids = alignment_summarizer.create_summary(self.truth_bam_handler,
+                                                                                                  self.train_mode,
+                                                                                                  downsample_rate)
 
-        return images, lables, positions, image_chunk_ids
+        return images, labels, positions, indices, image_chunk_ids
 
 
 class UserInterfaceSupport:
@@ -184,10 +184,10 @@ class UserInterfaceSupport:
                                  truth_bam=truth_bam,
                                  train_mode=train_mode)
 
-        images, labels, positions, image_chunk_ids = view.parse_region(_start, _end, downsample_rate)
+        images, labels, positions, indices, image_chunk_ids = view.parse_region(_start, _end, downsample_rate)
         region = (chr_name, _start, _end)
 
-        return images, labels, positions, image_chunk_ids, region
+        return images, labels, positions, indices, image_chunk_ids, region
 
     @staticmethod
     def image_generator(args, all_intervals, total_threads, thread_id):
@@ -210,16 +210,9 @@ class UserInterfaceSupport:
             for counter, interval in enumerate(intervals):
                 chr_name, _start, _end = interval
                 img_args = (chr_name, bam_file, draft_file, truth_bam, train_mode, downsample_rate)
-                images, labels, positions, chunk_ids, region = UserInterfaceSupport.single_worker(img_args, _start, _end)
+                images, labels, positions, indices, chunk_ids, region = UserInterfaceSupport.single_worker(img_args, _start, _end)
 
-                for i, image in enumerate(images):
-                    label = labels[i]
-                    position, index = zip(*positions[i])
-                    chunk_id = chunk_ids[i]
-
-                    summary_name = str(region[0]) + "_" + str(region[1]) + "_" + str(region[2]) + "_" + str(chunk_id)
-
-                    output_hdf_file.write_summary(region, image, label, position, index, chunk_id, summary_name)
+                output_hdf_file.write_summaries(region, images, labels, positions, indices, chunk_ids)
 
                 if counter > 0 and counter % 10 == 0 and thread_id == 0:
                     percent_complete = int((100 * counter) / len(intervals))
@@ -279,6 +272,7 @@ class UserInterfaceSupport:
         sys.stderr.flush()
 
         args = (output_path, bam_file, draft_file, truth_bam, train_mode, downsample_rate)
+        failed_threads = 0
         with concurrent.futures.ProcessPoolExecutor(max_workers=total_threads) as executor:
             futures = [executor.submit(UserInterfaceSupport.image_generator, args, all_intervals, total_threads, thread_id)
                        for thread_id in range(0, total_threads)]
@@ -291,6 +285,7 @@ class UserInterfaceSupport:
                         sys.stderr.write("[" + datetime.now().strftime('%m-%d-%Y %H:%M:%S') + "] "
                                          + "INFO: THREAD " + str(thread_id) + " FINISHED SUCCESSFULLY.\n")
                 else:
+                    failed_threads += 1
                     sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] ERROR: " + str(fut.exception()) + "\n")
                 fut._result = None  # python issue 27144
 
@@ -299,3 +294,6 @@ class UserInterfaceSupport:
         secs = int((end_time - start_time)) % 60
         sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: FINISHED IMAGE GENERATION\n")
         sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: ELAPSED TIME: " + str(mins) + " Min " + str(secs) + " Sec\n")
+
+        # images of the failed threads are missing, callers must not treat the output as complete
+        return failed_threads == 0
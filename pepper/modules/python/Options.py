@@ -28,3 +28,17 @@ class AlingerOptions(object):
     MAX_READS_IN_REGION = 1500
     RANDOM_SEED = 2719747673
 
+
+class StitchOptions(object):
+    # every prediction file lists the chunks it holds in a file with this suffix
+    CHUNK_INDEX_SUFFIX = ".chunks.json"
+    # contig to chunk index of all prediction files, written by call_consensus
+    PREDICTION_INDEX_NAME = "pepper_prediction_index.json"
+
+
+class PolishOptions(object):
+    # fixed stage directories so a polish run can be resumed in the same output directory
+    IMAGE_DIRECTORY = "images/"
+    PREDICTION_DIRECTORY = "predictions/"
+    # every completed stage writes a marker named after the stage with this suffix
+    STAGE_MARKER_SUFFIX = ".complete.json"
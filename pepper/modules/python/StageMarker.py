@@ -0,0 +1,98 @@
+import os
+import json
+import shutil
+from pepper.modules.python.Options import PolishOptions
+
+
+def get_file_fingerprints(paths):
+    """
+    Return the size and modification time of files. Directories are expanded to the files they hold.
+    :param paths: List of file or directory paths
+    :return: Dictionary of absolute file path to [size, modification time in ns]
+    """
+    fingerprints = {}
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            file_paths = sorted(os.path.join(path, file) for file in os.listdir(path) if os.path.isfile(os.path.join(path, file)))
+        elif os.path.isfile(path):
+            file_paths = [path]
+        else:
+            file_paths = []
+
+        for file_path in file_paths:
+            file_stat = os.stat(file_path)
+            fingerprints[file_path] = [file_stat.st_size, file_stat.st_mtime_ns]
+    return fingerprints
+
+
+def get_stage_marker_path(output_dir, stage):
+    return os.path.join(output_dir, stage + PolishOptions.STAGE_MARKER_SUFFIX)
+
+
+def is_stage_complete(output_dir, stage, inputs, parameters):
+    """
+    Check if a stage completed with the same inputs and parameters and its outputs are unchanged since.
+    :param output_dir: Directory holding the stage markers
+    :param stage: Name of the stage
+    :param inputs: Input files and directories of the stage
+    :param parameters: Dictionary of parameters that change the output of the stage
+    :return: True if the stage can be skipped
+    """
+    marker_path = get_stage_marker_path(output_dir, stage)
+    if not os.path.isfile(marker_path):
+        return False
+
+    try:
+        with open(marker_path, 'r') as marker_file:
+            marker = json.load(marker_file)
+    except ValueError:
+        return False
+
+    if marker.get('inputs') != get_file_fingerprints(inputs) or marker.get('parameters') != parameters:
+        return False
+
+    # the outputs are checked file by file, a missing or modified output invalidates the stage
+    output_fingerprints = marker.get('outputs', {})
+    return len(output_fingerprints) > 0 and get_file_fingerprints(output_fingerprints.keys()) == output_fingerprints
+
+
+def write_stage_marker(output_dir, stage, inputs, parameters, outputs):
+    """
+    Record a completed stage. The marker is written to a temporary file and moved in place so an interrupted write
+    never leaves a valid marker behind.
+    :param output_dir: Directory holding the stage markers
+    :param stage: Name of the stage
+    :param inputs: Input files and directories of the stage
+    :param parameters: Dictionary of parameters that change the output of the stage
+    :param outputs: Output files and directories of the stage
+    :return:
+    """
+    marker = {'stage': stage,
+              'inputs': get_file_fingerprints(inputs),
+              'parameters': parameters,
+              'outputs': get_file_fingerprints(outputs)}
+
+    marker_path = get_stage_marker_path(output_dir, stage)
+    temporary_path = marker_path + ".tmp." + str(os.getpid())
+    with open(temporary_path, 'w') as marker_file:
+        json.dump(marker, marker_file, indent=4)
+    os.replace(temporary_path, marker_path)
+
+
+def reset_stage(output_dir, stage, output_directory=None):
+    """
+    Remove the marker of a stage and the partial outputs a failed run may have left in its output directory.
+    :param output_dir: Directory holding the stage markers
+    :param stage: Name of the stage
+    :param output_directory: Output directory owned by the stage, None if the stage writes single files
+    :return:
+    """
+    marker_path = get_stage_marker_path(output_dir, stage)
+    if os.path.isfile(marker_path):
+        os.remove(marker_path)
+    if output_directory is None:
+        return
+    if os.path.isdir(output_directory):
+        shutil.rmtree(output_directory)
+    os.makedirs(output_directory)
@@ -1,17 +1,12 @@
 import h5py
-import sys
 from os.path import isfile, join
 from os import listdir
-import concurrent.futures
 import numpy as np
-from collections import defaultdict
-import operator
 from pepper.modules.python.Options import ImageSizeOptions
-from datetime import datetime
 
 
-label_decoder = {1: 'A', 2: 'C', 3: 'G', 4: 'T', 0: ''}
-MIN_SEQUENCE_REQUIRED_FOR_MULTITHREADING = 2
+# ASCII code of each base label, indexed by label
+BASE_CHARACTERS = np.frombuffer(b'-ACGT', dtype=np.uint8)
 
 
 def get_file_paths_from_directory(directory_path):
@@ -33,96 +28,125 @@ def chunks(file_names, threads):
     return chunks
 
 
-def small_chunk_stitch(contig, small_chunk_keys):
-    # for chunk_key in small_chunk_keys:
-    base_prediction_dictionary = defaultdict()
-    # phred_score_dictionary = defaultdict()
-    all_positions = set()
+def read_chunk_predictions(hdf5_file, contig, chunk_name, chunk_start):
+    """
+    Read the base predictions of a chunk ordered by chunk id. Prediction groups hold one image per row and list the
+    chunk id of every row, groups of files written one image at a time are named after their chunk id.
+    :param hdf5_file: Open prediction file
+    :param contig: Contig name
+    :param chunk_name: Name of the chunk
+    :param chunk_start: Start position of the chunk
+    :return: Positions, indices and predicted bases of the chunk
+    """
     # ignore first 2 * MIN_IMAGE_OVERLAP bases as they are just overlaps
     buffer_positions = ImageSizeOptions.MIN_IMAGE_OVERLAP * 2
+    chunk_group = hdf5_file['predictions'][contig][chunk_name]
+    smaller_chunks = sorted(set(chunk_group.keys()) - {'contig_start', 'contig_end'})
 
-    for file_name, contig_name, _st, _end in small_chunk_keys:
-        chunk_name = contig_name + '-' + str(_st) + '-' + str(_end)
-
-        with h5py.File(file_name, 'r') as hdf5_file:
-            smaller_chunks = set(hdf5_file['predictions'][contig][chunk_name].keys()) - {'contig_start', 'contig_end'}
-
-        smaller_chunks = sorted(smaller_chunks)
-
-        for i, chunk in enumerate(smaller_chunks):
-            with h5py.File(file_name, 'r') as hdf5_file:
-                bases = hdf5_file['predictions'][contig][chunk_name][chunk]['bases'][()]
-                # phred_score = hdf5_file['predictions'][contig][chunk_name][chunk]['phred_score'][()]
-                positions = hdf5_file['predictions'][contig][chunk_name][chunk]['position'][()]
-                indices = hdf5_file['predictions'][contig][chunk_name][chunk]['index'][()]
-
-            positions = np.array(positions, dtype=np.int64)
-            base_predictions = np.array(bases, dtype=np.int)
-            # if _st == 107900:
-            #     print(positions)
-
-            for pos, indx, base_pred in zip(positions, indices, base_predictions):
-                # not take the first buffer bases for every chunk that has an overlap to the last chunk
-                if _st > 0 and pos <= _st + buffer_positions:
-                    continue
-
-                if indx < 0 or pos < 0:
-                    continue
+    if not smaller_chunks:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)
 
-                base_prediction_dictionary[(pos, indx)] = base_pred
-                # phred_score_dictionary[(pos, indx)] = base_score + 33
-                all_positions.add((pos, indx))
+    all_chunk_ids, all_positions, all_indices, all_bases = [], [], [], []
+    for chunk in smaller_chunks:
+        if 'chunk_id' in chunk_group[chunk]:
+            chunk_ids = np.array(chunk_group[chunk]['chunk_id'][()], dtype=np.int64).ravel()
+        else:
+            chunk_ids = np.array([int(chunk)], dtype=np.int64)
+        all_chunk_ids.append(chunk_ids)
+        all_positions.append(np.array(chunk_group[chunk]['position'][()], dtype=np.int64).reshape(len(chunk_ids), -1))
+        all_indices.append(np.array(chunk_group[chunk]['index'][()], dtype=np.int64).reshape(len(chunk_ids), -1))
+        all_bases.append(np.array(chunk_group[chunk]['bases'][()], dtype=np.uint8).reshape(len(chunk_ids), -1))
 
-    if len(all_positions) == 0:
-        return -1, -1, ''
+    image_order = np.argsort(np.concatenate(all_chunk_ids), kind='stable')
+    positions = np.concatenate(all_positions)[image_order].ravel()
+    indices = np.concatenate(all_indices)[image_order].ravel()
+    bases = np.concatenate(all_bases)[image_order].ravel()
 
-    pos_list = sorted(list(all_positions), key=lambda element: (element[0], element[1]))
-    dict_fetch = operator.itemgetter(*pos_list)
+    valid_predictions = (indices >= 0) & (positions >= 0)
+    # not take the first buffer bases for every chunk that has an overlap to the last chunk
+    if chunk_start > 0:
+        valid_predictions &= positions > chunk_start + buffer_positions
 
-    # weird but python has no casting between np.int64 to list
-    if len(pos_list) > 1:
-        predicted_base_labels = list(dict_fetch(base_prediction_dictionary))
-        # predicted_phred_scores = list(dict_fetch(phred_score_dictionary))
-    else:
-        predicted_base_labels = [dict_fetch(base_prediction_dictionary)]
-        # predicted_phred_scores = [dict_fetch(phred_score_dictionary)]
+    return positions[valid_predictions], indices[valid_predictions], bases[valid_predictions]
 
-    sequence = ''.join([label_decoder[base] for base in predicted_base_labels])
-    # phred_score = ''.join([chr(phred_score) for base, phred_score in zip(predicted_base_labels, predicted_phred_scores) if base != 0])
-    first_pos = pos_list[0][0]
-    last_pos = pos_list[-1][0]
-    return first_pos, last_pos, sequence
 
+def resolve_overlaps(positions, indices, bases):
+    """
+    Sort predictions by position and index. When a position and index is predicted more than once the prediction
+    that comes last in the input wins.
+    :param positions: Positions of the predictions
+    :param indices: Indices of the predictions
+    :param bases: Predicted bases
+    :return: Sorted positions, indices and bases with one prediction per position and index
+    """
+    order = np.lexsort((np.arange(len(positions)), indices, positions))
+    positions, indices, bases = positions[order], indices[order], bases[order]
 
-def create_consensus_sequence(contig, sequence_chunk_keys, threads):
-    sequence_chunk_keys = sorted(sequence_chunk_keys, key=lambda element: (element[1]))
-
-    sequence_chunk_key_list = list()
-    for file_name, sequence_chunk_key, contig_start, contig_end in sequence_chunk_keys:
-        sequence_chunk_key_list.append((file_name, contig, int(contig_start), int(contig_end)))
+    last_prediction = np.ones(len(positions), dtype=bool)
+    last_prediction[:-1] = (positions[1:] != positions[:-1]) | (indices[1:] != indices[:-1])
+    return positions[last_prediction], indices[last_prediction], bases[last_prediction]
 
-    sequence_chunk_key_list = sorted(sequence_chunk_key_list, key=lambda element: (element[2], element[3]))
 
-    sequence_chunks = list()
+def decode_bases(bases):
+    # label 0 is a gap and does not produce a base
+    return BASE_CHARACTERS[bases[bases != 0]].tobytes().decode('ascii')
 
-    # generate the dictionary in parallel
-    with concurrent.futures.ProcessPoolExecutor(max_workers=threads) as executor:
-        file_chunks = chunks(sequence_chunk_key_list, max(MIN_SEQUENCE_REQUIRED_FOR_MULTITHREADING,
-                                                          int(len(sequence_chunk_key_list) / threads) + 1))
 
-        futures = [executor.submit(small_chunk_stitch, contig, chunk) for chunk in file_chunks]
-        for fut in concurrent.futures.as_completed(futures):
-            if fut.exception() is None:
-                first_pos, last_pos, sequence = fut.result()
-                if first_pos != -1 and last_pos != -1:
-                    sequence_chunks.append((first_pos, last_pos, sequence))
+def stitch_contig(contig, sequence_chunk_keys, consensus_fasta_file):
+    """
+    Stitch the predictions of a contig and stream the polished sequence to a FASTA file. Chunks are read once in
+    position order and overlaps are resolved incrementally, so only the predictions that a later chunk can still
+    overwrite are kept in memory.
+    :param contig: Contig name
+    :param sequence_chunk_keys: List of (file name, chunk name, contig start, contig end) chunks of the contig
+    :param consensus_fasta_file: Open FASTA file the polished sequence is written to
+    :return: Length of the polished sequence
+    """
+    buffer_positions = ImageSizeOptions.MIN_IMAGE_OVERLAP * 2
+    sequence_chunk_keys = sorted([(file_name, chunk_name, int(contig_start), int(contig_end))
+                                  for file_name, chunk_name, contig_start, contig_end in sequence_chunk_keys],
+                                 key=lambda element: (element[2], element[3]))
+
+    pending_positions = np.empty(0, dtype=np.int64)
+    pending_indices = np.empty(0, dtype=np.int64)
+    pending_bases = np.empty(0, dtype=np.uint8)
+    sequence_length = 0
+    hdf5_files = dict()
+    try:
+        for i, (file_name, chunk_name, contig_start, contig_end) in enumerate(sequence_chunk_keys):
+            if file_name not in hdf5_files:
+                hdf5_files[file_name] = h5py.File(file_name, 'r')
+
+            positions, indices, bases = read_chunk_predictions(hdf5_files[file_name], contig, chunk_name, contig_start)
+            pending_positions, pending_indices, pending_bases = \
+                resolve_overlaps(np.concatenate([pending_positions, positions]),
+                                 np.concatenate([pending_indices, indices]),
+                                 np.concatenate([pending_bases, bases]))
+
+            # a later chunk only predicts positions after its start plus the overlap buffer, the rest is final
+            if i + 1 < len(sequence_chunk_keys):
+                next_chunk_start = sequence_chunk_keys[i + 1][2]
+                if next_chunk_start <= 0:
+                    continue
+                final_predictions = np.searchsorted(pending_positions, next_chunk_start + buffer_positions, side='right')
             else:
-                sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "]  ERROR: " + str(fut.exception()) + "\n")
-            fut._result = None  # python issue 27144
-
-    sequence_chunks = sorted(sequence_chunks, key=lambda element: (element[0], element[1]))
-    stitched_sequence = ''
-    for first_pos, last_pos, sequence in sequence_chunks:
-        stitched_sequence = stitched_sequence + sequence
-
-    return stitched_sequence
+                final_predictions = len(pending_positions)
+
+            sequence = decode_bases(pending_bases[:final_predictions])
+            if len(sequence) > 0:
+                if sequence_length == 0:
+                    consensus_fasta_file.write('>' + contig + "\n")
+                consensus_fasta_file.write(sequence)
+                sequence_length += len(sequence)
+
+            pending_positions = pending_positions[final_predictions:]
+            pending_indices = pending_indices[final_predictions:]
+            pending_bases = pending_bases[final_predictions:]
+    finally:
+        for hdf5_file in hdf5_files.values():
+            hdf5_file.close()
+
+    if sequence_length > 0:
+        consensus_fasta_file.write("\n")
+
+    return sequence_length
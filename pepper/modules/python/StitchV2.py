@@ -7,8 +7,6 @@ import numpy as np
 from collections import defaultdict
 import operator
 from pepper.build import PEPPER
-from datetime import datetime
-import re
 
 
 BASE_ERROR_RATE = 0.0
@@ -18,6 +16,8 @@ MISMATCH_PENALTY = 6
 GAP_PENALTY = 8
 GAP_EXTEND_PENALTY = 2
 MIN_SEQUENCE_REQUIRED_FOR_MULTITHREADING = 2
+# shortest aligned block two overlapping chunks are joined at
+MIN_CONFIDENT_MATCH_LENGTH = 5
 
 
 def get_file_paths_from_directory(directory_path):
@@ -39,157 +39,106 @@ def chunks(file_names, threads):
     return chunks
 
 
-def chunks_alignment_sequence(alignment_sequence_pairs, min_length):
-    """Yield successive n-sized chunks from l."""
-    chunks = []
-    for i in range(0, len(alignment_sequence_pairs), min_length):
-        chunks.append(alignment_sequence_pairs[i:i + min_length])
-    return chunks
+def get_overlap_bases(running_end, this_start):
+    overlap_bases = running_end - this_start
+    return overlap_bases + int(overlap_bases * BASE_ERROR_RATE)
 
 
-def get_confident_positions(alignment):
-    cigar_string = alignment.cigar_string.replace('=', 'M').replace('X', 'M')
+def get_overlap_aligner():
+    return PEPPER.OverlapAligner(MATCH_PENALTY, MISMATCH_PENALTY, GAP_PENALTY, GAP_EXTEND_PENALTY, MIN_CONFIDENT_MATCH_LENGTH)
 
-    cigar_tuples = re.findall(r'(\d+)(\w)', cigar_string)
 
-    grouped_tuples = list()
-    prev_len = 0
-    prev_op = None
-    # group the matches together
-    for cigar_len, cigar_op in cigar_tuples:
-        if prev_op is None:
-            prev_op = cigar_op
-            prev_len = int(cigar_len)
-        elif prev_op == cigar_op:
-            # simply extend the operation
-            prev_len += int(cigar_len)
-        else:
-            grouped_tuples.append((prev_op, prev_len))
-            prev_op = cigar_op
-            prev_len = int(cigar_len)
-    if prev_op is not None:
-        grouped_tuples.append((prev_op, prev_len))
-
-    ref_index = alignment.reference_begin
-    read_index = 0
-
-    for cigar_op, cigar_len in grouped_tuples:
-        if cigar_op == 'M' and cigar_len >= 5:
-            return ref_index, read_index
-
-        if cigar_op == 'S':
-            read_index += cigar_len
-        elif cigar_op == 'I':
-            read_index += cigar_len
-        elif cigar_op == 'D':
-            ref_index += cigar_len
-        elif cigar_op == 'M':
-            ref_index += cigar_len
-            read_index += cigar_len
-        else:
-            raise ValueError("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "]  ERROR: INVALID CIGAR OPERATION ENCOUNTERED WHILTE STITCHING: "
-                             + str(cigar_op) + "\n")
+def align_chunk_overlaps(sequence_chunks, overlap_aligner):
+    """
+    Align the overlapping ends of consecutive chunks. Every alignment only depends on the two chunks it joins, so
+    batches of chunks can be aligned independently.
+    :param sequence_chunks: List of (contig, start, end, sequence) sorted by start and end
+    :param overlap_aligner: PEPPER.OverlapAligner
+    :return: Dictionary of chunk index to (position in the overlap of the previous chunk, position in this chunk)
+    """
+    overlap_indices = []
+    overlaps = []
+    for i in range(1, len(sequence_chunks)):
+        _, _, previous_end, previous_sequence = sequence_chunks[i - 1]
+        _, this_start, _, this_sequence = sequence_chunks[i]
+        if this_start < previous_end:
+            overlap_bases = get_overlap_bases(previous_end, this_start)
+            overlap_indices.append(i)
+            overlaps.append((previous_sequence[-overlap_bases:], this_sequence[:overlap_bases]))
 
-    return -1, -1
+    return dict(zip(overlap_indices, overlap_aligner.align_overlaps(overlaps)))
 
 
-def alignment_stitch(sequence_chunks):
-    sequence_chunks = sorted(sequence_chunks, key=lambda element: (element[1], element[2]))
+def join_chunk_sequences(sequence_chunks, join_positions, overlap_aligner):
+    """
+    Join chunks in one linear pass using precomputed overlap alignments. An alignment is reused if the stitched
+    sequence still ends with the whole overlap of the previous chunk, otherwise the overlap is aligned again against
+    the stitched sequence so the result matches stitching chunk by chunk.
+    :param sequence_chunks: List of (contig, start, end, sequence) sorted by start and end
+    :param join_positions: Dictionary of chunk index to join positions from align_chunk_overlaps
+    :param overlap_aligner: PEPPER.OverlapAligner
+    :return: Contig, start, end and sequence of the joined chunks
+    """
     contig, running_start, running_end, running_sequence = sequence_chunks[0]
-    # if len(running_sequence) < 500:
-    #     sys.stderr.write("ERROR: CURRENT SEQUENCE LENGTH TOO SHORT: " + sequence_chunk_keys[0] + "\n")
-    #     exit()
+    sequence_parts = [running_sequence]
 
-    aligner = PEPPER.Aligner(MATCH_PENALTY, MISMATCH_PENALTY, GAP_PENALTY, GAP_EXTEND_PENALTY)
-    filter = PEPPER.Filter()
     for i in range(1, len(sequence_chunks)):
         _, this_start, this_end, this_sequence = sequence_chunks[i]
         if this_start < running_end:
             # overlap
-            overlap_bases = running_end - this_start
-            overlap_bases = overlap_bases + int(overlap_bases * BASE_ERROR_RATE)
-
-            reference_sequence = running_sequence[-overlap_bases:]
-            read_sequence = this_sequence[:overlap_bases]
-
-            alignment = PEPPER.Alignment()
-            aligner.SetReferenceSequence(reference_sequence, len(reference_sequence))
-            aligner.Align_cpp(read_sequence, filter, alignment, 0)
+            overlap_bases = get_overlap_bases(running_end, this_start)
 
-            if alignment.best_score == 0:
-                # we are going to say that the left sequence is right
-                left_sequence = running_sequence
-
-                # we are going to  say right sequence is also right
-                right_sequence = this_sequence
-
-                # but there are 10 'N's as overlaps
-                overlap_sequence = 10 * 'N'
-                # now append all three parts and we have a contiguous sequence
-                running_sequence = left_sequence + overlap_sequence + right_sequence
-                running_end = this_end
+            if len(sequence_parts[-1]) >= overlap_bases:
+                reference_sequence = sequence_parts[-1][-overlap_bases:]
+                pos_a, pos_b = join_positions[i]
             else:
-                pos_a, pos_b = get_confident_positions(alignment)
-
-                if pos_a == -1 or pos_b == -1:
-                    # we are going to say that the left sequence is right
-                    left_sequence = running_sequence
-
-                    # we are going to  say right sequence is also right
-                    right_sequence = this_sequence
-
-                    # but there are 10 'N's as overlaps
-                    overlap_sequence = 10 * 'N'
-
-                    # now append all three parts and we have a contiguous sequence
-                    running_sequence = left_sequence + overlap_sequence + right_sequence
-                    running_end = this_end
-                else:
-                    # this is a perfect match so we can simply stitch them
-                    # take all of the sequence from the left
-                    left_sequence = running_sequence[:-overlap_bases]
-                    # get the bases that overlapped
-                    overlap_sequence = reference_sequence[:pos_a]
-                    # get sequences from current sequence
-                    right_sequence = this_sequence[pos_b:]
-
-                    # now append all three parts and we have a contiguous sequence
-                    running_sequence = left_sequence + overlap_sequence + right_sequence
-                    running_end = this_end
+                # the overlap reaches past the previous chunk, align against the stitched sequence
+                sequence_parts = [''.join(sequence_parts)]
+                reference_sequence = sequence_parts[-1][-overlap_bases:]
+                pos_a, pos_b = overlap_aligner.align_overlaps([(reference_sequence, this_sequence[:overlap_bases])])[0]
+
+            if pos_a == -1 or pos_b == -1:
+                # no confident match, keep both sequences and mark the overlap with 10 'N's
+                sequence_parts.append(10 * 'N')
+                sequence_parts.append(this_sequence)
+            else:
+                # take all of the sequence from the left, the bases that overlapped and the rest of this sequence
+                sequence_parts[-1] = sequence_parts[-1][:-overlap_bases]
+                sequence_parts.append(reference_sequence[:pos_a])
+                sequence_parts.append(this_sequence[pos_b:])
         else:
             # this means there was a gap before this chunk, which could be low read coverage in a small contig.
-            running_sequence = running_sequence + this_sequence
-            running_end = this_end
-
-    return contig, running_start, running_end, running_sequence
+            sequence_parts.append(this_sequence)
+        running_end = this_end
 
+    return contig, running_start, running_end, ''.join(sequence_parts)
 
-def small_chunk_stitch(contig, small_chunk_keys):
-    # for chunk_key in small_chunk_keys:
-    name_sequence_tuples = list()
 
-    for file_name, contig_name, _st, _end in small_chunk_keys:
-        chunk_name = contig_name + '-' + str(_st) + '-' + str(_end)
+def alignment_stitch(sequence_chunks):
+    sequence_chunks = sorted(sequence_chunks, key=lambda element: (element[1], element[2]))
+    overlap_aligner = get_overlap_aligner()
+    join_positions = align_chunk_overlaps(sequence_chunks, overlap_aligner)
+    return join_chunk_sequences(sequence_chunks, join_positions, overlap_aligner)
 
-        with h5py.File(file_name, 'r') as hdf5_file:
-            contig_start = hdf5_file['predictions'][contig][chunk_name]['contig_start'][()]
-            contig_end = hdf5_file['predictions'][contig][chunk_name]['contig_end'][()]
 
-        with h5py.File(file_name, 'r') as hdf5_file:
-            smaller_chunks = set(hdf5_file['predictions'][contig][chunk_name].keys()) - {'contig_start', 'contig_end'}
+def get_chunk_sequence(file_name, contig, chunk_name):
+    with h5py.File(file_name, 'r') as hdf5_file:
+        chunk_group = hdf5_file['predictions'][contig][chunk_name]
+        contig_start = chunk_group['contig_start'][()]
+        contig_end = chunk_group['contig_end'][()]
+        smaller_chunks = sorted(set(chunk_group.keys()) - {'contig_start', 'contig_end'})
 
-        smaller_chunks = sorted(smaller_chunks)
         all_positions = set()
         base_prediction_dict = defaultdict()
-
         for chunk in smaller_chunks:
-            with h5py.File(file_name, 'r') as hdf5_file:
-                bases = hdf5_file['predictions'][contig][chunk_name][chunk]['bases'][()]
-                positions = hdf5_file['predictions'][contig][chunk_name][chunk]['position'][()]
-                indices = hdf5_file['predictions'][contig][chunk_name][chunk]['index'][()]
+            bases = chunk_group[chunk]['bases'][()]
+            positions = chunk_group[chunk]['position'][()]
+            indices = chunk_group[chunk]['index'][()]
 
-            positions = np.array(positions, dtype=np.int64)
-            base_predictions = np.array(bases, dtype=np.int)
+            # groups can hold several images, one per row
+            positions = np.array(positions, dtype=np.int64).ravel()
+            indices = np.array(indices).ravel()
+            base_predictions = np.array(bases, dtype=np.int).ravel()
 
             for pos, indx, base_pred in zip(positions, indices, base_predictions):
                 if indx < 0 or pos < 0:
@@ -198,15 +147,28 @@ def small_chunk_stitch(contig, small_chunk_keys):
                     base_prediction_dict[(pos, indx)] = base_pred
                     all_positions.add((pos, indx))
 
-        pos_list = sorted(list(all_positions), key=lambda element: (element[0], element[1]))
-        dict_fetch = operator.itemgetter(*pos_list)
-        predicted_base_labels = list(dict_fetch(base_prediction_dict))
-        sequence = ''.join([label_decoder[base] for base in predicted_base_labels])
-        name_sequence_tuples.append((contig, contig_start, contig_end, sequence))
+    pos_list = sorted(list(all_positions), key=lambda element: (element[0], element[1]))
+    dict_fetch = operator.itemgetter(*pos_list)
+    predicted_base_labels = list(dict_fetch(base_prediction_dict))
+    sequence = ''.join([label_decoder[base] for base in predicted_base_labels])
+    return contig, contig_start, contig_end, sequence
+
+
+def small_chunk_stitch(contig, small_chunk_keys):
+    """
+    Read the sequences of a batch of consecutive chunks and align the overlaps between them.
+    :param contig: Contig name
+    :param small_chunk_keys: List of (file name, contig, start, end) sorted by start and end
+    :return: Sequence chunks of the batch and the join positions of the overlaps inside the batch
+    """
+    name_sequence_tuples = list()
+    for file_name, contig_name, _st, _end in small_chunk_keys:
+        chunk_name = contig_name + '-' + str(_st) + '-' + str(_end)
+        name_sequence_tuples.append(get_chunk_sequence(file_name, contig, chunk_name))
 
     name_sequence_tuples = sorted(name_sequence_tuples, key=lambda element: (element[1], element[2]))
-    contig, running_start, running_end, running_sequence = alignment_stitch(name_sequence_tuples)
-    return contig, running_start, running_end, running_sequence
+    join_positions = align_chunk_overlaps(name_sequence_tuples, get_overlap_aligner())
+    return name_sequence_tuples, join_positions
 
 
 def create_consensus_sequence(contig, sequence_chunk_keys, threads):
@@ -219,22 +181,40 @@ def create_consensus_sequence(contig, sequence_chunk_keys, threads):
 
     sequence_chunk_key_list = sorted(sequence_chunk_key_list, key=lambda element: (element[2], element[3]))
 
-    sequence_chunks = list()
-    # generate the dictionary in parallel
+    # sequences and the overlaps inside every batch are aligned in parallel
+    batch_results = dict()
     with concurrent.futures.ProcessPoolExecutor(max_workers=threads) as executor:
         file_chunks = chunks(sequence_chunk_key_list, max(MIN_SEQUENCE_REQUIRED_FOR_MULTITHREADING,
                                                           int(len(sequence_chunk_key_list) / threads) + 1))
 
-        futures = [executor.submit(small_chunk_stitch, contig, file_chunk) for file_chunk in file_chunks]
+        futures = {executor.submit(small_chunk_stitch, contig, file_chunk): batch_id for batch_id, file_chunk in enumerate(file_chunks)}
         for fut in concurrent.futures.as_completed(futures):
             if fut.exception() is None:
-                contig, contig_start, contig_end, sequence = fut.result()
-                sequence_chunks.append((contig, contig_start, contig_end, sequence))
+                batch_results[futures[fut]] = fut.result()
             else:
                 sys.stderr.write("ERROR: " + str(fut.exception()) + "\n")
             fut._result = None  # python issue 27144
 
-    sequence_chunks = sorted(sequence_chunks, key=lambda element: (element[1], element[2]))
-    contig, contig_start, contig_end, sequence = alignment_stitch(sequence_chunks)
+    # batches hold consecutive chunks, so only the overlaps between batches are left to align
+    sequence_chunks = list()
+    join_positions = dict()
+    for batch_id in sorted(batch_results.keys()):
+        batch_sequence_chunks, batch_join_positions = batch_results[batch_id]
+        for chunk_index, positions in batch_join_positions.items():
+            join_positions[len(sequence_chunks) + chunk_index] = positions
+        sequence_chunks.extend(batch_sequence_chunks)
+
+    if not sequence_chunks:
+        return ''
+    overlap_aligner = get_overlap_aligner()
+    boundary_chunks = [i for i in range(1, len(sequence_chunks)) if i not in join_positions
+                       and sequence_chunks[i][1] < sequence_chunks[i - 1][2]]
+    boundary_overlaps = []
+    for i in boundary_chunks:
+        overlap_bases = get_overlap_bases(sequence_chunks[i - 1][2], sequence_chunks[i][1])
+        boundary_overlaps.append((sequence_chunks[i - 1][3][-overlap_bases:], sequence_chunks[i][3][:overlap_bases]))
+    join_positions.update(zip(boundary_chunks, overlap_aligner.align_overlaps(boundary_overlaps)))
+
+    contig, contig_start, contig_end, sequence = join_chunk_sequences(sequence_chunks, join_positions, overlap_aligner)
 
     return sequence
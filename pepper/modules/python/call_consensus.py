@@ -1,10 +1,10 @@
 import sys
-import torch
+import json
+from collections import defaultdict
 from datetime import datetime
 from pepper.modules.python.ImageGenerationUI import UserInterfaceSupport
-from pepper.modules.python.models.predict import predict
-from pepper.modules.python.models.predict_distributed_gpu import predict_distributed_gpu
 from pepper.modules.python.models.predict_distributed_cpu import predict_cpu
+from pepper.modules.python.Options import StitchOptions
 from os.path import isfile, join
 from os import listdir
 import os
@@ -22,6 +22,7 @@ def get_file_paths_from_directory(directory_path):
 
 
 def polish_genome(csv_file, model_path, batch_size, num_workers, output_dir, gpu_mode):
+    from pepper.modules.python.models.predict import predict
     sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: OUTPUT DIRECTORY: " + output_dir + "\n")
     output_filename = output_dir + "pepper_predictions.hdf"
     predict(csv_file, output_filename, model_path, batch_size, num_workers, gpu_mode)
@@ -47,19 +48,27 @@ def polish_cpu(image_dir, model_path, batch_size, num_workers, output_dir, threa
     sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: THREADS PER CALLER: " + str(threads_per_caller) + "\n")
     sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: DATA-LOADER PER CALLER: " + str(num_workers) + "\n")
     sys.stderr.flush()
-    predict_cpu(image_dir,
-                file_chunks,
-                output_dir,
-                model_path,
-                batch_size,
-                total_callers,
-                threads_per_caller,
-                num_workers)
+    success = predict_cpu(image_dir,
+                          file_chunks,
+                          output_dir,
+                          model_path,
+                          batch_size,
+                          total_callers,
+                          threads_per_caller,
+                          num_workers)
     sys.stderr.flush()
-    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: PREDICTION GENERATED SUCCESSFULLY.\n")
+    if success:
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: PREDICTION GENERATED SUCCESSFULLY.\n")
+    else:
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] ERROR: PREDICTION FAILED FOR SOME IMAGES.\n")
+    return success
 
 
 def polish_genome_distributed_gpu(image_dir, model_path, batch_size, num_workers, output_dir, device_ids):
+    # torch is only needed for GPU inference, CPU inference runs on onnxruntime alone
+    import torch
+    from pepper.modules.python.models.predict_distributed_gpu import predict_distributed_gpu
+
     sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: DISTRIBUTED GPU SETUP\n")
 
     if device_ids is None:
@@ -96,12 +105,51 @@ def polish_genome_distributed_gpu(image_dir, model_path, batch_size, num_workers
 
     total_callers = min(total_callers, len(file_chunks))
     sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: TOTAL THREADS: " + str(total_callers) + "\n")
+    # a failed GPU caller raises in mp.spawn, so reaching this point means all callers finished
     predict_distributed_gpu(image_dir, file_chunks, output_dir, model_path, batch_size, device_ids, num_workers)
     sys.stderr.flush()
     sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: PREDICTION GENERATED SUCCESSFULLY.\n")
+    return True
+
+
+def write_prediction_index(output_dir):
+    """
+    Combine the chunk lists of all prediction files into one contig to (file, chunk) index for stitching.
+    :param output_dir: Directory containing the prediction files
+    :return:
+    """
+    prediction_files = sorted(get_file_paths_from_directory(output_dir))
+    for prediction_file in prediction_files:
+        if not os.path.isfile(prediction_file + StitchOptions.CHUNK_INDEX_SUFFIX):
+            sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] WARNING: NO CHUNK INDEX FOUND FOR: " + prediction_file
+                             + ", STITCH WILL SCAN THE PREDICTION FILES.\n")
+            return
+
+    prediction_index = defaultdict(list)
+    for prediction_file in prediction_files:
+        chunk_index_path = prediction_file + StitchOptions.CHUNK_INDEX_SUFFIX
+        with open(chunk_index_path, 'r') as chunk_index_file:
+            for contig, chunk_name, contig_start, contig_end in json.load(chunk_index_file):
+                prediction_index[contig].append((os.path.basename(prediction_file), chunk_name, contig_start, contig_end))
+        os.remove(chunk_index_path)
+
+    with open(output_dir + StitchOptions.PREDICTION_INDEX_NAME, 'w') as prediction_index_file:
+        json.dump(prediction_index, prediction_index_file)
 
 
 def call_consensus(image_dir, model_path, batch_size, num_workers, output_dir, device_ids, gpu, threads):
+    """
+    Run inference on all images of a directory and index the predictions for stitching.
+    :param image_dir: Directory containing the images
+    :param model_path: Path to a trained model
+    :param batch_size: Batch size used for prediction
+    :param num_workers: Number of workers to be used by the dataloader
+    :param output_dir: Path to output directory
+    :param device_ids: List of GPU devices to use
+    :param gpu: If true, predictions will be done over GPU
+    :param threads: Number of threads to use
+    :return: True if predictions of all images were generated
+    """
 
     # check the model file
     if not os.path.isfile(model_path):
@@ -133,6 +181,7 @@ def call_consensus(image_dir, model_path, batch_size, num_workers, output_dir, d
         """
         DO DISTRIBUTED GPU INFERENCE. THIS MODE WILL ENABLE ONE MODEL PER GPU
         """
+        import torch
         if not torch.cuda.is_available():
             sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] ERROR: TORCH IS NOT BUILT WITH CUDA.\n")
             sys.stderr.write("SEE TORCH CAPABILITY:\n$ python3\n"
@@ -141,20 +190,23 @@ def call_consensus(image_dir, model_path, batch_size, num_workers, output_dir, d
             exit(1)
 
         total_gpu_devices = torch.cuda.device_count()
-        polish_genome_distributed_gpu(image_dir,
-                                      model_path,
-                                      batch_size,
-                                      num_workers,
-                                      output_dir,
-                                      device_ids)
+        success = polish_genome_distributed_gpu(image_dir,
+                                                model_path,
+                                                batch_size,
+                                                num_workers,
+                                                output_dir,
+                                                device_ids)
     else:
         """
         DO CPU INFERENCE.
         """
         # distributed CPU setup
-        polish_cpu(image_dir,
-                   model_path,
-                   batch_size,
-                   num_workers,
-                   output_dir,
-                   threads)
+        success = polish_cpu(image_dir,
+                             model_path,
+                             batch_size,
+                             num_workers,
+                             output_dir,
+                             threads)
+
+    write_prediction_index(output_dir)
+    return success
@@ -13,7 +13,7 @@ def make_images(bam_filepath, fasta_filepath, region, output_dir, threads):
     :param region: Specific region of interest
     :param output_dir: Path to the output directory
     :param threads: Number of threads to use
-    :return:
+    :return: True if images of all intervals were generated
     """
     # check the bam file
     if not os.path.isfile(bam_filepath) or not PEPPER.BAM_handler(bam_filepath):
@@ -36,13 +36,13 @@ def make_images(bam_filepath, fasta_filepath, region, output_dir, threads):
     contig_list = UserInterfaceSupport.get_chromosome_list(region, fasta_filepath, bam_filepath, region_bed=None)
 
     # call the parallelization method to generate images in parallel
-    UserInterfaceSupport.chromosome_level_parallelization(contig_list,
-                                                          bam_filepath,
-                                                          fasta_filepath,
-                                                          truth_bam=None,
-                                                          output_path=output_dir,
-                                                          total_threads=threads,
-                                                          train_mode=False)
+    return UserInterfaceSupport.chromosome_level_parallelization(contig_list,
+                                                                 bam_filepath,
+                                                                 fasta_filepath,
+                                                                 truth_bam=None,
+                                                                 output_path=output_dir,
+                                                                 total_threads=threads,
+                                                                 train_mode=False)
 
 
 def make_train_images(bam_filepath, truth_bam_filepath, fasta_filepath, region, output_dir, threads, downsample_rate):
@@ -5,6 +5,7 @@ import torchvision.transforms as transforms
 import h5py
 import sys
 from datetime import datetime
+from pepper.modules.python.models.dataloader_predict_numpy import HDF5FileHandles, get_summary_images, read_summary_row
 
 
 def get_file_paths_from_directory(directory_path):
@@ -33,23 +34,22 @@ class SequenceDataset(Dataset):
         for hdf5_file_path in hdf_files:
             with h5py.File(hdf5_file_path, 'r') as hdf5_file:
                 if 'summaries' in hdf5_file:
-                    image_names = list(hdf5_file['summaries'].keys())
-
-                    for image_name in image_names:
-                        file_image_pair.append((hdf5_file_path, image_name))
+                    file_image_pair.extend(get_summary_images(hdf5_file_path, hdf5_file))
                 else:
                     sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "]  WARN: NO IMAGES FOUND IN FILE: "
                                      + hdf5_file_path + "\n")
 
         self.all_images = file_image_pair
+        # opened lazily in each dataloader worker and kept open across items
+        self.hdf5_files = HDF5FileHandles()
 
     def __getitem__(self, index):
         # load the image
-        hdf5_filepath, image_name = self.all_images[index]
+        hdf5_filepath, summary_name, image_row = self.all_images[index]
 
-        with h5py.File(hdf5_filepath, 'r') as hdf5_file:
-            image = hdf5_file['summaries'][image_name]['image'][()]
-            label = hdf5_file['summaries'][image_name]['label'][()]
+        summary = self.hdf5_files.get(hdf5_filepath)['summaries'][summary_name]
+        image = read_summary_row(summary, 'images', image_row)
+        label = read_summary_row(summary, 'labels', image_row)
 
         return image, label
 
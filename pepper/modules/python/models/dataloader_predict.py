@@ -1,10 +1,11 @@
 from os.path import isfile, join
 from os import listdir
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, BatchSampler, SequentialSampler
 import torchvision.transforms as transforms
 from datetime import datetime
 import h5py
 import sys
+from pepper.modules.python.models.dataloader_predict_numpy import HDF5FileHandles, get_summary_images, read_summary_row, read_image_batch
 
 
 def get_file_paths_from_directory(directory_path):
@@ -35,28 +36,39 @@ class SequenceDataset(Dataset):
         for hdf5_file_path in hdf_files:
             with h5py.File(hdf5_file_path, 'r') as hdf5_file:
                 if 'summaries' in hdf5_file:
-                    image_names = list(hdf5_file['summaries'].keys())
-
-                    for image_name in image_names:
-                        file_image_pair.append((hdf5_file_path, image_name))
+                    file_image_pair.extend(get_summary_images(hdf5_file_path, hdf5_file))
                 else:
                     sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] WARN: NO IMAGES FOUND IN FILE: "
                                      + hdf5_file_path + "\n")
 
         self.all_images = file_image_pair
+        # opened lazily in each dataloader worker and kept open across items
+        self.hdf5_files = HDF5FileHandles()
+
+    def get_batch_sampler(self, batch_size):
+        """
+        Return a sampler of consecutive index ranges. Used with batch_size=None in the DataLoader, every range is passed
+        to __getitem__ as a whole and the rows of a summary are read with one slice.
+        :param batch_size: Batch size
+        :return: A batch sampler over this dataset
+        """
+        return BatchSampler(SequentialSampler(self), batch_size=batch_size, drop_last=False)
 
     def __getitem__(self, index):
+        if isinstance(index, (list, tuple)):
+            return read_image_batch(self.hdf5_files, self.all_images, index)
+
         # load the image
-        hdf5_filepath, image_name = self.all_images[index]
+        hdf5_filepath, summary_name, image_row = self.all_images[index]
 
-        with h5py.File(hdf5_filepath, 'r') as hdf5_file:
-            image = hdf5_file['summaries'][image_name]['image'][()]
-            position = hdf5_file['summaries'][image_name]['position'][()]
-            index = hdf5_file['summaries'][image_name]['index'][()]
-            contig = hdf5_file['summaries'][image_name]['contig'][()]
-            chunk_id = hdf5_file['summaries'][image_name]['chunk_id'][()]
-            contig_start = hdf5_file['summaries'][image_name]['region_start'][()]
-            contig_end = hdf5_file['summaries'][image_name]['region_end'][()]
+        summary = self.hdf5_files.get(hdf5_filepath)['summaries'][summary_name]
+        image = read_summary_row(summary, 'images', image_row)
+        position = read_summary_row(summary, 'positions', image_row)
+        index = read_summary_row(summary, 'indices', image_row)
+        contig = summary['contig'][()]
+        chunk_id = read_summary_row(summary, 'chunk_ids', image_row)
+        contig_start = summary['region_start'][()]
+        contig_end = summary['region_end'][()]
 
         return contig, contig_start, contig_end, chunk_id, image, position, index
 
@@ -0,0 +1,180 @@
+from os.path import isfile, join
+from os import listdir
+import os
+from datetime import datetime
+import numpy as np
+import h5py
+import sys
+
+
+def get_file_paths_from_directory(directory_path):
+    """
+    Returns all paths of files given a directory path
+    :param directory_path: Path to the directory
+    :return: A list of paths of files
+    """
+    file_paths = [join(directory_path, file) for file in listdir(directory_path) if isfile(join(directory_path, file))
+                  and file[-3:] == 'hdf']
+    return file_paths
+
+
+class HDF5FileHandles(object):
+    """
+    Read-only HDF5 file handles that stay open across reads. Handles are opened lazily and are dropped when the object
+    is pickled or used from a forked process, so every dataloader worker opens its own.
+    """
+    def __init__(self):
+        self.handles = {}
+        self.pid = os.getpid()
+
+    def get(self, hdf5_filepath):
+        if self.pid != os.getpid():
+            # handles inherited through a fork share file state with the parent, never reuse them
+            self.handles = {}
+            self.pid = os.getpid()
+        if hdf5_filepath not in self.handles:
+            self.handles[hdf5_filepath] = h5py.File(hdf5_filepath, 'r')
+        return self.handles[hdf5_filepath]
+
+    def close(self):
+        if self.pid == os.getpid():
+            for hdf5_file in self.handles.values():
+                hdf5_file.close()
+        self.handles = {}
+
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+
+# datasets of a summary group written by earlier versions of make_images, which stored one image per group
+PER_IMAGE_SUMMARY_DATASETS = {'images': 'image', 'labels': 'label', 'positions': 'position', 'indices': 'index', 'chunk_ids': 'chunk_id'}
+
+
+def get_summary_images(hdf5_file_path, hdf5_file):
+    """
+    List the images of a file. A summary holds the images of one region, one image per row. Files written by earlier
+    versions hold one image per summary, these images are listed with a None row.
+    :param hdf5_file_path: Path to the HDF5 file
+    :param hdf5_file: Open HDF5 file
+    :return: List of (file path, summary name, image row) of all images in the file
+    """
+    file_image_pair = []
+    for summary_name, summary in hdf5_file['summaries'].items():
+        if 'chunk_ids' in summary:
+            file_image_pair.extend((hdf5_file_path, summary_name, image_row) for image_row in range(summary['chunk_ids'].shape[0]))
+        else:
+            file_image_pair.append((hdf5_file_path, summary_name, None))
+    return file_image_pair
+
+
+def read_summary_rows(summary, dataset, row_start, row_end):
+    """
+    Read a range of rows of a summary dataset.
+    :param summary: Summary group
+    :param dataset: Name of the dataset, i.e. images, labels, positions, indices or chunk_ids
+    :param row_start: First row, None if the summary holds a single image
+    :param row_end: Row after the last row
+    :return: Array of the rows
+    """
+    if row_start is None:
+        return np.asarray(summary[PER_IMAGE_SUMMARY_DATASETS[dataset]][()])[np.newaxis]
+    return summary[dataset][row_start:row_end]
+
+
+def read_summary_row(summary, dataset, image_row):
+    if image_row is None:
+        return summary[PER_IMAGE_SUMMARY_DATASETS[dataset]][()]
+    return summary[dataset][image_row]
+
+
+def get_image_row_ranges(all_images, image_indices):
+    """
+    Group images into ranges of consecutive rows of the same summary, keeping the order of the images. Images stored
+    one per summary are never grouped.
+    :param all_images: List of (file path, summary name, image row) of all images
+    :param image_indices: Indices of the images to group
+    :return: List of [file path, summary name, row start, row end] ranges
+    """
+    row_ranges = []
+    for image_index in image_indices:
+        hdf5_filepath, summary_name, image_row = all_images[image_index]
+        if image_row is None:
+            row_ranges.append([hdf5_filepath, summary_name, None, None])
+        elif row_ranges and row_ranges[-1][0] == hdf5_filepath and row_ranges[-1][1] == summary_name \
+                and row_ranges[-1][3] == image_row:
+            row_ranges[-1][3] += 1
+        else:
+            row_ranges.append([hdf5_filepath, summary_name, image_row, image_row + 1])
+    return row_ranges
+
+
+def read_image_batch(hdf5_files, all_images, image_indices):
+    """
+    Read a batch of images, every range of consecutive rows of a summary is read with a single slice per dataset.
+    :param hdf5_files: HDF5FileHandles to read from
+    :param all_images: List of (file path, summary name, image row) of all images
+    :param image_indices: Indices of the images in the batch
+    :return: Contigs, contig starts, contig ends, chunk ids, images, positions and indices of the batch
+    """
+    contigs, contig_starts, contig_ends, chunk_ids, images, positions, indices = [], [], [], [], [], [], []
+    for hdf5_filepath, summary_name, row_start, row_end in get_image_row_ranges(all_images, image_indices):
+        summary = hdf5_files.get(hdf5_filepath)['summaries'][summary_name]
+        contig = summary['contig'][()]
+        if isinstance(contig, bytes):
+            contig = contig.decode('UTF-8')
+        total_rows = 1 if row_start is None else row_end - row_start
+
+        contigs.extend([contig] * total_rows)
+        contig_starts.append(np.full(total_rows, summary['region_start'][()]))
+        contig_ends.append(np.full(total_rows, summary['region_end'][()]))
+        chunk_ids.append(read_summary_rows(summary, 'chunk_ids', row_start, row_end))
+        images.append(read_summary_rows(summary, 'images', row_start, row_end))
+        positions.append(read_summary_rows(summary, 'positions', row_start, row_end))
+        indices.append(read_summary_rows(summary, 'indices', row_start, row_end))
+
+    return contigs, np.concatenate(contig_starts), np.concatenate(contig_ends), np.concatenate(chunk_ids), \
+        np.concatenate(images), np.concatenate(positions), np.concatenate(indices)
+
+
+class SequenceBatchReader(object):
+    """
+    Torch-free batch reader of polishing images used by CPU inference.
+    Arguments:
+        A HDF5 file path
+    """
+    def __init__(self, image_directory, file_list=None, batch_size=1):
+        file_image_pair = []
+
+        if file_list is not None:
+            hdf_files = file_list
+        else:
+            hdf_files = get_file_paths_from_directory(image_directory)
+
+        for hdf5_file_path in hdf_files:
+            with h5py.File(hdf5_file_path, 'r') as hdf5_file:
+                if 'summaries' in hdf5_file:
+                    file_image_pair.extend(get_summary_images(hdf5_file_path, hdf5_file))
+                else:
+                    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] WARN: NO IMAGES FOUND IN FILE: "
+                                     + hdf5_file_path + "\n")
+
+        self.all_images = file_image_pair
+        self.batch_size = batch_size
+        self.hdf5_files = HDF5FileHandles()
+
+    def __iter__(self):
+        try:
+            for batch_start in range(0, len(self.all_images), self.batch_size):
+                batch_end = min(len(self.all_images), batch_start + self.batch_size)
+                contigs, contig_starts, contig_ends, chunk_ids, images, positions, indices = \
+                    read_image_batch(self.hdf5_files, self.all_images, range(batch_start, batch_end))
+
+                yield contigs, contig_starts, contig_ends, chunk_ids, images.astype(np.float32), positions, indices
+        finally:
+            self.hdf5_files.close()
+
+    def __len__(self):
+        return (len(self.all_images) + self.batch_size - 1) // self.batch_size
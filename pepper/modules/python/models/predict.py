@@ -1,11 +1,13 @@
 import sys
 import torch
-import torch.nn as nn
+import numpy as np
 from torch.utils.data import DataLoader
 from pepper.modules.python.models.dataloader_predict import SequenceDataset
 from tqdm import tqdm
 from datetime import datetime
 from pepper.modules.python.models.ModelHander import ModelHandler
+from pepper.modules.python.models.simple_model import SlidingWindowTransducer
+from pepper.modules.python.models.predict_distributed_cpu import get_window_counts, get_base_predictions
 from pepper.modules.python.Options import ImageSizeOptions, TrainOptions
 from pepper.modules.python.DataStorePredict import DataStore
 import torch.onnx
@@ -27,8 +29,8 @@ def predict(test_file, output_filename, model_path, batch_size, num_workers, gpu
     # data loader
     test_data = SequenceDataset(test_file)
     test_loader = DataLoader(test_data,
-                             batch_size=batch_size,
-                             shuffle=False,
+                             batch_size=None,
+                             sampler=test_data.get_batch_sampler(batch_size),
                              num_workers=num_workers)
 
     transducer_model, hidden_size, gru_layers, prev_ite = \
@@ -42,6 +44,12 @@ def predict(test_file, output_filename, model_path, batch_size, num_workers, gpu
     if gpu_mode:
         transducer_model = transducer_model.cuda()
 
+    sliding_window_model = SlidingWindowTransducer(transducer_model,
+                                                   ImageSizeOptions.SEQ_LENGTH,
+                                                   TrainOptions.TRAIN_WINDOW,
+                                                   TrainOptions.WINDOW_JUMP)
+    window_counts = get_window_counts()
+
     sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: STARTING INFERENCE\n")
 
     with torch.no_grad():
@@ -50,48 +58,16 @@ def predict(test_file, output_filename, model_path, batch_size, num_workers, gpu
 
             hidden = torch.zeros(images.size(0), 2 * TrainOptions.GRU_LAYERS, TrainOptions.HIDDEN_SIZE)
 
-            prediction_base_tensor = torch.zeros((images.size(0), images.size(1), ImageSizeOptions.TOTAL_LABELS))
-
             if gpu_mode:
                 images = images.cuda()
                 hidden = hidden.cuda()
-                prediction_base_tensor = prediction_base_tensor.cuda()
-
-            for i in range(0, ImageSizeOptions.SEQ_LENGTH, TrainOptions.WINDOW_JUMP):
-                if i + TrainOptions.TRAIN_WINDOW > ImageSizeOptions.SEQ_LENGTH:
-                    break
-                chunk_start = i
-                chunk_end = i + TrainOptions.TRAIN_WINDOW
-                # chunk all the data
-                image_chunk = images[:, chunk_start:chunk_end]
-
-                # run inference
-                output_base, hidden = transducer_model(image_chunk, hidden)
-
-                # now calculate how much padding is on the top and bottom of this chunk so we can do a simple
-                # add operation
-                top_zeros = chunk_start
-                bottom_zeros = ImageSizeOptions.SEQ_LENGTH - chunk_end
-
-                # do softmax and get prediction
-                # we run a softmax a padding to make the output tensor compatible for adding
-                inference_layers = nn.Sequential(
-                    nn.Softmax(dim=2),
-                    nn.ZeroPad2d((0, 0, top_zeros, bottom_zeros))
-                )
-                if gpu_mode:
-                    inference_layers = inference_layers.cuda()
-                    base_prediction = inference_layers(output_base).cuda()
-                else:
-                    base_prediction = inference_layers(output_base)
-
-                # now simply add the tensor to the global counter
-                prediction_base_tensor = torch.add(prediction_base_tensor, base_prediction)
 
-            base_values, base_labels = torch.max(prediction_base_tensor, 2)
+            prediction_base_sums = sliding_window_model(images, hidden).cpu().numpy()
+            base_labels, phred_scores = get_base_predictions(prediction_base_sums, window_counts,
+                                                             np.empty(prediction_base_sums.shape[:2], dtype=np.intp),
+                                                             np.empty(prediction_base_sums.shape[:2], dtype=np.float32))
 
-            predicted_base_labels = base_labels.cpu().numpy()
+            prediction_data_file.write_predictions(contig, contig_start.numpy(), contig_end.numpy(), chunk_id.numpy(),
+                                                   position.numpy(), index.numpy(), base_labels, phred_scores)
 
-            for i in range(images.size(0)):
-                prediction_data_file.write_prediction(contig[i], contig_start[i], contig_end[i], chunk_id[i],
-                                                      position[i], index[i], predicted_base_labels[i])
+    prediction_data_file.close()
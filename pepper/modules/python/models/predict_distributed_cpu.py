@@ -2,123 +2,191 @@ import onnxruntime
 import sys
 import os
 import time
-import torch
-import torch.nn as nn
+import hashlib
+import importlib.util
 import concurrent.futures
+import numpy as np
 from datetime import datetime
-from torch.utils.data import DataLoader
-from pepper.modules.python.models.dataloader_predict import SequenceDataset
-from pepper.modules.python.models.ModelHander import ModelHandler
+from pepper.modules.python.models.dataloader_predict_numpy import SequenceBatchReader
 from pepper.modules.python.Options import ImageSizeOptions, TrainOptions
 from pepper.modules.python.DataStorePredict import DataStore
-import torch.onnx
 import warnings
 warnings.filterwarnings("ignore", message="Exporting a model to ONNX with a batch_size other than 1, with a variable lenght with GRU can cause an error when running the ONNX model with a different batch size")
 
 
-def predict(input_filepath, file_chunks, output_filepath, batch_size, num_workers, rank, threads_per_caller, model_path):
+# graph that runs all windows of an image in one call
+UNROLLED_ONNX_SUFFIX = ".unrolled.onnx"
+
+
+def get_window_starts():
+    # the last window that does not fit in the sequence is skipped, same as in training
+    return list(range(0, ImageSizeOptions.SEQ_LENGTH - TrainOptions.TRAIN_WINDOW + 1, TrainOptions.WINDOW_JUMP))
+
+
+def get_window_counts():
+    """
+    Return the number of windows that cover each position of an image.
+    :return: Window count of each position
+    """
+    window_counts = np.zeros(ImageSizeOptions.SEQ_LENGTH, dtype=np.float32)
+    for window_start in get_window_starts():
+        window_counts[window_start:window_start + TrainOptions.TRAIN_WINDOW] += 1
+    return window_counts
+
+
+def predict_windows(ort_session, images, hidden, softmax_buffer, prediction_base_sums):
+    """
+    Run a window model over a batch of images and sum the softmax of the windows covering each position. All
+    intermediate values are written to preallocated buffers.
+    :param ort_session: ORT session of a model that predicts one window
+    :param images: Batch of images
+    :param hidden: Zero filled buffer for the hidden state
+    :param softmax_buffer: Buffer for the softmax of a window
+    :param prediction_base_sums: Buffer the softmax sums are written to
+    :return: Softmax sums of the batch
+    """
+    input_image_name = ort_session.get_inputs()[0].name
+    input_hidden_name = ort_session.get_inputs()[1].name
+    batch_size = images.shape[0]
+    prediction_base_sums = prediction_base_sums[:batch_size]
+    softmax_buffer = softmax_buffer[:batch_size]
+    prediction_base_sums.fill(0)
+
+    hidden = hidden[:batch_size]
+    for window_start in get_window_starts():
+        window_end = window_start + TrainOptions.TRAIN_WINDOW
+        ort_inputs = {input_image_name: np.ascontiguousarray(images[:, window_start:window_end]),
+                      input_hidden_name: hidden}
+        output_base, hidden = ort_session.run(None, ort_inputs)
+
+        # softmax in place, then add the window to the positions it covers, which is the same as padding the window
+        # with zeros on top and bottom and adding the whole tensor
+        np.subtract(output_base, np.max(output_base, axis=2, keepdims=True), out=softmax_buffer)
+        np.exp(softmax_buffer, out=softmax_buffer)
+        np.divide(softmax_buffer, np.sum(softmax_buffer, axis=2, keepdims=True), out=softmax_buffer)
+        prediction_base_sums[:, window_start:window_end] += softmax_buffer
+
+    return prediction_base_sums
+
+
+def predict_unrolled(ort_session, images, hidden):
+    """
+    Run a model with an unrolled window loop over a batch of images.
+    :param ort_session: ORT session of a model that predicts whole images
+    :param images: Batch of images
+    :param hidden: Zero filled buffer for the hidden state
+    :return: Softmax sums of the batch
+    """
+    ort_inputs = {ort_session.get_inputs()[0].name: images,
+                  ort_session.get_inputs()[1].name: hidden[:images.shape[0]]}
+    return ort_session.run(None, ort_inputs)[0]
+
+
+def get_base_predictions(prediction_base_sums, window_counts, base_labels, phred_scores):
+    """
+    Pick the base with the highest softmax sum at every position and calculate its phred score.
+    :param prediction_base_sums: Softmax sums of a batch
+    :param window_counts: Number of windows covering each position
+    :param base_labels: Buffer the base labels are written to
+    :param phred_scores: Buffer the phred scores are written to
+    :return: Base labels and phred scores of the batch
+    """
+    batch_size = prediction_base_sums.shape[0]
+    base_labels = base_labels[:batch_size]
+    phred_scores = phred_scores[:batch_size]
+
+    np.argmax(prediction_base_sums, axis=2, out=base_labels)
+    np.max(prediction_base_sums, axis=2, out=phred_scores)
+    np.divide(phred_scores, window_counts, out=phred_scores)
+    np.subtract(1.0, phred_scores, out=phred_scores)
+    with np.errstate(divide='ignore'):
+        np.log10(phred_scores, out=phred_scores)
+    np.multiply(phred_scores, -10, out=phred_scores)
+    phred_scores[phred_scores == float('inf')] = 100
+
+    return base_labels, phred_scores
+
+
+def predict(input_filepath, file_chunks, output_filepath, batch_size, num_workers, rank, threads_per_caller, onnx_path, unrolled):
     # session options
     sess_options = onnxruntime.SessionOptions()
     sess_options.intra_op_num_threads = threads_per_caller
     sess_options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
     sess_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
 
-    ort_session = onnxruntime.InferenceSession(model_path + ".onnx", sess_options=sess_options)
-    torch.set_num_threads(threads_per_caller)
+    ort_session = onnxruntime.InferenceSession(onnx_path, sess_options=sess_options)
 
     # create output file
     output_filename = output_filepath + "pepper_prediction_" + str(rank) + ".hdf"
     prediction_data_file = DataStore(output_filename, mode='w')
 
     # data loader
-    input_data = SequenceDataset(input_filepath, file_chunks)
-    data_loader = DataLoader(input_data,
-                             batch_size=batch_size,
-                             shuffle=False,
-                             num_workers=num_workers)
+    batch_reader = SequenceBatchReader(input_filepath, file_chunks, batch_size)
+
+    # buffers are allocated once for the largest batch, smaller batches use a slice
+    hidden = np.zeros((batch_size, 2 * TrainOptions.GRU_LAYERS, TrainOptions.HIDDEN_SIZE), dtype=np.float32)
+    softmax_buffer = np.empty((batch_size, TrainOptions.TRAIN_WINDOW, ImageSizeOptions.TOTAL_LABELS), dtype=np.float32)
+    prediction_base_sums = np.empty((batch_size, ImageSizeOptions.SEQ_LENGTH, ImageSizeOptions.TOTAL_LABELS), dtype=np.float32)
+    base_labels = np.empty((batch_size, ImageSizeOptions.SEQ_LENGTH), dtype=np.intp)
+    phred_scores = np.empty((batch_size, ImageSizeOptions.SEQ_LENGTH), dtype=np.float32)
+    window_counts = get_window_counts()
 
     batch_completed = 0
 
-    with torch.no_grad():
-        for contig, contig_start, contig_end, chunk_id, images, position, index in data_loader:
-            images = images.type(torch.FloatTensor)
-
-            hidden = torch.zeros(images.size(0), 2 * TrainOptions.GRU_LAYERS, TrainOptions.HIDDEN_SIZE)
-
-            prediction_base_tensor = torch.zeros((images.size(0), images.size(1), ImageSizeOptions.TOTAL_LABELS))
-
-            for i in range(0, ImageSizeOptions.SEQ_LENGTH, TrainOptions.WINDOW_JUMP):
-                if i + TrainOptions.TRAIN_WINDOW > ImageSizeOptions.SEQ_LENGTH:
-                    break
-                chunk_start = i
-                chunk_end = i + TrainOptions.TRAIN_WINDOW
-                # chunk all the data
-                image_chunk = images[:, chunk_start:chunk_end]
-
-                # run inference on onnx mode, which takes numpy inputs
-                ort_inputs = {ort_session.get_inputs()[0].name: image_chunk.cpu().numpy(),
-                              ort_session.get_inputs()[1].name: hidden.cpu().numpy()}
-                output_base, hidden = ort_session.run(None, ort_inputs)
-                output_base = torch.from_numpy(output_base)
-                hidden = torch.from_numpy(hidden)
-
-                # now calculate how much padding is on the top and bottom of this chunk so we can do a simple
-                # add operation
-                top_zeros = chunk_start
-                bottom_zeros = ImageSizeOptions.SEQ_LENGTH - chunk_end
-
-                counts = torch.ones((output_base.size(0), output_base.size(1), 1))
-
-                # do softmax and get prediction
-                # we run a softmax a padding to make the output tensor compatible for adding
-                inference_layers = nn.Sequential(
-                    nn.Softmax(dim=2),
-                    nn.ZeroPad2d((0, 0, top_zeros, bottom_zeros))
-                )
-                base_prediction = inference_layers(output_base)
-
-                # now simply add the tensor to the global counter
-                prediction_base_tensor = torch.add(prediction_base_tensor, base_prediction)
-
-            base_values, base_labels = torch.max(prediction_base_tensor, 2)
-
-            # this part is for the phred score calculation
-            counts = torch.ones((base_values.size(0), base_values.size(1) - 2 * ImageSizeOptions.SEQ_OVERLAP))
-            top_ones = nn.ZeroPad2d((ImageSizeOptions.SEQ_OVERLAP, ImageSizeOptions.SEQ_OVERLAP))
-            counts = top_ones(counts) + 1
-            phred_score = -10 * torch.log10(1.0 - (base_values / counts))
-            phred_score[phred_score == float('inf')] = 100
-
-            predicted_base_labels = base_labels.cpu().numpy()
-            phred_score = phred_score.cpu().numpy()
-
-            for i in range(images.size(0)):
-                prediction_data_file.write_prediction(contig[i], contig_start[i], contig_end[i], chunk_id[i],
-                                                      position[i], index[i], predicted_base_labels[i], phred_score[i])
-
-            if rank == 0:
-                batch_completed += 1
-                sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] " +
-                                 "INFO: BATCHES PROCESSED " + str(batch_completed) + "/" + str(len(data_loader)) + ".\n")
-                sys.stderr.flush()
+    for contig, contig_start, contig_end, chunk_id, images, position, index in batch_reader:
+        if unrolled:
+            batch_base_sums = predict_unrolled(ort_session, images, hidden)
+        else:
+            batch_base_sums = predict_windows(ort_session, images, hidden, softmax_buffer, prediction_base_sums)
+
+        batch_base_labels, batch_phred_scores = get_base_predictions(batch_base_sums, window_counts, base_labels, phred_scores)
+
+        prediction_data_file.write_predictions(contig, contig_start, contig_end, chunk_id, position, index,
+                                               batch_base_labels, batch_phred_scores)
+
+        if rank == 0:
+            batch_completed += 1
+            sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] " +
+                             "INFO: BATCHES PROCESSED " + str(batch_completed) + "/" + str(len(batch_reader)) + ".\n")
+            sys.stderr.flush()
+
+    prediction_data_file.close()
 
     return rank
 
 
-def predict_cpu(filepath, file_chunks, output_filepath, model_path, batch_size, total_callers, threads_per_caller, num_workers):
+def get_file_checksum(file_path):
     """
-    Create a prediction table/dictionary of an images set using a trained model.
-    :param filepath: Path to image files to predict on
-    :param file_chunks: Path to chunked files
-    :param batch_size: Batch size used for prediction
+    Calculate the sha256 checksum of a file.
+    :param file_path: Path to a file
+    :return: Hex digest of the file content
+    """
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as file_handle:
+        for block in iter(lambda: file_handle.read(1 << 20), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def get_unrolled_model_path(model_path):
+    # keyed by the checksum of the model so a retrained or replaced model is never served from a stale export
+    return model_path + "." + get_file_checksum(model_path)[:16] + UNROLLED_ONNX_SUFFIX
+
+
+def export_unrolled_model_to_onnx(model_path, unrolled_model_path):
+    """
+    Export a trained PyTorch model to ONNX with the sliding window loop unrolled, so the graph takes whole images and
+    returns the softmax sums of all windows. Torch is only imported here so inference workers do not need it. The
+    model is exported to a temporary file and moved in place, so concurrent runs never read a partial export.
     :param model_path: Path to a trained model
-    :param output_filepath: Path to output directory
-    :param total_callers: Number of callers to spawn
-    :param threads_per_caller: Number of threads to use per caller
-    :param num_workers: Number of workers to be used by the dataloader
-    :return: Prediction dictionary
+    :param unrolled_model_path: Path of the unrolled ONNX model
+    :return:
     """
-    # load the model and create an ONNX session
+    import torch
+    import torch.onnx
+    from pepper.modules.python.models.ModelHander import ModelHandler
+    from pepper.modules.python.models.simple_model import SlidingWindowTransducer
+
     transducer_model, hidden_size, gru_layers, prev_ite = \
         ModelHandler.load_simple_model_for_training(model_path,
                                                     input_channels=ImageSizeOptions.IMAGE_CHANNELS,
@@ -126,28 +194,75 @@ def predict_cpu(filepath, file_chunks, output_filepath, model_path, batch_size,
                                                     seq_len=ImageSizeOptions.SEQ_LENGTH,
                                                     num_classes=ImageSizeOptions.TOTAL_LABELS)
     transducer_model.eval()
+    sliding_window_model = SlidingWindowTransducer(transducer_model,
+                                                   ImageSizeOptions.SEQ_LENGTH,
+                                                   TrainOptions.TRAIN_WINDOW,
+                                                   TrainOptions.WINDOW_JUMP)
+    sliding_window_model.eval()
 
-    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: MODEL LOADING TO ONNX\n")
-    x = torch.zeros(1, TrainOptions.TRAIN_WINDOW, ImageSizeOptions.IMAGE_HEIGHT)
+    x = torch.zeros(1, ImageSizeOptions.SEQ_LENGTH, ImageSizeOptions.IMAGE_HEIGHT)
     h = torch.zeros(1, 2 * TrainOptions.GRU_LAYERS, TrainOptions.HIDDEN_SIZE)
 
+    # temporary files are kept in the same directory so os.replace stays atomic
+    temporary_path = unrolled_model_path + ".tmp." + str(os.getpid())
+    torch.onnx.export(sliding_window_model, (x, h),
+                      temporary_path,
+                      training=False,
+                      opset_version=10,
+                      do_constant_folding=True,
+                      input_names=['input_image', 'input_hidden'],
+                      output_names=['output_base_sum'],
+                      dynamic_axes={'input_image': {0: 'batch_size'},
+                                    'input_hidden': {0: 'batch_size'},
+                                    'output_base_sum': {0: 'batch_size'}})
+    os.replace(temporary_path, unrolled_model_path)
+
+
+def get_onnx_model(model_path):
+    """
+    Return the ONNX model to run inference with. The unrolled model is exported if torch is available, otherwise a
+    previously exported window model is used.
+    :param model_path: Path to a trained model
+    :return: Path to the ONNX model and whether the window loop is unrolled in it
+    """
+    unrolled_model_path = get_unrolled_model_path(model_path)
+    if os.path.isfile(unrolled_model_path):
+        return unrolled_model_path, True
+
+    if importlib.util.find_spec('torch') is not None:
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: SAVING UNROLLED MODEL TO ONNX: " + unrolled_model_path + "\n")
+        export_unrolled_model_to_onnx(model_path, unrolled_model_path)
+        return unrolled_model_path, True
+
     if not os.path.isfile(model_path + ".onnx"):
-        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: SAVING MODEL TO ONNX\n")
-        torch.onnx.export(transducer_model, (x, h),
-                          model_path + ".onnx",
-                          training=False,
-                          opset_version=10,
-                          do_constant_folding=True,
-                          input_names=['input_image', 'input_hidden'],
-                          output_names=['output_pred', 'output_hidden'],
-                          dynamic_axes={'input_image': {0: 'batch_size'},
-                                        'input_hidden': {0: 'batch_size'},
-                                        'output_pred': {0: 'batch_size'},
-                                        'output_hidden': {0: 'batch_size'}})
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] ERROR: TORCH IS REQUIRED TO EXPORT THE MODEL TO ONNX\n")
+        exit(1)
+
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] WARNING: TORCH NOT FOUND, USING THE SLIDING WINDOW ONNX MODEL\n")
+    return model_path + ".onnx", False
+
+
+def predict_cpu(filepath, file_chunks, output_filepath, model_path, batch_size, total_callers, threads_per_caller, num_workers):
+    """
+    Create a prediction table/dictionary of an images set using a trained model.
+    :param filepath: Path to image files to predict on
+    :param file_chunks: Path to chunked files
+    :param batch_size: Batch size used for prediction
+    :param model_path: Path to a trained model
+    :param output_filepath: Path to output directory
+    :param total_callers: Number of callers to spawn
+    :param threads_per_caller: Number of threads to use per caller
+    :param num_workers: Number of workers to be used by the dataloader
+    :return: True if all callers finished successfully
+    """
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: MODEL LOADING TO ONNX\n")
+
+    onnx_path, unrolled = get_onnx_model(model_path)
 
     start_time = time.time()
+    failed_callers = 0
     with concurrent.futures.ProcessPoolExecutor(max_workers=total_callers) as executor:
-        futures = [executor.submit(predict, filepath, file_chunks[thread_id], output_filepath, batch_size, num_workers, thread_id, threads_per_caller, model_path)
+        futures = [executor.submit(predict, filepath, file_chunks[thread_id], output_filepath, batch_size, num_workers, thread_id, threads_per_caller, onnx_path, unrolled)
                    for thread_id in range(0, total_callers)]
 
         for fut in concurrent.futures.as_completed(futures):
@@ -157,6 +272,7 @@ def predict_cpu(filepath, file_chunks, output_filepath, model_path, batch_size,
                 sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: THREAD "
                                  + str(thread_id) + " FINISHED SUCCESSFULLY.\n")
             else:
+                failed_callers += 1
                 sys.stderr.write("ERROR: " + str(fut.exception()) + "\n")
             fut._result = None  # python issue 27144
 
@@ -165,3 +281,5 @@ def predict_cpu(filepath, file_chunks, output_filepath, model_path, batch_size,
     secs = int((end_time - start_time)) % 60
     sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: FINISHED PREDICTION\n")
     sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: ELAPSED TIME: " + str(mins) + " Min " + str(secs) + " Sec\n")
+
+    return failed_callers == 0
@@ -2,13 +2,15 @@ import sys
 import os
 import torch
 import torch.distributed as dist
-import torch.nn as nn
+import numpy as np
 from torch.utils.data import DataLoader
 import torch.multiprocessing as mp
 from torch.nn.parallel import DistributedDataParallel
 from pepper.modules.python.models.dataloader_predict import SequenceDataset
 from tqdm import tqdm
 from pepper.modules.python.models.ModelHander import ModelHandler
+from pepper.modules.python.models.simple_model import SlidingWindowTransducer
+from pepper.modules.python.models.predict_distributed_cpu import get_window_counts, get_base_predictions
 from pepper.modules.python.Options import ImageSizeOptions, TrainOptions
 from pepper.modules.python.DataStorePredict import DataStore
 os.environ['PYTHONWARNINGS'] = 'ignore:semaphore_tracker:UserWarning'
@@ -30,14 +32,19 @@ def predict(input_filepath, file_chunks, output_filepath, model_path, batch_size
     # data loader
     input_data = SequenceDataset(input_filepath, file_chunks)
     data_loader = DataLoader(input_data,
-                             batch_size=batch_size,
-                             shuffle=False,
+                             batch_size=None,
+                             sampler=input_data.get_batch_sampler(batch_size),
                              num_workers=num_workers)
 
     torch.cuda.set_device(device_id)
     transducer_model.to(device_id)
     transducer_model.eval()
     transducer_model = DistributedDataParallel(transducer_model, device_ids=[device_id])
+    sliding_window_model = SlidingWindowTransducer(transducer_model,
+                                                   ImageSizeOptions.SEQ_LENGTH,
+                                                   TrainOptions.TRAIN_WINDOW,
+                                                   TrainOptions.WINDOW_JUMP)
+    window_counts = get_window_counts()
 
     if rank == 0:
         progress_bar = tqdm(
@@ -54,68 +61,25 @@ def predict(input_filepath, file_chunks, output_filepath, model_path, batch_size
             images = images.type(torch.FloatTensor)
             hidden = torch.zeros(images.size(0), 2 * TrainOptions.GRU_LAYERS, TrainOptions.HIDDEN_SIZE)
 
-            prediction_base_tensor = torch.zeros((images.size(0), images.size(1), ImageSizeOptions.TOTAL_LABELS))
-
             images = images.to(device_id)
             hidden = hidden.to(device_id)
-            prediction_base_tensor = prediction_base_tensor.to(device_id)
-
-            for i in range(0, ImageSizeOptions.SEQ_LENGTH, TrainOptions.WINDOW_JUMP):
-                if i + TrainOptions.TRAIN_WINDOW > ImageSizeOptions.SEQ_LENGTH:
-                    break
-                chunk_start = i
-                chunk_end = i + TrainOptions.TRAIN_WINDOW
-                # chunk all the data
-                image_chunk = images[:, chunk_start:chunk_end]
-
-                # run inference
-                output_base, hidden = transducer_model(image_chunk, hidden)
-
-                # now calculate how much padding is on the top and bottom of this chunk so we can do a simple
-                # add operation
-                top_zeros = chunk_start
-                bottom_zeros = ImageSizeOptions.SEQ_LENGTH - chunk_end
-
-                # do softmax and get prediction
-                # we run a softmax a padding to make the output tensor compatible for adding
-                inference_layers = nn.Sequential(
-                    nn.Softmax(dim=2),
-                    nn.ZeroPad2d((0, 0, top_zeros, bottom_zeros))
-                )
-                inference_layers = inference_layers.to(device_id)
-
-                # run the softmax and padding layers
-                base_prediction = inference_layers(output_base).to(device_id)
-
-                # now simply add the tensor to the global counter
-                prediction_base_tensor = torch.add(prediction_base_tensor, base_prediction)
-
-                del inference_layers
-                torch.cuda.empty_cache()
-
-            base_values, base_labels = torch.max(prediction_base_tensor, 2)
-
-            # this part is for the phred score calculation
-            counts = torch.ones((base_values.size(0), base_values.size(1) - 2 * ImageSizeOptions.SEQ_OVERLAP))
-            top_ones = nn.ZeroPad2d((ImageSizeOptions.SEQ_OVERLAP, ImageSizeOptions.SEQ_OVERLAP))
-            counts = top_ones(counts) + 1
-
-            base_values = base_labels.cpu().numpy()
-            phred_score = -10 * torch.log10(1.0 - (base_values / counts))
-            phred_score[phred_score == float('inf')] = 100
-
-            predicted_base_labels = base_labels.cpu().numpy()
-            phred_score = phred_score.cpu().numpy()
-
-            for i in range(images.size(0)):
-                prediction_data_file.write_prediction(contig[i], contig_start[i], contig_end[i], chunk_id[i],
-                                                      position[i], index[i], predicted_base_labels[i], phred_score[i])
+
+            # the sliding window loop, softmax and overlap sums all run on the device
+            prediction_base_sums = sliding_window_model(images, hidden).cpu().numpy()
+            base_labels, phred_scores = get_base_predictions(prediction_base_sums, window_counts,
+                                                             np.empty(prediction_base_sums.shape[:2], dtype=np.intp),
+                                                             np.empty(prediction_base_sums.shape[:2], dtype=np.float32))
+
+            prediction_data_file.write_predictions(contig, contig_start.numpy(), contig_end.numpy(), chunk_id.numpy(),
+                                                   position.numpy(), index.numpy(), base_labels, phred_scores)
             if rank == 0:
                 progress_bar.update(1)
 
     if rank == 0:
         progress_bar.close()
 
+    prediction_data_file.close()
+
 
 def cleanup():
     dist.destroy_process_group()
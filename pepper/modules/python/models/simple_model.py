@@ -1,5 +1,6 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 
 class TransducerGRU(nn.Module):
@@ -46,4 +47,30 @@ class TransducerGRU(nn.Module):
         if bidirectional:
             num_directions = 2
 
-        return torch.zeros(batch_size, num_directions * num_layers, self.hidden_size)
\ No newline at end of file
+        return torch.zeros(batch_size, num_directions * num_layers, self.hidden_size)
+
+
+class SlidingWindowTransducer(nn.Module):
+    """
+    Runs a transducer over a whole image in windows of window_size bases that start window_jump bases apart, passing
+    the hidden state from one window to the next. Returns the sum of the softmax of every window covering a position.
+    The window loop is unrolled when the model is exported to ONNX, so a batch of images needs a single call.
+    """
+    def __init__(self, transducer_model, seq_length, window_size, window_jump):
+        super(SlidingWindowTransducer, self).__init__()
+        self.transducer_model = transducer_model
+        self.seq_length = seq_length
+        self.window_size = window_size
+        self.window_jump = window_jump
+
+    def forward(self, x, hidden):
+        prediction_sum = None
+        for window_start in range(0, self.seq_length - self.window_size + 1, self.window_jump):
+            window_end = window_start + self.window_size
+            output_base, hidden = self.transducer_model(x[:, window_start:window_end], hidden)
+
+            # pad the window to the full sequence length so overlapping windows add up
+            base_prediction = F.pad(torch.softmax(output_base, dim=2), (0, 0, window_start, self.seq_length - window_end))
+            prediction_sum = base_prediction if prediction_sum is None else prediction_sum + base_prediction
+
+        return prediction_sum
@@ -1,8 +1,12 @@
 import h5py
 import sys
 import re
-import time
-from pepper.modules.python.Stitch import create_consensus_sequence
+import json
+import shutil
+import concurrent.futures
+from collections import defaultdict
+from pepper.modules.python.Stitch import stitch_contig
+from pepper.modules.python.Options import StitchOptions
 from os.path import isfile, join
 from pathlib import Path
 from os import listdir
@@ -41,44 +45,91 @@ def number_key(name):
     return L
 
 
-def perform_stitch(hdf_file_path, output_path, threads):
-    all_prediction_files = get_file_paths_from_directory(hdf_file_path)
-    all_contigs = set()
-    time.sleep(5)
+def load_prediction_index(hdf_file_path, all_prediction_files):
+    """
+    Return the chunks of every contig. The index written by call_consensus is used if it exists, otherwise every
+    prediction file is scanned once.
+    :param hdf_file_path: Directory containing the prediction files
+    :param all_prediction_files: Paths to all prediction files
+    :return: Dictionary of contig to a list of (file name, chunk name, contig start, contig end) chunks
+    """
+    prediction_index = defaultdict(list)
+    prediction_index_path = join(hdf_file_path, StitchOptions.PREDICTION_INDEX_NAME)
+    if isfile(prediction_index_path):
+        with open(prediction_index_path, 'r') as prediction_index_file:
+            for contig, chunk_keys in json.load(prediction_index_file).items():
+                for file_name, chunk_key, contig_start, contig_end in chunk_keys:
+                    prediction_index[contig].append((join(hdf_file_path, file_name), chunk_key, contig_start, contig_end))
+        return prediction_index
+
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: NO PREDICTION INDEX FOUND, SCANNING PREDICTION FILES.\n")
     for prediction_file in sorted(all_prediction_files):
         with h5py.File(prediction_file, 'r') as hdf5_file:
-            contigs = list(hdf5_file['predictions'].keys())
-            all_contigs.update(contigs)
+            for contig in hdf5_file['predictions'].keys():
+                for chunk_key in sorted(hdf5_file['predictions'][contig].keys()):
+                    contig_start = hdf5_file['predictions'][contig][chunk_key]['contig_start'][()]
+                    contig_end = hdf5_file['predictions'][contig][chunk_key]['contig_end'][()]
+                    prediction_index[contig].append((prediction_file, chunk_key, contig_start, contig_end))
+
+    return prediction_index
+
+
+def stitch_contig_to_file(contig, chunk_keys, fragment_path):
+    with open(fragment_path, 'w') as fragment_file:
+        sequence_length = stitch_contig(contig, chunk_keys, fragment_file)
+    return contig, sequence_length
+
+
+def perform_stitch(hdf_file_path, output_path, threads):
+    """
+    Stitch the predictions of all contigs into a polished FASTA file.
+    :param hdf_file_path: Directory containing the prediction files
+    :param output_path: Prefix of the output file
+    :param threads: Number of threads to use
+    :return: True if all contigs were stitched
+    """
+    all_prediction_files = get_file_paths_from_directory(hdf_file_path)
+    prediction_index = load_prediction_index(hdf_file_path, all_prediction_files)
 
     output_path = output_path + '_pepper_polished.fa'
     output_directory = Path(output_path).resolve().parents[0]
     output_directory.mkdir(parents=True, exist_ok=True)
 
-    consensus_fasta_file = open(output_path, 'w')
-
-    for contig in sorted(all_contigs, key=natural_key):
-        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: PROCESSING CONTIG: " + contig + "\n")
-        sys.stderr.flush()
-        # get all the chunk keys from all the files
-        all_chunk_keys = list()
-        for prediction_file in all_prediction_files:
-            with h5py.File(prediction_file, 'r') as hdf5_file:
-                if contig not in hdf5_file['predictions'].keys():
-                    continue
-                chunk_keys = sorted(hdf5_file['predictions'][contig].keys())
-                for chunk_key in chunk_keys:
-                    contig_start = hdf5_file['predictions'][contig][chunk_key]['contig_start'][()]
-                    contig_end = hdf5_file['predictions'][contig][chunk_key]['contig_end'][()]
-                    all_chunk_keys.append((prediction_file, chunk_key, contig_start, contig_end))
+    # every contig is stitched to its own fragment, fragments are concatenated in contig order at the end
+    fragment_directory = Path(output_path + "_fragments")
+    fragment_directory.mkdir(parents=True, exist_ok=True)
+    all_contigs = sorted(prediction_index.keys(), key=natural_key)
+    fragment_paths = {contig: str(fragment_directory / (str(contig_id) + ".fa")) for contig_id, contig in enumerate(all_contigs)}
+
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: STITCHING " + str(len(all_contigs)) + " CONTIGS.\n")
+    sys.stderr.flush()
+    stitched_contigs = set()
+    failed_contigs = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=threads) as executor:
+        # contigs with the most chunks are started first so a long contig does not finish last on its own
+        futures = [executor.submit(stitch_contig_to_file, contig, prediction_index[contig], fragment_paths[contig])
+                   for contig in sorted(all_contigs, key=lambda contig: len(prediction_index[contig]), reverse=True)]
 
-        consensus_sequence = create_consensus_sequence(contig, all_chunk_keys, threads)
+        for fut in concurrent.futures.as_completed(futures):
+            if fut.exception() is None:
+                contig, sequence_length = fut.result()
+                stitched_contigs.add(contig)
+                sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: FINISHED PROCESSING " + contig + ", POLISHED SEQUENCE LENGTH: "
+                                 + str(sequence_length) + ".\n")
+            else:
+                failed_contigs += 1
+                sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] ERROR: " + str(fut.exception()) + "\n")
+            fut._result = None  # python issue 27144
 
-        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: FINISHED PROCESSING " + contig + ", POLISHED SEQUENCE LENGTH: "
-                         + str(len(consensus_sequence)) + ".\n")
+    # contigs without a sequence have empty fragments and are not written
+    with open(output_path, 'w') as consensus_fasta_file:
+        for contig in all_contigs:
+            if contig not in stitched_contigs:
+                continue
+            with open(fragment_paths[contig], 'r') as fragment_file:
+                shutil.copyfileobj(fragment_file, consensus_fasta_file)
 
-        # TODO: I should write a FASTA handler here. This is too sloppy.
-        if consensus_sequence is not None and len(consensus_sequence) > 0:
-            consensus_fasta_file.write('>' + contig + "\n")
-            consensus_fasta_file.write(consensus_sequence+"\n")
+    shutil.rmtree(fragment_directory)
 
-    hdf5_file.close()
+    # the polished sequence of a failed contig is missing from the output
+    return failed_contigs == 0
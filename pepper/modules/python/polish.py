@@ -1,11 +1,12 @@
 from pepper.build import PEPPER
 import os
 import sys
-import torch
-import time
 from pathlib import Path
 from datetime import datetime
+from pepper.version import __version__
 from pepper.modules.python.ImageGenerationUI import UserInterfaceSupport
+from pepper.modules.python.Options import PolishOptions
+from pepper.modules.python.StageMarker import is_stage_complete, write_stage_marker, reset_stage
 from pepper.modules.python.make_images import make_images
 from pepper.modules.python.call_consensus import call_consensus
 from pepper.modules.python.perform_stitch import perform_stitch
@@ -14,7 +15,8 @@ from pepper.modules.python.perform_stitch import perform_stitch
 def polish(bam_filepath, fasta_filepath, output_path, threads, region,
            model_path, batch_size, gpu_mode, device_ids, num_workers):
     """
-    Run all the sub-modules to polish an input assembly.
+    Run all the sub-modules to polish an input assembly. Every stage records its inputs, parameters and outputs when
+    it completes, re-running polish in the same output directory skips the stages that are still valid.
     """
     # check the bam file
     if not os.path.isfile(bam_filepath) or not PEPPER.BAM_handler(bam_filepath):
@@ -55,6 +57,7 @@ def polish(bam_filepath, fasta_filepath, output_path, threads, region,
 
     # check if gpu inference can be done
     if gpu_mode:
+        import torch
         if not torch.cuda.is_available():
             sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] ERROR: TORCH IS NOT BUILT WITH CUDA.\n")
             sys.stderr.write("SEE TORCH CAPABILITY:\n$ python3\n"
@@ -64,6 +67,7 @@ def polish(bam_filepath, fasta_filepath, output_path, threads, region,
 
     # check if all devices are available
     if device_ids is not None:
+        import torch
         device_ids = [int(i) for i in device_ids.split(',')]
         for device_id in device_ids:
             major_capable, minor_capable = torch.cuda.get_device_capability(device=device_id)
@@ -77,41 +81,70 @@ def polish(bam_filepath, fasta_filepath, output_path, threads, region,
                 sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: CAPABILITY OF GPU#" + str(device_id) +":\t" + str(major_capable)
                                  + "-" + str(minor_capable) + "\n")
 
-    timestr = time.strftime("%m%d%Y_%H%M%S")
-
     # run directories
     output_dir = UserInterfaceSupport.handle_output_directory(output_path)
 
-    image_output_directory = output_dir + "images_" + str(timestr) + "/"
-    prediction_output_directory = output_dir + "predictions_" + str(timestr) + "/"
+    image_output_directory = output_dir + PolishOptions.IMAGE_DIRECTORY
+    prediction_output_directory = output_dir + PolishOptions.PREDICTION_DIRECTORY
+    polished_fasta_path = output_dir + '_pepper_polished.fa'
 
-    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: RUN-ID: " + str(timestr) + "\n")
     sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: IMAGE OUTPUT: " + str(image_output_directory) + "\n")
 
-    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] STEP 1: GENERATING IMAGES\n")
-    sys.stderr.flush()
-    # call the parallelization method to generate images in parallel
-    make_images(bam_filepath,
-                fasta_filepath,
-                region,
-                image_output_directory,
-                threads)
+    # later stages take the outputs of earlier stages as inputs, so redoing a stage invalidates all stages after it
+    image_inputs = [bam_filepath, fasta_filepath]
+    image_parameters = {'region': region, 'version': __version__}
+    if is_stage_complete(output_dir, 'make_images', image_inputs, image_parameters):
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] STEP 1: SKIPPING IMAGE GENERATION, FOUND COMPLETED IMAGES.\n")
+    else:
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] STEP 1: GENERATING IMAGES\n")
+        sys.stderr.flush()
+        reset_stage(output_dir, 'make_images', image_output_directory)
+        # call the parallelization method to generate images in parallel
+        success = make_images(bam_filepath,
+                              fasta_filepath,
+                              region,
+                              image_output_directory,
+                              threads)
+        if not success:
+            sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] ERROR: IMAGE GENERATION FAILED, RE-RUN POLISH WITH THE SAME OUTPUT DIRECTORY TO RESUME.\n")
+            exit(1)
+        write_stage_marker(output_dir, 'make_images', image_inputs, image_parameters, [image_output_directory])
 
-    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] STEP 2: RUNNING INFERENCE\n")
     sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: PREDICTION OUTPUT: " + str(prediction_output_directory) + "\n")
-    sys.stderr.flush()
-    call_consensus(image_output_directory,
-                   model_path,
-                   batch_size,
-                   num_workers,
-                   prediction_output_directory,
-                   device_ids,
-                   gpu_mode,
-                   threads)
-
-    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] STEP 3: RUNNING STITCH\n")
-    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: STITCH OUTPUT: " + str(output_dir) + "\n")
-    sys.stderr.flush()
-    perform_stitch(prediction_output_directory,
-                   output_dir,
-                   threads)
+    inference_inputs = [image_output_directory, model_path]
+    inference_parameters = {'version': __version__}
+    if is_stage_complete(output_dir, 'call_consensus', inference_inputs, inference_parameters):
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] STEP 2: SKIPPING INFERENCE, FOUND COMPLETED PREDICTIONS.\n")
+    else:
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] STEP 2: RUNNING INFERENCE\n")
+        sys.stderr.flush()
+        reset_stage(output_dir, 'call_consensus', prediction_output_directory)
+        success = call_consensus(image_output_directory,
+                                 model_path,
+                                 batch_size,
+                                 num_workers,
+                                 prediction_output_directory,
+                                 device_ids,
+                                 gpu_mode,
+                                 threads)
+        if not success:
+            sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] ERROR: INFERENCE FAILED, RE-RUN POLISH WITH THE SAME OUTPUT DIRECTORY TO RESUME.\n")
+            exit(1)
+        write_stage_marker(output_dir, 'call_consensus', inference_inputs, inference_parameters, [prediction_output_directory])
+
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: STITCH OUTPUT: " + str(polished_fasta_path) + "\n")
+    stitch_inputs = [prediction_output_directory]
+    stitch_parameters = {'version': __version__}
+    if is_stage_complete(output_dir, 'perform_stitch', stitch_inputs, stitch_parameters):
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] STEP 3: SKIPPING STITCH, FOUND COMPLETED POLISHED SEQUENCE.\n")
+    else:
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] STEP 3: RUNNING STITCH\n")
+        sys.stderr.flush()
+        reset_stage(output_dir, 'perform_stitch')
+        success = perform_stitch(prediction_output_directory,
+                                 output_dir,
+                                 threads)
+        if not success:
+            sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] ERROR: STITCH FAILED, RE-RUN POLISH WITH THE SAME OUTPUT DIRECTORY TO RESUME.\n")
+            exit(1)
+        write_stage_marker(output_dir, 'perform_stitch', stitch_inputs, stitch_parameters, [polished_fasta_path])
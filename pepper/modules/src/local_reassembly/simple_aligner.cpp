@@ -17,17 +17,80 @@ LibSSWPairwiseAligner::LibSSWPairwiseAligner() {
                               Aligner_options::gap_extend_penalty);
 }
 
-Alignment LibSSWPairwiseAligner::align(string query){
-    Alignment alignment;
-    bool status = ssw_aligner->Align_cpp(query.c_str(), filter, &alignment, 0);
-    return alignment;
+bool LibSSWPairwiseAligner::align(const string& query, int reference_offset, int reference_length, Alignment& alignment){
+    return ssw_aligner->AlignAtReferenceOffset(query.c_str(), reference_offset, reference_length, filter, &alignment, 0);
 }
 
-void LibSSWPairwiseAligner::set_reference(string reference) {
+void LibSSWPairwiseAligner::set_reference(const string& reference) {
     ssw_aligner->SetReferenceSequence(reference.c_str(), reference.length());
 }
 
 
+OverlapAligner::OverlapAligner(const int& match, const int& mismatch, const int& gap_open_penalty,
+                               const int& gap_extend_penalty, const int& min_match_length)
+    : ssw_aligner(match, mismatch, gap_open_penalty, gap_extend_penalty), min_match_length(min_match_length) {
+}
+
+pair<int, int> OverlapAligner::get_join_positions(const Alignment& alignment) {
+    // the first aligned block of at least min_match_length bases is where the two sequences are joined
+    int reference_index = alignment.ref_begin;
+    int query_index = 0;
+
+    size_t cigar_index = 0;
+    while(cigar_index < alignment.cigar.size()) {
+        char cigar_op = cigar_int_to_op(alignment.cigar[cigar_index]);
+        bool is_match = cigar_op == 'M' || cigar_op == '=' || cigar_op == 'X';
+        int cigar_len = cigar_int_to_len(alignment.cigar[cigar_index]);
+
+        // matches and mismatches next to each other are one aligned block
+        size_t next_index = cigar_index + 1;
+        for(; next_index < alignment.cigar.size(); next_index++) {
+            char next_op = cigar_int_to_op(alignment.cigar[next_index]);
+            bool next_is_match = next_op == 'M' || next_op == '=' || next_op == 'X';
+            if((is_match && !next_is_match) || (!is_match && next_op != cigar_op)) break;
+            cigar_len += cigar_int_to_len(alignment.cigar[next_index]);
+        }
+
+        if(is_match && cigar_len >= min_match_length) {
+            return make_pair(reference_index, query_index);
+        }
+
+        if(is_match) {
+            reference_index += cigar_len;
+            query_index += cigar_len;
+        } else if(cigar_op == 'S' || cigar_op == 'I') {
+            query_index += cigar_len;
+        } else if(cigar_op == 'D') {
+            reference_index += cigar_len;
+        } else {
+            throw std::invalid_argument("INVALID CIGAR OPERATION ENCOUNTERED WHILE STITCHING: " + string(1, cigar_op));
+        }
+        cigar_index = next_index;
+    }
+
+    return make_pair(-1, -1);
+}
+
+vector<pair<int, int> > OverlapAligner::align_overlaps(const vector<pair<string, string> >& overlaps) {
+    // every overlap is a (reference, query) pair, (-1, -1) is returned for overlaps that can not be joined
+    vector<pair<int, int> > join_positions;
+    join_positions.reserve(overlaps.size());
+
+    Alignment alignment;
+    for(const auto& overlap : overlaps) {
+        alignment.Clear();
+        ssw_aligner.SetReferenceSequence(overlap.first.c_str(), overlap.first.length());
+        ssw_aligner.Align_cpp(overlap.second.c_str(), filter, &alignment, 0);
+
+        if(alignment.sw_score == 0) {
+            join_positions.push_back(make_pair(-1, -1));
+        } else {
+            join_positions.push_back(get_join_positions(alignment));
+        }
+    }
+    return join_positions;
+}
+
 int CigarOperationFromChar(char op) {
     switch (op) {
         case '=':
@@ -61,12 +124,14 @@ ReadAligner::ReadAligner(int ref_start, int ref_end, string ref_seq) {
     reference_sequence = ref_seq;
     region_start = ref_start;
     region_end = ref_end;
+    // the reference is translated once per region, every read is aligned to a window of it
+    SSWAligner.set_reference(reference_sequence);
 }
 
-vector<type_read> ReadAligner::align_reads_to_reference(vector<type_read> reads) {
-    // set the reference sequence
-//    SSWAligner.set_reference(reference_sequence);
+vector<type_read> ReadAligner::align_reads_to_reference(const vector<type_read>& reads) {
     vector<type_read> realigned_reads;
+    realigned_reads.reserve(reads.size());
+    Alignment alignment;
     for(auto &read: reads) {
 //        cout<<read.pos<<" "<<read.pos_end<<" "<<region_start<<" "<<region_end<<" "<<endl;
         if(read.pos < region_start) {
@@ -75,13 +140,15 @@ vector<type_read> ReadAligner::align_reads_to_reference(vector<type_read> reads)
             continue;
         }
         long long reference_start_index = read.pos - region_start;
-        // do a left trim of the sequence and set as a reference sequence
-        SSWAligner.set_reference(reference_sequence.substr(reference_start_index));
+        // the window covers the original alignment of the read, or the read length if that is longer, and some
+        // padding, reads are cut to the region so the window stays short even for long reads
+        long long reference_window_length = max(read.pos_end - read.pos, (long long) read.sequence.length())
+                                            + Aligner_options::reference_window_padding;
 
-        // go through each of the alignments and try to align it
-        Alignment alignment = SSWAligner.align(read.sequence);
+        // align the read to its reference window
+        bool aligned = SSWAligner.align(read.sequence, reference_start_index, reference_window_length, alignment);
 
-        if(alignment.sw_score > 1) {
+        if(aligned && alignment.sw_score > 1) {
             // create a new read
             type_read realigned_read;
             realigned_read = read;
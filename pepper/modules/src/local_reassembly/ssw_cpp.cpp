@@ -6,6 +6,7 @@
 #include "../../headers/realignment/ssw.h"
 
 #include <sstream>
+#include <algorithm>
 
 namespace {
 
@@ -328,9 +329,17 @@ int Aligner::TranslateBase(const char* bases, const int& length,
 
 bool Aligner::Align_cpp(const char* query, const Filter& filter,
                     Alignment* alignment, const int32_t maskLen) const
+{
+  return AlignAtReferenceOffset(query, 0, reference_length_, filter, alignment, maskLen);
+}
+
+bool Aligner::AlignAtReferenceOffset(const char* query, const int32_t& ref_offset, const int32_t& ref_len,
+                                     const Filter& filter, Alignment* alignment, const int32_t maskLen) const
 {
   if (!translation_matrix_) return false;
-  if (reference_length_ == 0) return false;
+  if (ref_offset < 0 || ref_offset >= reference_length_) return false;
+  int32_t valid_ref_len = std::min(ref_len, reference_length_ - ref_offset);
+  if (valid_ref_len <= 0) return false;
 
   int query_len = strlen(query);
   if (query_len == 0) return false;
@@ -343,14 +352,15 @@ bool Aligner::Align_cpp(const char* query, const Filter& filter,
 
   uint8_t flag = 0;
   SetFlag(filter, &flag);
-  s_align* s_al = ssw_align(profile, translated_reference_, reference_length_,
+  const int8_t* translated_reference = translated_reference_ + ref_offset;
+  s_align* s_al = ssw_align(profile, translated_reference, valid_ref_len,
                                  static_cast<int>(gap_opening_penalty_),
 				 static_cast<int>(gap_extending_penalty_),
 				 flag, filter.score_filter, filter.distance_filter, maskLen);
 
   alignment->Clear();
   ConvertAlignment(*s_al, query_len, alignment);
-  alignment->mismatches = CalculateNumberMismatch(&*alignment, translated_reference_, translated_query, query_len);
+  alignment->mismatches = CalculateNumberMismatch(&*alignment, translated_reference, translated_query, query_len);
 
 
   // Free memory
@@ -10,6 +10,13 @@ SummaryGenerator::SummaryGenerator(string reference_sequence, string chromosome_
     this->ref_start = ref_start;
     this->ref_end = ref_end;
     this->chromosome_name = chromosome_name;
+
+    long long region_length = ref_end - ref_start + 1;
+    base_summaries.assign(region_length * ImageOptions::IMAGE_FEATURES, 0);
+    coverage.assign(region_length, 0);
+    longest_insert_count.assign(region_length, 0);
+    base_labels.assign(region_length, 0);
+    insert_offset.assign(region_length + 1, 0);
 }
 
 
@@ -44,7 +51,54 @@ uint8_t get_labels(char base) {
 }
 
 
-void SummaryGenerator::iterate_over_read(type_read read, long long region_start, long long region_end) {
+void SummaryGenerator::count_inserts(const vector <type_read> &reads, long long region_end) {
+    // the longest insert after a position decides how many rows the position gets in the image, finding all of them
+    // with a pass over the cigar strings lets the insert counts of the region live in a single array
+    for (auto &read:reads) {
+        if(read.mapping_quality <= 0) continue;
+
+        int read_index = 0;
+        long long ref_position = read.pos;
+        for (auto &cigar: read.cigar_tuples) {
+            if (ref_position > region_end) break;
+            switch (cigar.operation) {
+                case CIGAR_OPERATIONS::EQUAL:
+                case CIGAR_OPERATIONS::DIFF:
+                case CIGAR_OPERATIONS::MATCH:
+                    read_index += cigar.length;
+                    ref_position += cigar.length;
+                    break;
+                case CIGAR_OPERATIONS::IN:
+                    if (in_reference(ref_position - 1)) {
+                        int insert_length = min((long long) cigar.length, max(0LL, (long long) read.sequence.length() - read_index));
+                        int &longest_insert = longest_insert_count[ref_position - 1 - ref_start];
+                        longest_insert = max(longest_insert, insert_length);
+                    }
+                    read_index += cigar.length;
+                    break;
+                case CIGAR_OPERATIONS::REF_SKIP:
+                case CIGAR_OPERATIONS::PAD:
+                case CIGAR_OPERATIONS::DEL:
+                    ref_position += cigar.length;
+                    break;
+                case CIGAR_OPERATIONS::SOFT_CLIP:
+                    read_index += cigar.length;
+                    break;
+                case CIGAR_OPERATIONS::HARD_CLIP:
+                    break;
+            }
+        }
+    }
+
+    for (size_t i = 0; i < longest_insert_count.size(); i++) {
+        insert_offset[i + 1] = insert_offset[i] + longest_insert_count[i];
+    }
+    insert_summaries.assign(insert_offset.back() * ImageOptions::IMAGE_FEATURES, 0);
+    insert_labels.assign(insert_offset.back(), 0);
+}
+
+
+void SummaryGenerator::iterate_over_read(const type_read &read, long long region_start, long long region_end) {
     int read_index = 0;
     long long ref_position = read.pos;
     int cigar_index = 0;
@@ -70,8 +124,8 @@ void SummaryGenerator::iterate_over_read(type_read read, long long region_start,
                         char base = read.sequence[read_index];
 
                         // update the summary of base
-                        base_summaries[make_pair(ref_position, get_feature_index(base, read.flags.is_reverse))] += 1.0;
-                        coverage[ref_position] += 1.0;
+                        base_summaries[reference_index * ImageOptions::IMAGE_FEATURES + get_feature_index(base, read.flags.is_reverse)] += 1;
+                        coverage[reference_index] += 1;
 
                     }
                     read_index += 1;
@@ -84,15 +138,14 @@ void SummaryGenerator::iterate_over_read(type_read read, long long region_start,
 
                 if (ref_position - 1 >= ref_start &&
                     ref_position - 1 <= ref_end) {
-                    // process insert allele here
-                    string alt;
-                    alt = read.sequence.substr(read_index, cigar.length);
-                    for (int i = 0; i < cigar.length; i++) {
-                        pair<long long, int> position_pair = make_pair(ref_position - 1, i);
-                        insert_summaries[make_pair(position_pair, get_feature_index(alt[i], read.flags.is_reverse))] += 1.0;
+                    // process insert allele here, inserts longer than counted by count_inserts are cut
+                    long long insert_length = min((long long) longest_insert_count[reference_index],
+                                                  min((long long) cigar.length, (long long) read.sequence.length() - read_index));
+                    for (int i = 0; i < insert_length; i++) {
+                        char base = read.sequence[read_index + i];
+                        insert_summaries[(insert_offset[reference_index] + i) * ImageOptions::IMAGE_FEATURES +
+                                         get_feature_index(base, read.flags.is_reverse)] += 1;
                     }
-                    longest_insert_count[ref_position - 1] = std::max(longest_insert_count[ref_position - 1],
-                                                                      (long long) alt.length());
                 }
                 read_index += cigar.length;
                 break;
@@ -105,8 +158,9 @@ void SummaryGenerator::iterate_over_read(type_read read, long long region_start,
                 for (int i = 0; i < cigar.length; i++) {
                     if (ref_position + i >= ref_start && ref_position + i <= ref_end) {
                         // update the summary of base
-                        base_summaries[make_pair(ref_position + i, get_feature_index('*', read.flags.is_reverse))] += 1.0;
-                        coverage[ref_position] += 1.0;
+                        base_summaries[(ref_position + i - ref_start) * ImageOptions::IMAGE_FEATURES + get_feature_index('*', read.flags.is_reverse)] += 1;
+                        // the coverage of a deletion is counted at its first position
+                        if (in_reference(ref_position)) coverage[ref_position - ref_start] += 1;
                     }
                 }
                 ref_position += cigar.length;
@@ -139,7 +193,7 @@ bool check_base(char base) {
     return false;
 }
 
-void SummaryGenerator::generate_labels(type_read read, long long region_start, long long region_end) {
+void SummaryGenerator::generate_labels(const type_read &read, long long region_start, long long region_end) {
     int read_index = 0;
     long long ref_position = read.pos;
     int cigar_index = 0;
@@ -163,7 +217,7 @@ void SummaryGenerator::generate_labels(type_read read, long long region_start, l
 //                    cout<<ref_position<<" "<<ref_end<<" "<<region_end<<endl;
                     if (ref_position >= ref_start && ref_position <= ref_end) {
                         char base = read.sequence[read_index];
-                        base_labels[ref_position] = base;
+                        base_labels[reference_index] = base;
                     }
                     read_index += 1;
                     ref_position += 1;
@@ -174,16 +228,14 @@ void SummaryGenerator::generate_labels(type_read read, long long region_start, l
                 if (ref_position - 1 >= ref_start &&
                     ref_position - 1 <= ref_end) {
                     // process insert allele here
-                    string alt;
-                    alt = read.sequence.substr(read_index, cigar.length);
+                    long long alt_length = min((long long) cigar.length, (long long) read.sequence.length() - read_index);
 
-                    for (int i = 0; i < longest_insert_count[ref_position - 1]; i++) {
+                    for (int i = 0; i < longest_insert_count[reference_index]; i++) {
                         char base = '#';
-                        if (i < alt.length()) {
-                            base = alt[i];
+                        if (i < alt_length) {
+                            base = read.sequence[read_index + i];
                         }
-                        pair<long long, int> position_pair = make_pair(ref_position - 1, i);
-                        insert_labels[position_pair] = base;
+                        insert_labels[insert_offset[reference_index] + i] = base;
                     }
                 }
                 read_index += cigar.length;
@@ -198,8 +250,7 @@ void SummaryGenerator::generate_labels(type_read read, long long region_start, l
                     for (int i = 0; i < cigar.length; i++) {
                         if (ref_position + i >= ref_start && ref_position + i <= ref_end) {
                             // DELETE
-                            char base = '*';
-                            base_labels[ref_position + i] = '*';
+                            base_labels[ref_position + i - ref_start] = '*';
                         }
                     }
                 }
@@ -220,19 +271,16 @@ void SummaryGenerator::debug_print(long long start_pos, long long end_pos) {
     for (int i = start_pos; i <= end_pos; i++) {
         if(i==start_pos) cout<<"REF:\t";
         cout << "  " << reference_sequence[i - start_pos] << "\t";
-        if (longest_insert_count[i] > 0) {
-            for (int ii = 0; ii < longest_insert_count[i]; ii++)cout << "  *" << "\t";
-        }
+        for (int ii = 0; ii < get_longest_insert(i); ii++) cout << "  *" << "\t";
     }
     cout << endl;
     for (int i = start_pos; i <= end_pos; i++) {
         if(i==start_pos) cout<<"TRH:\t";
-        cout << "  " <<base_labels[i] << "\t";
-        if (longest_insert_count[i] > 0) {
-            for (int ii = 0; ii < longest_insert_count[i]; ii++) {
-                if (insert_labels[make_pair(i, ii)]) cout << "  "<< insert_labels[make_pair(i, ii)] << "\t";
-                else cout << "  *" << "\t";
-            }
+        cout << "  " << get_base_label(i) << "\t";
+        for (int ii = 0; ii < get_longest_insert(i); ii++) {
+            char insert_label = insert_labels[insert_offset[i - ref_start] + ii];
+            if (insert_label) cout << "  "<< insert_label << "\t";
+            else cout << "  *" << "\t";
         }
     }
     cout << endl;
@@ -251,7 +299,7 @@ void SummaryGenerator::debug_print(long long start_pos, long long end_pos) {
     cout << endl;
 
     cout << "-------------" << endl;
-    for (int i = 0; i < image[0].size(); i++) {
+    for (int i = 0; i < ImageOptions::IMAGE_FEATURES; i++) {
         if(i==0)cout<<"AFW:\t";
         if(i==1)cout<<"CFW:\t";
         if(i==2)cout<<"GFW:\t";
@@ -263,8 +311,8 @@ void SummaryGenerator::debug_print(long long start_pos, long long end_pos) {
         if(i==8)cout<<"GFW:\t";
         if(i==9)cout<<"GRV:\t";
 
-        for (int j = 0; j < image.size(); j++) {
-            printf("%3d\t", image[j][i]);
+        for (int j = 0; j < image.size() / ImageOptions::IMAGE_FEATURES; j++) {
+            printf("%3d\t", image[j * ImageOptions::IMAGE_FEATURES + i]);
         }
         cout << endl;
     }
@@ -273,36 +321,31 @@ void SummaryGenerator::debug_print(long long start_pos, long long end_pos) {
 
 void SummaryGenerator::generate_image(long long start_pos, long long end_pos) {
     // at this point labels and positions are generated, now generate the pileup
+    image.reserve(image.size() + genomic_pos.size() * ImageOptions::IMAGE_FEATURES);
     for (long long i = start_pos; i <= end_pos; i++) {
-        vector<uint8_t> row;
-        uint8_t pixel_value = 0;
-        // iterate through the summaries
-        for(int j = 0; j <= 9; j++) {
-            pixel_value = (base_summaries[make_pair(i, j)] / max(1.0, coverage[i])) * ImageOptions::MAX_COLOR_VALUE;
-            row.push_back(pixel_value);
+        if (!in_reference(i)) {
+            image.insert(image.end(), ImageOptions::IMAGE_FEATURES, 0);
+            continue;
         }
-//        assert(row.size() == 10);
-        image.push_back(row);
-
-        if (longest_insert_count[i] > 0) {
+        double position_coverage = max(1.0, get_coverage(i));
 
-            for (int ii = 0; ii < longest_insert_count[i]; ii++) {
-                vector<uint8_t> ins_row;
+        // iterate through the summaries
+        const int* base_counts = &base_summaries[(i - ref_start) * ImageOptions::IMAGE_FEATURES];
+        for(int j = 0; j < ImageOptions::IMAGE_FEATURES; j++) {
+            uint8_t pixel_value = (base_counts[j] / position_coverage) * ImageOptions::MAX_COLOR_VALUE;
+            image.push_back(pixel_value);
+        }
 
-                // iterate through the summaries
-                for(int j = 0; j <= 9; j++) {
-                    if (j >= 0 && j <=9) {
-                        pixel_value = (insert_summaries[make_pair(make_pair(i, ii), j)] /
-                                max(1.0, coverage[i])) * ImageOptions::MAX_COLOR_VALUE ;
-                        ins_row.push_back(pixel_value);
-                    }
-                }
-//                assert(ins_row.size() == 10);
-                image.push_back(ins_row);
+        for (int ii = 0; ii < longest_insert_count[i - ref_start]; ii++) {
+            // iterate through the summaries
+            const int* insert_counts = &insert_summaries[(insert_offset[i - ref_start] + ii) * ImageOptions::IMAGE_FEATURES];
+            for(int j = 0; j < ImageOptions::IMAGE_FEATURES; j++) {
+                uint8_t pixel_value = (insert_counts[j] / position_coverage) * ImageOptions::MAX_COLOR_VALUE;
+                image.push_back(pixel_value);
             }
         }
     }
-//    assert(image.size() == genomic_pos.size());
+//    assert(image.size() == genomic_pos.size() * ImageOptions::IMAGE_FEATURES);
 }
 
 
@@ -312,6 +355,7 @@ void SummaryGenerator::generate_train_summary(vector <type_read> &reads,
                                               long long end_pos,
                                               type_read truth_read) {
 
+    count_inserts(reads, end_pos);
 
     for (auto &read:reads) {
         // this populates base_summaries and insert_summaries dictionaries
@@ -326,30 +370,31 @@ void SummaryGenerator::generate_train_summary(vector <type_read> &reads,
     // after all the dictionaries are populated, we can simply walk through the region and generate a sequence
     for (long long pos = start_pos; pos <= end_pos; pos++) {
 
-        if(coverage[pos] > 0) {
-            labels.push_back(get_labels(base_labels[pos]));
+        if(get_coverage(pos) > 0) {
+            labels.push_back(get_labels(get_base_label(pos)));
         } else {
             labels.push_back(get_labels('*'));
         }
 
         // if the label contains anything but ACTG
-        if(!check_base(base_labels[pos])) {
+        if(!check_base(get_base_label(pos))) {
 //            cerr<<"INFO: INVALID REFERENCE BASE INDEX FOUND: ["<<chromosome_name<<":"<<start_pos<<"-"<<end_pos<<"] " <<
 //                pos<<" "<<" "<<base_labels[pos]<<endl;
             bad_label_positions.push_back(labels.size());
         }
 
         genomic_pos.push_back(make_pair(pos, 0));
-        if (longest_insert_count[pos] > 0) {
-            for (int ii = 0; ii < longest_insert_count[pos]; ii++) {
+        if (get_longest_insert(pos) > 0) {
+            for (int ii = 0; ii < get_longest_insert(pos); ii++) {
                 genomic_pos.push_back(make_pair(pos, ii + 1));
-                if (insert_labels[make_pair(pos, ii)]) {
-                    labels.push_back(get_labels(insert_labels[make_pair(pos, ii)]));
+                char insert_label = insert_labels[insert_offset[pos - ref_start] + ii];
+                if (insert_label) {
+                    labels.push_back(get_labels(insert_label));
 
                     // if the label contains anything but ACTG
-                    if(!check_base(insert_labels[make_pair(pos, ii)])) {
+                    if(!check_base(insert_label)) {
 //                        cerr<<"INFO: INVALID REFERENCE INSERT BASE INDEX FOUND: "<<chromosome_name<<" "<<
-//                            pos<<" "<<insert_labels[make_pair(pos, ii)]<<endl;
+//                            pos<<" "<<insert_label<<endl;
                         bad_label_positions.push_back(labels.size());
                     }
                 }
@@ -370,6 +415,8 @@ void SummaryGenerator::generate_train_summary(vector <type_read> &reads,
 void SummaryGenerator::generate_summary(vector <type_read> &reads,
                                         long long start_pos,
                                         long long end_pos) {
+    count_inserts(reads, end_pos);
+
     for (auto &read:reads) {
         // this populates base_summaries and insert_summaries dictionaries
         if(read.mapping_quality > 0) {
@@ -380,10 +427,8 @@ void SummaryGenerator::generate_summary(vector <type_read> &reads,
     // after all the dictionaries are populated, we can simply walk through the region and generate a sequence
     for (long long pos = start_pos; pos <= end_pos; pos++) {
         genomic_pos.push_back(make_pair(pos, 0));
-        if (longest_insert_count[pos] > 0) {
-            for (int ii = 0; ii < longest_insert_count[pos]; ii++) {
-                genomic_pos.push_back(make_pair(pos, ii + 1));
-            }
+        for (int ii = 0; ii < get_longest_insert(pos); ii++) {
+            genomic_pos.push_back(make_pair(pos, ii + 1));
         }
     }
 
@@ -1,6 +1,5 @@
 import argparse
 import sys
-import torch
 from pepper.version import __version__
 from pepper.modules.python.polish import polish
 from datetime import datetime
@@ -356,6 +355,7 @@ def main():
         download_models(FLAGS.output_dir)
 
     elif FLAGS.sub_command == 'torch_stat':
+        import torch
         sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: TORCH VERSION: " + str(torch.__version__) + "\n\n")
         sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: PARALLEL CONFIG:\n")
         print(torch.__config__.parallel_info())
@@ -46,6 +46,19 @@ def add_call_variant_arguments(parser):
         type=int,
         help="Number of threads to use."
     )
+    parser.add_argument(
+        "--image_generation_processes",
+        type=int,
+        required=False,
+        default=None,
+        help="Number of processes used for image generation. If not set then it is the number of threads. Default is None."
+    )
+    parser.add_argument(
+        "--cpu_affinity",
+        default=False,
+        action='store_true',
+        help="If set then each worker process is pinned to its own set of CPUs on one NUMA node. Default is False."
+    )
     # Image generation optional parameters
     parser.add_argument(
         "-d",
@@ -74,7 +87,8 @@ def add_call_variant_arguments(parser):
         type=str,
         required=False,
         default=None,
-        help="Bed file to process regions only in the bed region. Default is None."
+        help="Bed file of target regions. Only the padded target regions are processed, use it for panels and exomes. "
+             "Default is None."
     )
     parser.add_argument(
         "-hp",
@@ -190,6 +204,21 @@ def add_call_variant_arguments(parser):
         default=4,
         help="Number of callers to initialize per GPU. Default is 4"
     )
+    parser.add_argument(
+        "--callers",
+        type=int,
+        required=False,
+        default=None,
+        help="Number of callers for CPU inference. If not set then it is derived from the number of threads. Default is None."
+    )
+    parser.add_argument(
+        "--threads_per_caller",
+        type=int,
+        required=False,
+        default=None,
+        help="Number of threads per caller for CPU inference. If not set then threads are split evenly between callers.\n"
+             "Default is None."
+    )
     parser.add_argument(
         "-d_ids",
         "--device_ids",
@@ -213,6 +242,38 @@ def add_call_variant_arguments(parser):
         action='store_false',
         help="Do not use quantization for inference while on CPU inference mode. Speeds up inference."
     )
+    parser.add_argument(
+        "--static_quantized_model",
+        type=str,
+        required=False,
+        default=None,
+        help="Path to a statically quantized ONNX model generated with pepper_variant_train quantize_model.\n"
+             "If set then this model is used for CPU inference. Default is None."
+    )
+    parser.add_argument(
+        "--cascade_model",
+        type=str,
+        required=False,
+        default=None,
+        help="Path to a cascade model generated with pepper_variant_train train_cascade.\n"
+             "If set then candidates the cascade is confident about skip the network during CPU inference. Default is None."
+    )
+    parser.add_argument(
+        "--shared_session",
+        default=False,
+        action='store_true',
+        help="If set then CPU inference runs one multi-threaded session fed by light-weight image readers\n"
+             "instead of one single-threaded session per thread. Memory usage stays constant with thread count.\n"
+             "Requires python 3.8 or newer."
+    )
+    parser.add_argument(
+        "--tune_profile",
+        type=str,
+        required=False,
+        default=None,
+        help="Path to a profile generated with the tune sub-command. If set then the number of image generation\n"
+             "processes, callers, threads per caller and batch size are taken from the profile. Default is None."
+    )
     parser.add_argument(
         "-w",
         "--num_workers",
@@ -46,6 +46,12 @@ def add_find_candidates_arguments(parser):
         type=int,
         help="Number of threads."
     )
+    parser.add_argument(
+        "--cpu_affinity",
+        default=False,
+        action='store_true',
+        help="If set then each worker process is pinned to its own set of CPUs on one NUMA node. Default is False."
+    )
     parser.add_argument(
         "-hp",
         "--use_hp_info",
@@ -32,6 +32,19 @@ def add_make_images_arguments(parser):
         type=int,
         help="Number of threads to use."
     )
+    parser.add_argument(
+        "--image_generation_processes",
+        type=int,
+        required=False,
+        default=None,
+        help="Number of processes used for image generation. If not set then it is the number of threads. Default is None."
+    )
+    parser.add_argument(
+        "--cpu_affinity",
+        default=False,
+        action='store_true',
+        help="If set then each worker process is pinned to its own set of CPUs on one NUMA node. Default is False."
+    )
     parser.add_argument(
         "-d",
         "--downsample_rate",
@@ -59,7 +72,8 @@ def add_make_images_arguments(parser):
         type=str,
         required=False,
         default=None,
-        help="Bed file to process regions only in the bed region. Default is None."
+        help="Bed file to process regions only in the bed region. Outside of training only the padded target regions "
+             "are processed, use it for panels and exomes. Default is None."
     )
     parser.add_argument(
         "-hp",
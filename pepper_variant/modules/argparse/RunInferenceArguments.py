@@ -47,6 +47,30 @@ def add_run_inference_arguments(parser):
         action='store_false',
         help="Do not use quantization for inference while on CPU inference mode. Speeds up inference."
     )
+    parser.add_argument(
+        "--static_quantized_model",
+        type=str,
+        required=False,
+        default=None,
+        help="Path to a statically quantized ONNX model generated with pepper_variant_train quantize_model.\n"
+             "If set then this model is used for CPU inference. Default is None."
+    )
+    parser.add_argument(
+        "--cascade_model",
+        type=str,
+        required=False,
+        default=None,
+        help="Path to a cascade model generated with pepper_variant_train train_cascade.\n"
+             "If set then candidates the cascade is confident about skip the network during CPU inference. Default is None."
+    )
+    parser.add_argument(
+        "--shared_session",
+        default=False,
+        action='store_true',
+        help="If set then CPU inference runs one multi-threaded session fed by light-weight image readers\n"
+             "instead of one single-threaded session per thread. Memory usage stays constant with thread count.\n"
+             "Requires python 3.8 or newer."
+    )
     parser.add_argument(
         "-g",
         "--gpu",
@@ -88,6 +112,27 @@ def add_run_inference_arguments(parser):
         default=8,
         help="Total threads. Default is 8."
     )
+    parser.add_argument(
+        "--callers",
+        type=int,
+        required=False,
+        default=None,
+        help="Number of callers for CPU inference. If not set then it is derived from the number of threads. Default is None."
+    )
+    parser.add_argument(
+        "--threads_per_caller",
+        type=int,
+        required=False,
+        default=None,
+        help="Number of threads per caller for CPU inference. If not set then threads are split evenly between callers.\n"
+             "Default is None."
+    )
+    parser.add_argument(
+        "--cpu_affinity",
+        default=False,
+        action='store_true',
+        help="If set then each worker process is pinned to its own set of CPUs on one NUMA node. Default is False."
+    )
     parser.add_argument(
         "-hp",
         "--use_hp_info",
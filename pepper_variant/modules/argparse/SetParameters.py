@@ -12,7 +12,7 @@ def set_parameters(options):
     if options.ont_r9_guppy5_sup:
         sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: ONT VARIANT CALLING MODE SELECTED.\n")
         # image generation
-        if options.sub_command in ['call_variant', 'make_images', 'make_train_images']:
+        if options.sub_command in ['call_variant', 'tune', 'make_images', 'make_train_images']:
             if options.min_mapq is None:
                 options.min_mapq = 5
             if options.min_snp_baseq is None:
@@ -67,7 +67,7 @@ def set_parameters(options):
     if options.ont_r9_guppy4_hac:
         sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: ONT VARIANT CALLING MODE SELECTED.\n")
         # image generation
-        if options.sub_command in ['call_variant', 'make_images', 'make_train_images']:
+        if options.sub_command in ['call_variant', 'tune', 'make_images', 'make_train_images']:
             if options.min_mapq is None:
                 options.min_mapq = 5
             if options.min_snp_baseq is None:
@@ -122,7 +122,7 @@ def set_parameters(options):
     if options.ont_r10_q20:
         sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: ONT VARIANT CALLING MODE SELECTED.\n")
         # image generation
-        if options.sub_command in ['call_variant', 'make_images', 'make_train_images']:
+        if options.sub_command in ['call_variant', 'tune', 'make_images', 'make_train_images']:
             if options.min_mapq is None:
                 options.min_mapq = 1
             if options.min_snp_baseq is None:
@@ -176,7 +176,7 @@ def set_parameters(options):
     elif options.hifi:
         sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: HiFi VARIANT CALLING MODE SELECTED.\n")
         # image generation
-        if options.sub_command in ['call_variant', 'make_images', 'make_train_images']:
+        if options.sub_command in ['call_variant', 'tune', 'make_images', 'make_train_images']:
             if options.min_mapq is None:
                 options.min_mapq = 5
             if options.min_snp_baseq is None:
@@ -230,7 +230,7 @@ def set_parameters(options):
     elif options.clr:
         sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: CLR VARIANT CALLING MODE SELECTED.\n")
         # image generation
-        if options.sub_command in ['call_variant', 'make_images', 'make_train_images']:
+        if options.sub_command in ['call_variant', 'tune', 'make_images', 'make_train_images']:
             if options.min_mapq is None:
                 options.min_mapq = 5
             if options.min_snp_baseq is None:
@@ -287,7 +287,7 @@ def set_parameters(options):
     else:
         sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: MODE: PEPPER\n")
 
-    if options.sub_command in ['call_variant', 'make_images', 'make_train_images']:
+    if options.sub_command in ['call_variant', 'tune', 'make_images', 'make_train_images']:
         sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: THRESHOLDS ARE SET TO: \n")
         sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: MIN MAPQ:\t\t\t\t" + str(options.min_mapq) + "\n")
         sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: MIN SNP BASEQ:\t\t\t" + str(options.min_snp_baseq) + "\n")
@@ -0,0 +1,19 @@
+from pepper_variant.modules.argparse.CallVariantsArguments import add_call_variant_arguments
+
+
+def add_tune_arguments(parser):
+    """
+    Add arguments to a parser for sub-command "tune". Tune takes the same arguments as call_variant so the trials run
+    on the actual input with the same parameters.
+    :param parser: argeparse object
+    :return:
+    """
+    add_call_variant_arguments(parser)
+    parser.add_argument(
+        "--tune_intervals",
+        type=int,
+        required=False,
+        default=None,
+        help="Number of intervals sampled from the input for the trials. Default is two per thread."
+    )
+    return parser
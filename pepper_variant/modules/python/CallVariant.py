@@ -1,11 +1,11 @@
 import os
 import sys
-import torch
 import time
 from datetime import datetime
 from pepper_variant.modules.python.ImageGenerationUI import ImageGenerationUtils
 from pepper_variant.modules.python.RunInference import run_inference
 from pepper_variant.modules.python.FindCandidates import process_candidates
+from pepper_variant.modules.python.TuneModule import load_tune_profile
 from pepper_variant.build import PEPPER_VARIANT
 
 
@@ -46,8 +46,16 @@ def call_variant(options):
         sys.stderr.write("ERROR: num_workers NEEDS TO BE >=0.\n")
         exit(1)
 
+    # load a tuned profile
+    if options.tune_profile is not None:
+        if not os.path.isfile(options.tune_profile):
+            sys.stderr.write("ERROR: CAN NOT LOCATE TUNE PROFILE.\n")
+            exit(1)
+        load_tune_profile(options)
+
     # check if gpu inference can be done
     if options.gpu:
+        import torch
         if not torch.cuda.is_available():
             sys.stderr.write("ERROR: TORCH IS NOT BUILT WITH CUDA.\n")
             sys.stderr.write("SEE TORCH CAPABILITY:\n$ python3\n"
@@ -57,6 +65,7 @@ def call_variant(options):
 
     # check if all devices are available
     if options.device_ids is not None:
+        import torch
         device_ids = [int(i) for i in options.device_ids.split(',')]
         options.device_ids = device_ids
         for device_id in options.device_ids:
@@ -1,12 +1,14 @@
 import h5py
 import sys
 import math
+import heapq
+import pickle
 from os.path import isfile, join
 from os import listdir
 import concurrent.futures
 import numpy as np
-from collections import defaultdict
 from pepper_variant.modules.python.Options import PEPPERVariantCandidateFinderOptions, ImageSizeOptions
+from pepper_variant.modules.python.CpuAffinity import get_placement, pin_worker
 from pepper_variant.build import PEPPER_VARIANT
 
 
@@ -353,7 +355,61 @@ def sequence_entropy(sequence):
 
     return entropy
 
-def small_chunk_stitch(options, file_chunks):
+def get_allele_matrix(candidates, total_candidates):
+    """
+    Return the alleles of a batch of candidates as a matrix of strings with one row per candidate.
+    :param candidates: Alleles of each candidate as stored in the prediction file
+    :param total_candidates: Number of candidates in the batch
+    :return: Matrix of allele strings, the first character of an allele is its type
+    """
+    alleles = np.asarray(candidates).reshape(total_candidates, -1)
+    if alleles.dtype == object:
+        alleles = alleles.astype('S' if alleles.size > 0 and isinstance(alleles.flat[0], bytes) else 'U')
+    if alleles.dtype.kind == 'S':
+        alleles = np.char.decode(alleles, 'UTF-8')
+    return alleles
+
+
+def get_allele_masks(options, depths, alleles, candidate_frequencies, non_alt_predictions):
+    """
+    Apply the per-allele checks of candidate finding to a batch of candidates as array operations. The p-value checks
+    depend on whether the candidate is in a low complexity region, which needs the reference, so they are computed for
+    both cases.
+    :param options: Options for candidate finding
+    :param depths: Depth of each candidate
+    :param alleles: Matrix of allele strings of each candidate
+    :param candidate_frequencies: Matrix of allele frequencies of each candidate
+    :param non_alt_predictions: Best non-reference prediction of each candidate
+    :return: Valid allele mask, p-value masks outside and inside low complexity regions and reporting frequency mask
+    """
+    allele_types = alleles.astype('U1')
+    # an allele is valid if only its type remains once the A, C, G and T bases are removed
+    valid_alleles = (np.char.str_len(alleles) > 0) & (np.char.translate(alleles, {ord(base): None for base in 'ACGT'}) == allele_types)
+    is_snp = valid_alleles & (allele_types == '1')
+    is_insert = valid_alleles & (allele_types == '2')
+    is_delete = valid_alleles & (allele_types == '3')
+
+    non_alt_predictions = non_alt_predictions[:, np.newaxis]
+    p_value_pass = (is_snp & (non_alt_predictions >= options.snp_p_value)) | \
+                   (is_insert & (non_alt_predictions >= options.insert_p_value)) | \
+                   (is_delete & (non_alt_predictions >= options.delete_p_value))
+    p_value_pass_in_lc = (is_snp & (non_alt_predictions >= options.snp_p_value_in_lc)) | \
+                         (is_insert & (non_alt_predictions >= options.insert_p_value_in_lc)) | \
+                         (is_delete & (non_alt_predictions >= options.delete_p_value_in_lc))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vafs = candidate_frequencies.astype(np.float64) / depths.astype(np.float64)[:, np.newaxis]
+    frequency_pass = np.zeros(alleles.shape, dtype=bool)
+    if options.report_snp_above_freq > 0:
+        frequency_pass |= is_snp & (vafs >= options.report_snp_above_freq)
+    if options.report_indel_above_freq > 0:
+        frequency_pass |= (is_insert | is_delete) & (vafs >= options.report_indel_above_freq)
+
+    return valid_alleles, p_value_pass, p_value_pass_in_lc, frequency_pass
+
+
+def small_chunk_stitch(options, file_chunks, worker_cpus, process_id):
+    pin_worker(worker_cpus, process_id)
     fasta_handler = PEPPER_VARIANT.FASTA_handler(options.fasta)
     selected_candidate_list_margin = []
     selected_candidate_list_deepvariant = []
@@ -369,26 +425,36 @@ def small_chunk_stitch(options, file_chunks):
                 candidate_frequencies = hdf5_file['predictions'][batch_key]['candidate_frequency'][()]
                 base_predictions = hdf5_file['predictions'][batch_key]['base_prediction'][()]
                 # type_predictions = hdf5_file['predictions'][batch_key]['type_prediction'][()]
+                if len(contigs) == 0:
+                    continue
 
-                for i in range(len(contigs)):
-                    candidate = str(candidates[i]).strip('][')
-                    candidate = candidate.replace(',', ' ')
-                    candidate = candidate.split()
-                    candidate = [x.strip("'") for x in candidate]
-                    candidate_frequency = str(candidate_frequencies[i]).strip('][')
-                    candidate_frequency = candidate_frequency.replace(',', ' ')
-                    candidate_frequency = candidate_frequency.split()
-                    candidate_frequency = [int(x.strip("'")) for x in candidate_frequency]
+                # candidates hold predictions as float32, round the same way so the masks agree with the candidate objects
+                base_predictions = base_predictions.astype(np.float32).astype(np.float64)
+                predicted_genotypes = np.argmax(base_predictions, axis=1)
+                non_alt_predictions = np.max(base_predictions[:, 1:], axis=1)
+                alleles = get_allele_matrix(candidates, len(contigs))
+                candidate_frequencies = candidate_frequencies.reshape(len(contigs), -1)
+                valid_alleles, p_value_pass, p_value_pass_in_lc, frequency_pass = \
+                    get_allele_masks(options, depths, alleles, candidate_frequencies, non_alt_predictions)
+
+                # a candidate is kept if it has a margin SNP or an allele selected for variant calling in either region type
+                margin_candidates = (predicted_genotypes != 0) & np.any(valid_alleles & (alleles.astype('U1') == '1'), axis=1)
+                selected_alleles = frequency_pass | p_value_pass
+                selected_alleles_in_lc = frequency_pass | p_value_pass_in_lc
+                callable_mask = margin_candidates | np.any(selected_alleles, axis=1) | np.any(selected_alleles_in_lc, axis=1)
+
+                for i in np.flatnonzero(callable_mask):
                     candidate = PEPPER_VARIANT.CandidateImagePrediction(contigs[i].decode('UTF-8'),
                                                                         positions[i],
                                                                         depths[i],
-                                                                        candidate,
-                                                                        candidate_frequency,
+                                                                        alleles[i].tolist(),
+                                                                        candidate_frequencies[i].tolist(),
                                                                         base_predictions[i],
                                                                         [])
-                    all_candidates.append(candidate)
+                    all_candidates.append((candidate, predicted_genotypes[i], valid_alleles[i], p_value_pass[i], p_value_pass_in_lc[i],
+                                           frequency_pass[i]))
 
-        for candidate in all_candidates:
+        for candidate, predicted_genotype, valid_alleles, p_value_pass, p_value_pass_in_lc, frequency_pass in all_candidates:
 
             reference_base = fasta_handler.get_reference_sequence(candidate.contig, candidate.position, candidate.position+1).upper()
             reference_upstream = fasta_handler.get_reference_sequence(candidate.contig, candidate.position, candidate.position + 10).upper()
@@ -418,8 +484,6 @@ def small_chunk_stitch(options, file_chunks):
             if reference_base not in ['A', 'C', 'G', 'T']:
                 continue
 
-            predicted_genotype = np.argmax(candidate.prediction_base)
-
             if predicted_genotype == 0:
                 genotype = [0, 0]
             elif predicted_genotype == 1:
@@ -432,23 +496,11 @@ def small_chunk_stitch(options, file_chunks):
             # this is for Margin. Only pick SNPs.
             alt_alleles = []
             variant_allele_support = []
-            for alt_allele, allele_frequency in zip(candidate.candidates, candidate.candidate_frequency):
-                alt_type = alt_allele[0]
-                allele = alt_allele[1:]
-
-                allele_list = list(allele)
-                valid_allele = True
-                for base in allele_list:
-                    if base not in ['A', 'C', 'G', 'T']:
-                        valid_allele = False
-
-                if not valid_allele:
-                    continue
+            for alt_allele, allele_frequency, valid_allele in zip(candidate.candidates, candidate.candidate_frequency, valid_alleles):
                 # only process SNPs for margin
-                if alt_type == '1':
-                    if predicted_genotype != 0:
-                        alt_alleles.append(allele)
-                        variant_allele_support.append(allele_frequency)
+                if valid_allele and alt_allele[0] == '1' and predicted_genotype != 0:
+                    alt_alleles.append(alt_allele[1:])
+                    variant_allele_support.append(allele_frequency)
 
             if len(alt_alleles) > 0:
                 # print(candidate.contig, candidate.position, candidate.position + 1, reference_base, alt_alleles, genotype, candidate.depth, variant_allele_support)
@@ -462,64 +514,27 @@ def small_chunk_stitch(options, file_chunks):
             max_delete_length = 0
             reference_allele = reference_base
             non_alt_predictions = []
-            for alt_allele, allele_frequency in zip(candidate.candidates, candidate.candidate_frequency):
+            non_alt_prediction = max(candidate.prediction_base[1], candidate.prediction_base[2])
+            # the thresholds of the allele types were applied to the whole batch, pick the masks of this region type
+            allele_p_value_pass = p_value_pass_in_lc if candidate_in_repeat else p_value_pass
+            for alt_allele, allele_frequency, valid_allele, allele_p_value, allele_frequency_pass in \
+                    zip(candidate.candidates, candidate.candidate_frequency, valid_alleles, allele_p_value_pass, frequency_pass):
                 # print("GENERAL: ", candidate.contig, candidate.position, reference_allele, ''.join(alt_allele), candidate.depth, allele_frequency)
-                alt_type = alt_allele[0]
-                allele = alt_allele[1:]
-
-                allele_list = list(allele)
-                valid_allele = True
-                for base in allele_list:
-                    if base not in ['A', 'C', 'G', 'T']:
-                        valid_allele = False
-
                 if not valid_allele:
                     continue
 
-                vaf = float(allele_frequency) / float(candidate.depth)
-                non_alt_prediction = max(candidate.prediction_base[1], candidate.prediction_base[2])
                 non_alt_predictions.append(non_alt_prediction)
-                if alt_type == '1':
-                    if not candidate_in_repeat and non_alt_prediction >= options.snp_p_value:
-                        # add them to list
-                        alt_alleles.append(''.join(alt_allele[1:]))
-                        variant_allele_support.append(allele_frequency)
-                    # repeat variants
-                    elif candidate_in_repeat and non_alt_prediction >= options.snp_p_value_in_lc:
-                        alt_alleles.append(''.join(alt_allele[1:]))
-                        variant_allele_support.append(allele_frequency)
-                    elif 0 < options.report_snp_above_freq <= vaf:
-                        alt_alleles.append(''.join(alt_allele[1:]))
-                        variant_allele_support.append(allele_frequency)
-                elif alt_type == '2':
-                    if not candidate_in_repeat and non_alt_prediction >= options.insert_p_value:
-                        # add them to list
-                        alt_alleles.append(''.join(alt_allele[1:]))
-                        variant_allele_support.append(allele_frequency)
-                    # repeat variants
-                    elif candidate_in_repeat and non_alt_prediction >= options.insert_p_value_in_lc:
-                        alt_alleles.append(''.join(alt_allele[1:]))
-                        variant_allele_support.append(allele_frequency)
-                    elif 0 < options.report_indel_above_freq <= vaf:
-                        alt_alleles.append(''.join(alt_allele[1:]))
-                        variant_allele_support.append(allele_frequency)
-                elif alt_type == '3':
-                    if not candidate_in_repeat and non_alt_prediction >= options.delete_p_value:
-                        # add them to list
-                        alt_alleles.append(reference_allele)
-                        reference_allele = ''.join(alt_allele[1:])
-                        variant_allele_support.append(allele_frequency)
-                    # repeat variants
-                    elif candidate_in_repeat and non_alt_prediction >= options.delete_p_value_in_lc:
-                        # add them to list
+                if allele_p_value:
+                    if alt_allele[0] == '3':
                         alt_alleles.append(reference_allele)
-                        reference_allele = ''.join(alt_allele[1:])
-                        variant_allele_support.append(allele_frequency)
-                    elif 0 < options.report_indel_above_freq <= vaf:
-                        alt_alleles.append(''.join(alt_allele[1:]))
-                        variant_allele_support.append(allele_frequency)
+                        reference_allele = alt_allele[1:]
+                    else:
+                        alt_alleles.append(alt_allele[1:])
+                    variant_allele_support.append(allele_frequency)
+                elif allele_frequency_pass:
+                    alt_alleles.append(alt_allele[1:])
+                    variant_allele_support.append(allele_frequency)
 
-                predicted_genotype = np.argmax(candidate.prediction_base)
                 # print(candidate.contig, candidate.position, reference_base, alt_allele, allele_frequency, candidate.depth, vaf, "PRED: ", non_alt_prediction, "QUAL", non_alt_phred, candidate.prediction_base, candidate_in_repeat)
             if len(alt_alleles) > 0:
                 # print("SELECTED", candidate.contig, candidate.position, candidate.position + 1, reference_allele, alt_alleles, genotype, candidate.depth, variant_allele_support, prediction_value, non_alt_phred, candidate_in_repeat)
@@ -529,53 +544,129 @@ def small_chunk_stitch(options, file_chunks):
     return selected_candidate_list_margin, selected_candidate_list_deepvariant
 
 
-def find_candidates(options, input_dir, all_prediction_pair):
+def get_sorted_sites(selected_candidates):
+    """
+    Sort candidates by coordinate and group them by site. Candidates with the same reference and alternate allele at a
+    site are only kept once.
+    :param selected_candidates: List of selected candidates
+    :return: List of (contig, position, candidates) sites in coordinate order
+    """
+    sorted_sites = []
+    seen_alleles = set()
+    for candidate in sorted(selected_candidates, key=lambda x: (x[0], x[1])):
+        if not sorted_sites or sorted_sites[-1][0] != candidate[0] or sorted_sites[-1][1] != candidate[1]:
+            sorted_sites.append((candidate[0], candidate[1], []))
+            seen_alleles = set()
+        allele_key = (candidate[3], candidate[4][0])
+        if allele_key in seen_alleles:
+            continue
+        seen_alleles.add(allele_key)
+        sorted_sites[-1][2].append(candidate)
+
+    return sorted_sites
 
-    all_selected_candidates_phasing = list()
-    all_selected_candidates_variant_calling = list()
-    # generate the dictionary in parallel
+
+def write_candidate_run(options, file_chunks, worker_cpus, process_id, run_path):
+    """
+    Find the candidates of a set of prediction batches and save them as a coordinate sorted run of sites.
+    :param options: Options for candidate finding
+    :param file_chunks: List of (file name, batch key) pairs
+    :param worker_cpus: CPU ids the worker may run on
+    :param process_id: Id of the worker
+    :param run_path: Path of the run file
+    :return: File offset of the first site of each contig in the run and total sites in the run
+    """
+    # candidates selected for margin are not written to any VCF, only the variant calling candidates are saved
+    selected_candidate_list_margin, selected_candidate_list_deepvariant = small_chunk_stitch(options, file_chunks, worker_cpus, process_id)
+    sorted_sites = get_sorted_sites(selected_candidate_list_deepvariant)
+
+    contig_offsets = {}
+    with open(run_path, 'wb') as run_file:
+        for site in sorted_sites:
+            if site[0] not in contig_offsets:
+                contig_offsets[site[0]] = run_file.tell()
+            pickle.dump(site, run_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    return contig_offsets, len(sorted_sites)
+
+
+def read_candidate_run(run_path, contig, contig_offset):
+    with open(run_path, 'rb') as run_file:
+        run_file.seek(contig_offset)
+        while True:
+            try:
+                site = pickle.load(run_file)
+            except EOFError:
+                return
+            if site[0] != contig:
+                return
+            yield site
+
+
+def merge_candidate_runs(candidate_runs, contig):
+    """
+    Stream a k-way merge of the sites of a contig in sorted candidate runs. Runs can share sites at the borders of their
+    regions, candidates of a shared site are combined and duplicate alleles are dropped.
+    :param candidate_runs: List of (run path, contig offsets) runs
+    :param contig: Contig to merge
+    :return: Generator of (contig, position, candidates) sites in coordinate order
+    """
+    merged_sites = heapq.merge(*[read_candidate_run(run_path, contig, contig_offsets[contig])
+                                 for run_path, contig_offsets in candidate_runs if contig in contig_offsets],
+                               key=lambda site: site[1])
+
+    current_site = None
+    seen_alleles = set()
+    for contig, position, candidates in merged_sites:
+        if current_site is not None and (current_site[0], current_site[1]) != (contig, position):
+            yield current_site
+            current_site = None
+
+        if current_site is None:
+            current_site = (contig, position, [])
+            seen_alleles = set()
+
+        for candidate in candidates:
+            allele_key = (candidate[3], candidate[4][0])
+            if allele_key in seen_alleles:
+                continue
+            seen_alleles.add(allele_key)
+            current_site[2].append(candidate)
+
+    if current_site is not None:
+        yield current_site
+
+
+def find_candidates(options, input_dir, all_prediction_pair, run_directory):
+    """
+    Find candidates of all prediction batches in parallel. Every worker saves a sorted run of its candidates to the run
+    directory, so the candidates of the whole genome are never held in memory together.
+    :param options: Options for candidate finding
+    :param input_dir: Directory containing the predictions
+    :param all_prediction_pair: List of (file name, batch key) pairs
+    :param run_directory: Directory to save the candidate runs
+    :return: Sorted list of contigs with candidates and a list of (run path, contig offsets) runs
+    """
+    contigs = set()
+    completed_runs = {}
+    # generate the runs in parallel
     with concurrent.futures.ProcessPoolExecutor(max_workers=options.threads) as executor:
         file_chunks = chunks(all_prediction_pair, max(2, int(len(all_prediction_pair) / options.threads) + 1))
-        futures = [executor.submit(small_chunk_stitch, options, file_chunk) for file_chunk in file_chunks]
+        worker_cpu_sets = get_placement(options, len(file_chunks))
+        futures = {}
+        for process_id, file_chunk in enumerate(file_chunks):
+            run_path = run_directory + "candidate_run_" + str(process_id) + ".pkl"
+            futures[executor.submit(write_candidate_run, options, file_chunk, worker_cpu_sets[process_id], process_id, run_path)] = run_path
+
         for fut in concurrent.futures.as_completed(futures):
             if fut.exception() is None:
-                positional_candidates_phasing, positional_candidates_variant_calling = fut.result()
-                all_selected_candidates_phasing.extend(positional_candidates_phasing)
-                all_selected_candidates_variant_calling.extend(positional_candidates_variant_calling)
+                contig_offsets, total_sites = fut.result()
+                contigs.update(contig_offsets.keys())
+                completed_runs[futures[fut]] = contig_offsets
             else:
                 sys.stderr.write("ERROR IN THREAD: " + str(fut.exception()) + "\n")
             fut._result = None  # python issue 27144
 
-    all_selected_candidates_phasing = sorted(all_selected_candidates_phasing, key=lambda x: (x[0], x[1]))
-    all_selected_candidates_variant_calling = sorted(all_selected_candidates_variant_calling, key=lambda x: (x[0], x[1]))
-
-    all_selected_candidates_phasing_positional_dictionary = defaultdict(list)
-    all_selected_candidates_phasing_positional_dictionary_alts = defaultdict(list)
-    all_selected_candidates_variant_calling_positional_dictionary = defaultdict(list)
-    all_selected_candidates_variant_calling_positional_dictionary_alts = defaultdict(list)
-
-    for candidate in all_selected_candidates_phasing:
-        ref = candidate[3]
-        alt = candidate[4][0]
-        if (ref, alt) in all_selected_candidates_phasing_positional_dictionary_alts[(candidate[0], candidate[1])]:
-            continue
-        all_selected_candidates_phasing_positional_dictionary_alts[(candidate[0], candidate[1])].append((ref, alt))
-        all_selected_candidates_phasing_positional_dictionary[(candidate[0], candidate[1])].append(candidate)
-
-    contigs = list()
-    for candidate in all_selected_candidates_variant_calling:
-        if candidate[0] not in contigs:
-            contigs.append(candidate[0])
-        ref = candidate[3]
-        alt = candidate[4][0]
-        if (ref, alt) in all_selected_candidates_variant_calling_positional_dictionary_alts[(candidate[0], candidate[1])]:
-            continue
-        all_selected_candidates_variant_calling_positional_dictionary_alts[(candidate[0], candidate[1])].append((ref, alt))
-        all_selected_candidates_variant_calling_positional_dictionary[(candidate[0], candidate[1])].append(candidate)
-
-    # print(all_selected_candidates_variant_calling_positional_dictionary)
-    # print(all_selected_candidates_phasing_positional_dictionary)
-    # exit(0)
-
-    # print("SORTED")
-    return contigs, all_selected_candidates_phasing_positional_dictionary, all_selected_candidates_variant_calling_positional_dictionary
+    # runs are merged in submission order so candidates of a shared site are combined in the same order every time
+    candidate_runs = [(run_path, completed_runs[run_path]) for run_path in futures.values() if run_path in completed_runs]
+    return sorted(contigs), candidate_runs
@@ -0,0 +1,109 @@
+import os
+import sys
+import numpy as np
+import onnxruntime
+from datetime import datetime
+from pepper_variant.modules.python.models.ModelHander import ModelHandler
+from pepper_variant.modules.python.models.quantize import load_labeled_images, evaluate_onnx_model, get_variant_level_stats, print_confusion_matrix
+from pepper_variant.modules.python.models.cascade import train_cascade_classifier, calibrate_cascade_thresholds, evaluate_cascade
+from pepper_variant.modules.python.ImageGenerationUI import ImageGenerationUtils
+from pepper_variant.modules.python.Options import ImageSizeOptions, ImageSizeOptionsHP, CascadeOptions
+
+
+def do_train_cascade(options):
+    """
+    Train and calibrate the first stage of the confidence cascade, then measure the compute saved and the change in
+    accuracy against the full model on a held-out truth set.
+    :param options: Options for cascade training
+    :return:
+    """
+    if os.path.isfile(options.model_path) is False:
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] ERROR: INVALID PATH TO MODEL\n")
+        exit(1)
+
+    if not 0 < options.max_error_rate < 1:
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] ERROR: --max_error_rate MUST BE BETWEEN 0 AND 1 (EXCLUSIVE), GOT: "
+                         + str(options.max_error_rate) + "\n")
+        exit(1)
+
+    if options.use_hp_info:
+        image_features = ImageSizeOptionsHP.IMAGE_HEIGHT
+    else:
+        image_features = ImageSizeOptions.IMAGE_HEIGHT
+
+    output_dir = ImageGenerationUtils.handle_output_directory(options.output_dir)
+    float_model_path = output_dir + "pepper_model.onnx"
+    cascade_model_path = output_dir + "pepper_cascade.npz"
+
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: LOADING TRAINING IMAGES\n")
+    train_images, train_type_labels = load_labeled_images(options.train_image_dir, options.train_images)
+    if train_images is None:
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] ERROR: NO TRAINING IMAGES FOUND.\n")
+        exit(1)
+
+    # hold out a part of the training images to calibrate the thresholds
+    permutation = np.random.permutation(len(train_images))
+    total_calibration = int(len(train_images) * CascadeOptions.CALIBRATION_FRACTION)
+    calibration_indices = permutation[:total_calibration]
+    fit_indices = permutation[total_calibration:]
+
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: TRAINING FIRST STAGE ON " + str(len(fit_indices))
+                     + " IMAGES, CALIBRATING ON " + str(len(calibration_indices)) + " IMAGES\n")
+    cascade = train_cascade_classifier(train_images[fit_indices], train_type_labels[fit_indices])
+    calibrate_cascade_thresholds(cascade, train_images[calibration_indices], train_type_labels[calibration_indices], options.max_error_rate)
+
+    for label in range(ImageSizeOptions.TOTAL_TYPE_LABELS):
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: CONFIDENCE THRESHOLD FOR "
+                         + ImageSizeOptions.decoded_labels[label] + ": " + str(cascade.thresholds[label]) + "\n")
+
+    cascade.save(cascade_model_path)
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: CASCADE MODEL SAVED: " + cascade_model_path + "\n")
+
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: MODEL LOADING TO ONNX\n")
+    transducer_model, hidden_size, gru_layers, prev_ite = \
+        ModelHandler.load_simple_model_for_training(options.model_path,
+                                                    image_features=image_features,
+                                                    num_classes=ImageSizeOptions.TOTAL_LABELS,
+                                                    num_type_classes=ImageSizeOptions.TOTAL_TYPE_LABELS)
+    transducer_model.eval()
+    ModelHandler.export_to_onnx(transducer_model, image_features, float_model_path)
+
+    test_images, test_type_labels = load_labeled_images(options.test_image_dir, options.test_images)
+    if test_images is None:
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] ERROR: NO TEST IMAGES FOUND.\n")
+        exit(1)
+
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: COMPARING FULL MODEL AND CASCADE ON " + str(len(test_images)) + " IMAGES\n")
+    full_predictions, full_confusion_matrix, full_time = evaluate_onnx_model(float_model_path, test_images, test_type_labels, options.batch_size, options.threads)
+
+    sess_options = onnxruntime.SessionOptions()
+    sess_options.intra_op_num_threads = options.threads
+    sess_options.inter_op_num_threads = 1
+    sess_options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+    sess_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    ort_session = onnxruntime.InferenceSession(float_model_path, sess_options=sess_options)
+    input_name = ort_session.get_inputs()[0].name
+
+    cascade_predictions, total_settled, cascade_time = evaluate_cascade(cascade, ort_session, input_name, test_images, options.batch_size)
+    cascade_confusion_matrix = np.zeros((ImageSizeOptions.TOTAL_TYPE_LABELS, ImageSizeOptions.TOTAL_TYPE_LABELS), dtype=np.int64)
+    np.add.at(cascade_confusion_matrix, (test_type_labels, cascade_predictions), 1)
+
+    print_confusion_matrix("FULL MODEL", full_confusion_matrix)
+    print_confusion_matrix("CASCADE", cascade_confusion_matrix)
+
+    full_accuracy, full_precision, full_recall = get_variant_level_stats(full_confusion_matrix)
+    cascade_accuracy, cascade_precision, cascade_recall = get_variant_level_stats(cascade_confusion_matrix)
+    settled_percentage = (100.0 * total_settled) / max(1, len(test_images))
+    agreement = (100.0 * np.sum(full_predictions == cascade_predictions)) / max(1, len(full_predictions))
+
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: FULL MODEL ACCURACY: " + str(round(full_accuracy, 5))
+                     + " VARIANT PRECISION: " + str(round(full_precision, 5)) + " VARIANT RECALL: " + str(round(full_recall, 5))
+                     + " INFERENCE TIME: " + str(round(full_time, 2)) + " Sec\n")
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: CASCADE ACCURACY: " + str(round(cascade_accuracy, 5))
+                     + " VARIANT PRECISION: " + str(round(cascade_precision, 5)) + " VARIANT RECALL: " + str(round(cascade_recall, 5))
+                     + " INFERENCE TIME: " + str(round(cascade_time, 2)) + " Sec\n")
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: CANDIDATES SETTLED BY FIRST STAGE: " + str(total_settled)
+                     + "/" + str(len(test_images)) + " (" + str(round(settled_percentage, 2)) + "% OF NETWORK CALLS SAVED)\n")
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: PREDICTION AGREEMENT WITH FULL MODEL: " + str(round(agreement, 5)) + "%\n")
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: USE THE CASCADE WITH: --cascade_model " + cascade_model_path + "\n")
+    sys.stderr.flush()
@@ -0,0 +1,116 @@
+import os
+import sys
+from datetime import datetime
+
+NUMA_NODE_DIRECTORY = "/sys/devices/system/node/"
+
+
+def parse_cpu_list(cpu_list):
+    """
+    Parse a kernel CPU list such as 0-3,8-11 into a list of CPU ids.
+    :param cpu_list: CPU list string
+    :return: List of CPU ids
+    """
+    cpus = []
+    for cpu_range in cpu_list.strip().split(','):
+        if not cpu_range:
+            continue
+        if '-' in cpu_range:
+            range_start, range_end = cpu_range.split('-')
+            cpus.extend(range(int(range_start), int(range_end) + 1))
+        else:
+            cpus.append(int(cpu_range))
+    return cpus
+
+
+def get_numa_nodes():
+    """
+    Return the CPUs this process is allowed to run on grouped by NUMA node. Hosts without NUMA information in sysfs
+    are treated as a single node.
+    :return: List of CPU lists, one per NUMA node
+    """
+    allowed_cpus = os.sched_getaffinity(0)
+    numa_nodes = []
+    if os.path.isdir(NUMA_NODE_DIRECTORY):
+        node_names = [name for name in os.listdir(NUMA_NODE_DIRECTORY) if name.startswith('node') and name[4:].isdigit()]
+        for node_name in sorted(node_names, key=lambda name: int(name[4:])):
+            with open(os.path.join(NUMA_NODE_DIRECTORY, node_name, 'cpulist')) as cpu_list_file:
+                node_cpus = [cpu for cpu in parse_cpu_list(cpu_list_file.read()) if cpu in allowed_cpus]
+            if node_cpus:
+                numa_nodes.append(node_cpus)
+
+    if not numa_nodes:
+        numa_nodes = [sorted(allowed_cpus)]
+
+    return numa_nodes
+
+
+def get_worker_cpu_sets(total_workers):
+    """
+    Plan the CPU sets of a pool of workers. Workers are spread over NUMA nodes in proportion to the CPUs of each node
+    with consecutive worker ids on the same node, and every worker gets an equal slice of the CPUs of its node. This
+    runs in the parent process so the plan is based on the CPUs the whole run is allowed to use.
+    :param total_workers: Total number of workers
+    :return: List of CPU id lists, one per worker
+    """
+    numa_nodes = get_numa_nodes()
+    total_cpus = sum(len(node_cpus) for node_cpus in numa_nodes)
+
+    worker_cpu_sets = []
+    first_worker = 0
+    cumulative_cpus = 0
+    for node_cpus in numa_nodes:
+        cumulative_cpus += len(node_cpus)
+        last_worker = int(round(total_workers * cumulative_cpus / total_cpus))
+        node_workers = last_worker - first_worker
+
+        for local_worker_id in range(node_workers):
+            if node_workers >= len(node_cpus):
+                # more workers than CPUs on this node, workers share single CPUs
+                worker_cpu_sets.append([node_cpus[local_worker_id % len(node_cpus)]])
+            else:
+                cpus_per_worker = int(len(node_cpus) / node_workers)
+                worker_cpu_sets.append(node_cpus[local_worker_id * cpus_per_worker:(local_worker_id + 1) * cpus_per_worker])
+        first_worker = last_worker
+
+    return worker_cpu_sets
+
+
+def pin_worker(worker_cpus, worker_id):
+    """
+    Pin the calling process to a CPU set. Linux places new pages on the NUMA node of the CPU that first touches them,
+    so memory the worker allocates after pinning stays local to its node.
+    :param worker_cpus: CPU ids the worker may run on
+    :param worker_id: Id of the worker
+    :return: List of CPU ids the worker is pinned to, None if pinning is not supported
+    """
+    if worker_cpus is None or not hasattr(os, 'sched_setaffinity'):
+        return None
+
+    os.sched_setaffinity(0, worker_cpus)
+
+    if worker_id == 0:
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: WORKER 0 PINNED TO CPUS: " + str(worker_cpus) + "\n")
+        sys.stderr.flush()
+
+    return worker_cpus
+
+
+def get_placement(options, total_workers):
+    """
+    Return the CPU set of each worker if CPU affinity is enabled, otherwise no placement for any worker.
+    :param options: Options with the cpu_affinity flag
+    :param total_workers: Total number of workers
+    :return: List with a CPU id list or None per worker
+    """
+    if not options.cpu_affinity:
+        return [None] * total_workers
+
+    if not hasattr(os, 'sched_setaffinity'):
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] WARNING: CPU AFFINITY IS NOT SUPPORTED ON THIS PLATFORM.\n")
+        return [None] * total_workers
+
+    worker_cpu_sets = get_worker_cpu_sets(total_workers)
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: PLACING " + str(total_workers) + " WORKERS ON "
+                     + str(len(get_numa_nodes())) + " NUMA NODE(S).\n")
+    return worker_cpu_sets
@@ -2,13 +2,15 @@ import h5py
 from datetime import datetime
 import sys
 from os.path import isfile, join
-from os import listdir
+from os import listdir, remove
 import re
 import time
+import concurrent.futures
 import pickle
+import shutil
 from pepper_variant.build import PEPPER_VARIANT
-from pepper_variant.modules.python.CandidateFinder import find_candidates
-from pepper_variant.modules.python.VcfWriter import VCFWriter
+from pepper_variant.modules.python.CandidateFinder import find_candidates, merge_candidate_runs
+from pepper_variant.modules.python.VcfWriter import VCFWriter, concatenate_bgzf_fragments, index_vcf_files
 from pepper_variant.modules.python.ImageGenerationUI import ImageGenerationUtils
 from pepper_variant.modules.python.Options import CandidateFinderOptions
 
@@ -153,6 +155,85 @@ def get_file_paths_from_directory(directory_path):
     return file_paths
 
 
+def write_contig_vcf_fragments(options, contig_id, contig, candidate_runs, fragment_directory, vcf_file_names, vcf_header_text):
+    """
+    Write the candidates of a contig to its own set of bgzipped VCF fragments.
+    :param options: Options for candidate finding
+    :param contig_id: Position of the contig in the output order
+    :param contig: Contig name
+    :param candidate_runs: List of (run path, contig offsets) runs
+    :param fragment_directory: Directory to save the fragments
+    :param vcf_file_names: Names of the full, pepper and variant calling VCFs
+    :param vcf_header_text: Header of the VCFs as text
+    :return: Id of the contig, totals of written variants and paths of the fragments
+    """
+    vcf_file_name_full, vcf_file_name_pepper, vcf_file_name_variant_calling = vcf_file_names
+    fragment_suffix = "_" + str(contig_id)
+    vcf_file = VCFWriter([contig], options.fasta, options.sample_name, fragment_directory,
+                         vcf_file_name_full + fragment_suffix,
+                         vcf_file_name_pepper + fragment_suffix,
+                         vcf_file_name_variant_calling + fragment_suffix,
+                         vcf_header_text=vcf_header_text)
+    totals = vcf_file.write_vcf_records(merge_candidate_runs(candidate_runs, contig), options)
+    vcf_file.close()
+
+    return contig_id, totals, vcf_file.vcf_file_names
+
+
+def write_vcf_files(options, contigs, candidate_runs, output_path, vcf_file_names):
+    """
+    Write the candidate VCFs. Every contig is written to its own fragments in parallel, the fragments are then
+    concatenated in reference contig order and the VCFs are indexed. If any contig fails no VCF is written.
+    :param options: Options for candidate finding
+    :param contigs: Contigs with candidates
+    :param candidate_runs: List of (run path, contig offsets) runs
+    :param output_path: Path to the output directory
+    :param vcf_file_names: Names of the full, pepper and variant calling VCFs
+    :return: Totals of written variants
+    """
+    # the header-only VCFs written here are the start of the concatenated VCFs
+    vcf_file = VCFWriter(contigs, options.fasta, options.sample_name, output_path, *vcf_file_names)
+    vcf_file.close()
+
+    reference_contigs = PEPPER_VARIANT.FASTA_handler(options.fasta).get_chromosome_names()
+    contigs = [contig for contig in reference_contigs if contig in contigs] + [contig for contig in contigs if contig not in reference_contigs]
+
+    fragment_directory = ImageGenerationUtils.handle_output_directory(output_path + "vcf_fragments")
+    all_totals = [0, 0, 0, 0, 0]
+    contig_fragment_names = [None] * len(contigs)
+    failed_contigs = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=options.threads) as executor:
+        futures = [executor.submit(write_contig_vcf_fragments, options, contig_id, contig, candidate_runs, fragment_directory, vcf_file_names,
+                                   vcf_file.vcf_header_text)
+                   for contig_id, contig in enumerate(contigs)]
+        for fut in concurrent.futures.as_completed(futures):
+            if fut.exception() is None:
+                contig_id, totals, fragment_names = fut.result()
+                all_totals = [total + contig_total for total, contig_total in zip(all_totals, totals)]
+                contig_fragment_names[contig_id] = fragment_names
+            else:
+                failed_contigs += 1
+                sys.stderr.write("ERROR IN THREAD: " + str(fut.exception()) + "\n")
+            fut._result = None  # python issue 27144
+
+    if failed_contigs > 0:
+        # a VCF without the variants of the failed contigs would look complete, do not write one
+        shutil.rmtree(fragment_directory)
+        for vcf_file_name in vcf_file.vcf_file_names:
+            remove(vcf_file_name)
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] ERROR: FAILED TO WRITE VARIANTS OF " + str(failed_contigs)
+                         + " CONTIGS.\n")
+        exit(1)
+
+    for i, vcf_file_name in enumerate(vcf_file.vcf_file_names):
+        concatenate_bgzf_fragments(vcf_file_name, [fragment_names[i] for fragment_names in contig_fragment_names])
+    shutil.rmtree(fragment_directory)
+
+    index_vcf_files(vcf_file.vcf_file_names, options.threads)
+
+    return all_totals
+
+
 def candidate_finder(options, input_dir, output_path):
     all_prediction_files = get_file_paths_from_directory(input_dir)
 
@@ -172,16 +253,18 @@ def candidate_finder(options, input_dir, output_path):
     local_start_time = time.time()
     sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: STARTING CANDIDATE FINDING." + "\n")
 
-    contigs, selected_candidates_phasing, selected_candidates_variant_calling = find_candidates(options, input_dir, all_prediction_pair)
+    run_directory = ImageGenerationUtils.handle_output_directory(output_path + "candidate_runs")
+    contigs, candidate_runs = find_candidates(options, input_dir, all_prediction_pair, run_directory)
     end_time = time.time()
 
-    vcf_file_full = VCFWriter(contigs, options.fasta, options.sample_name, output_path, vcf_file_name_full, vcf_file_name_pepper, vcf_file_name_variant_calling)
-
     mins = int((end_time - local_start_time) / 60)
     secs = int((end_time - local_start_time)) % 60
 
     # vcf_file_phasing.write_vcf_records(selected_candidates_phasing, options, calling_mode=0)
-    total_variants, total_pepper, total_variant_calling, total_variant_calling_snp, total_variant_calling_indel = vcf_file_full.write_vcf_records(selected_candidates_variant_calling, options)
+    total_variants, total_pepper, total_variant_calling, total_variant_calling_snp, total_variant_calling_indel = \
+        write_vcf_files(options, contigs, candidate_runs, output_path, (vcf_file_name_full, vcf_file_name_pepper, vcf_file_name_variant_calling))
+    shutil.rmtree(run_directory)
+
     sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: FINISHED PROCESSING, TOTAL CANDIDATES FOUND: " + str(total_variants) + "\n")
     sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: FINISHED PROCESSING, TOTAL VARIANTS IN PEPPER: " + str(total_pepper) + "\n")
     sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: FINISHED PROCESSING, TOTAL VARIANTS SELECTED FOR RE-GENOTYPING: " + str(total_variant_calling) + "\n")
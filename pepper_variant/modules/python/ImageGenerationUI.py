@@ -12,7 +12,8 @@ from pepper_variant.modules.python.ExcludeContigs import EXCLUDED_HUMAN_CONTIGS
 from pepper_variant.modules.python.DataStore import DataStore
 from pepper_variant.modules.python.AlignmentSummarizer import AlignmentSummarizer
 from pepper_variant.modules.python.AlignmentSummarizerHP import AlignmentSummarizerHP
-from pepper_variant.modules.python.Options import ImageSizeOptions
+from pepper_variant.modules.python.Options import ImageSizeOptions, ConsensCandidateFinder
+from pepper_variant.modules.python.CpuAffinity import get_placement, pin_worker
 
 
 class ImageGenerator:
@@ -176,6 +177,10 @@ class ImageGenerationUtils:
                 line = fp.readline()
                 cnt = 1
                 while line:
+                    # skip blank, comment and track lines of panel bed files
+                    if not line.strip() or line.startswith(('#', 'track', 'browser')):
+                        line = fp.readline()
+                        continue
                     line_to_list = line.rstrip().split('\t')
                     chr_name, start_pos, end_pos = line_to_list[0], int(line_to_list[1]), int(line_to_list[2])
                     region = sorted([start_pos, end_pos])
@@ -188,15 +193,18 @@ class ImageGenerationUtils:
         return chromosome_name_list, region_bed_list
 
     @staticmethod
-    def generate_image_and_save_to_file(options, all_intervals, bed_list, process_id):
+    def generate_image_and_save_to_file(options, all_intervals, bed_list, total_processes, worker_cpus, process_id):
         """
         Method description
         :param options: Image generation options.
         :param all_intervals: All intervals.
         :param bed_list: List of intervals from bed file.
+        :param total_processes: Total number of image generation processes.
+        :param worker_cpus: CPUs this process is pinned to, None to leave placement to the kernel.
         :param process_id: Process id.
         :return:
         """
+        pin_worker(worker_cpus, process_id)
         thread_prefix = "[THREAD " + "{:02d}".format(process_id) + "]"
 
 
@@ -208,7 +216,7 @@ class ImageGenerationUtils:
 
         file_name = file_name + ".hdf5"
 
-        intervals = [r for i, r in enumerate(all_intervals) if i % options.threads == process_id]
+        intervals = [r for i, r in enumerate(all_intervals) if i % total_processes == process_id]
 
         # initial notification
         if process_id == 0:
@@ -274,16 +282,69 @@ class ImageGenerationUtils:
         return process_id
 
     @staticmethod
-    def generate_images(options):
+    def get_target_intervals(options, chr_list, bed_list):
         """
-        Generates images.
+        Split the padded target regions of a region bed into intervals of region size. Targets are clipped to the
+        contigs and regions to process and overlapping targets are merged, contigs without targets are skipped.
         :param options: Option for generating images.
-        :return:
+        :param chr_list: List of contigs and regions to process.
+        :param bed_list: Target regions from a bed file.
+        :return: List of intervals and total bases in the intervals
         """
-        chr_list, bed_list = ImageGenerationUtils.get_chromosome_list(options.region, options.fasta, options.bam, region_bed=options.region_bed)
-        options.image_output_directory = ImageGenerationUtils.handle_output_directory(os.path.abspath(options.image_output_directory))
+        fasta_handler = PEPPER_VARIANT.FASTA_handler(options.fasta)
+
+        all_intervals = []
+        total_bases = 0
+        for chr_name, region in chr_list:
+            if chr_name not in bed_list:
+                continue
+
+            contig_start, contig_end = (0, fasta_handler.get_chromosome_sequence_length(chr_name) - 1)
+            if region:
+                contig_start = max(contig_start, region[0])
+                contig_end = min(contig_end, region[1])
+
+            merged_targets = []
+            for target_start, target_end in sorted(bed_list[chr_name]):
+                target_start = max(contig_start, target_start - ConsensCandidateFinder.TARGET_PADDING)
+                target_end = min(contig_end, target_end + ConsensCandidateFinder.TARGET_PADDING)
+                if target_start >= target_end:
+                    continue
+
+                if merged_targets and target_start <= merged_targets[-1][1]:
+                    merged_targets[-1][1] = max(merged_targets[-1][1], target_end)
+                else:
+                    merged_targets.append([target_start, target_end])
+
+            for target_start, target_end in merged_targets:
+                for pos in range(target_start, target_end, options.region_size):
+                    pos_end = min(target_end, pos + options.region_size)
+                    all_intervals.append((chr_name, pos, pos_end))
+                    total_bases += pos_end - pos
+
+        if len(all_intervals) == 0:
+            sys.stderr.write("[" + datetime.now().strftime('%m-%d-%Y %H:%M:%S') + "] "
+                             + "ERROR: NO REGION IN THE BED FILE OVERLAPS THE CONTIGS TO PROCESS.\n")
+            sys.stderr.flush()
+            exit(1)
+
+        sys.stderr.write("[" + datetime.now().strftime('%m-%d-%Y %H:%M:%S') + "] INFO: RESTRICTED TO "
+                         + str(len(set(interval[0] for interval in all_intervals))) + " CONTIGS WITH TARGET REGIONS.\n")
+        return all_intervals, total_bases
+
+    @staticmethod
+    def get_all_intervals(options, chr_list, bed_list=None):
+        """
+        Split the contigs and regions to process into intervals of region size. Outside of training, a region bed
+        restricts the intervals to its padded target regions.
+        :param options: Option for generating images.
+        :param chr_list: List of contigs and regions to process.
+        :param bed_list: Target regions from a bed file.
+        :return: List of intervals and total bases in the intervals
+        """
+        if bed_list is not None and not options.train_mode:
+            return ImageGenerationUtils.get_target_intervals(options, chr_list, bed_list)
 
-        start_time = time.time()
         fasta_handler = PEPPER_VARIANT.FASTA_handler(options.fasta)
 
         all_intervals = []
@@ -315,17 +376,23 @@ class ImageGenerationUtils:
                 all_intervals.append((chr_name, pos_start, pos_end))
                 total_bases += inv_size
 
-        # all intervals calculated now
-        # contig update message
-        sys.stderr.write("[" + datetime.now().strftime('%m-%d-%Y %H:%M:%S') + "] "
-                         + "INFO: TOTAL CONTIGS: " + str(len(chr_list))
-                         + " TOTAL INTERVALS: " + str(len(all_intervals))
-                         + " TOTAL BASES: " + str(total_bases) + "\n")
-        sys.stderr.flush()
+        return all_intervals, total_bases
 
-        with concurrent.futures.ProcessPoolExecutor(max_workers=options.threads) as executor:
-            futures = [executor.submit(ImageGenerationUtils.generate_image_and_save_to_file, options, all_intervals, bed_list, process_id)
-                       for process_id in range(0, options.threads)]
+    @staticmethod
+    def generate_images_for_intervals(options, all_intervals, bed_list, total_processes):
+        """
+        Generate images of a list of intervals using a pool of processes.
+        :param options: Option for generating images.
+        :param all_intervals: Intervals to generate images for.
+        :param bed_list: List of intervals from bed file.
+        :param total_processes: Number of image generation processes.
+        :return:
+        """
+        worker_cpu_sets = get_placement(options, total_processes)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=total_processes) as executor:
+            futures = [executor.submit(ImageGenerationUtils.generate_image_and_save_to_file, options, all_intervals, bed_list, total_processes,
+                                       worker_cpu_sets[process_id], process_id)
+                       for process_id in range(0, total_processes)]
 
             for fut in concurrent.futures.as_completed(futures):
                 if fut.exception() is None:
@@ -338,6 +405,34 @@ class ImageGenerationUtils:
                     sys.stderr.write("ERROR: " + str(fut.exception()) + "\n")
                 fut._result = None  # python issue 27144
 
+    @staticmethod
+    def generate_images(options):
+        """
+        Generates images.
+        :param options: Option for generating images.
+        :return:
+        """
+        chr_list, bed_list = ImageGenerationUtils.get_chromosome_list(options.region, options.fasta, options.bam, region_bed=options.region_bed)
+        options.image_output_directory = ImageGenerationUtils.handle_output_directory(os.path.abspath(options.image_output_directory))
+
+        start_time = time.time()
+        all_intervals, total_bases = ImageGenerationUtils.get_all_intervals(options, chr_list, bed_list)
+
+        # all intervals calculated now
+        # contig update message
+        sys.stderr.write("[" + datetime.now().strftime('%m-%d-%Y %H:%M:%S') + "] "
+                         + "INFO: TOTAL CONTIGS: " + str(len(chr_list))
+                         + " TOTAL INTERVALS: " + str(len(all_intervals))
+                         + " TOTAL BASES: " + str(total_bases) + "\n")
+        sys.stderr.flush()
+
+        # a tuned profile can set a different number of image generation processes than inference threads
+        total_processes = options.threads
+        if options.image_generation_processes is not None:
+            total_processes = options.image_generation_processes
+
+        ImageGenerationUtils.generate_images_for_intervals(options, all_intervals, bed_list, total_processes)
+
         end_time = time.time()
         mins = int((end_time - start_time) / 60)
         secs = int((end_time - start_time)) % 60
@@ -1,5 +1,7 @@
 class ConsensCandidateFinder(object):
     REGION_SAFE_BASES = 100
+    # bases added on both sides of the target regions of a region bed during inference
+    TARGET_PADDING = 100
 
 
 class ImageSizeOptions(object):
@@ -90,6 +92,29 @@ class TrainOptions(object):
     HIDDEN_SIZE = 256
 
 
+class InferenceOptions(object):
+    ONNX_OPSET_VERSION = 11
+    ONNX_CACHE_DIRECTORY = "pepper_onnx_cache"
+    # number of batches read ahead of the inference session in each worker
+    PREFETCH_BATCHES = 2
+    # callers pull work units of this many summaries from a shared queue
+    SUMMARIES_PER_WORK_UNIT = 2
+    # interval in seconds between per-caller progress reports
+    PROGRESS_REPORT_INTERVAL = 60
+    # seconds a shared session reader gets to exit after the session stops before it is terminated
+    READER_EXIT_TIMEOUT = 10
+
+
+class CascadeOptions(object):
+    # the first stage of the cascade is a softmax regression over the image, trained with mini-batch gradient descent
+    EPOCHS = 10
+    LEARNING_RATE = 0.05
+    L2_PENALTY = 0.0001
+    BATCH_SIZE = 512
+    # fraction of the training images held out to calibrate the confidence thresholds
+    CALIBRATION_FRACTION = 0.2
+
+
 class AlingerOptions(object):
     # base and map quality
     ALIGNMENT_SAFE_BASES = 20
@@ -0,0 +1,63 @@
+import os
+import sys
+from datetime import datetime
+from pepper_variant.modules.python.models.ModelHander import ModelHandler
+from pepper_variant.modules.python.models.quantize import load_labeled_images, quantize_model_static, compare_quantized_model
+from pepper_variant.modules.python.ImageGenerationUI import ImageGenerationUtils
+from pepper_variant.modules.python.Options import ImageSizeOptions, ImageSizeOptionsHP
+
+
+def do_quantize(options):
+    """
+    Create a statically quantized ONNX model and report its accuracy against the float model.
+    :param options: Options for quantization
+    :return:
+    """
+    if os.path.isfile(options.model_path) is False:
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] ERROR: INVALID PATH TO MODEL\n")
+        exit(1)
+
+    if options.use_hp_info:
+        image_features = ImageSizeOptionsHP.IMAGE_HEIGHT
+    else:
+        image_features = ImageSizeOptions.IMAGE_HEIGHT
+
+    output_dir = ImageGenerationUtils.handle_output_directory(options.output_dir)
+    float_model_path = output_dir + "pepper_model.onnx"
+    quantized_model_path = output_dir + "pepper_model.static_quantized.onnx"
+
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: MODEL LOADING TO ONNX\n")
+    transducer_model, hidden_size, gru_layers, prev_ite = \
+        ModelHandler.load_simple_model_for_training(options.model_path,
+                                                    image_features=image_features,
+                                                    num_classes=ImageSizeOptions.TOTAL_LABELS,
+                                                    num_type_classes=ImageSizeOptions.TOTAL_TYPE_LABELS)
+    transducer_model.eval()
+    ModelHandler.export_to_onnx(transducer_model, image_features, float_model_path)
+
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: LOADING CALIBRATION IMAGES\n")
+    calibration_images, _ = load_labeled_images(options.calibration_image_dir, options.calibration_images)
+    if calibration_images is None:
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] ERROR: NO CALIBRATION IMAGES FOUND.\n")
+        exit(1)
+
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: CALIBRATING ON " + str(len(calibration_images))
+                     + " IMAGES USING " + options.calibration_method.upper() + "\n")
+    quantize_model_static(float_model_path, quantized_model_path, calibration_images, options.batch_size, options.calibration_method)
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: QUANTIZED MODEL SAVED: " + quantized_model_path + "\n")
+
+    test_images, test_type_labels = load_labeled_images(options.test_image_dir, options.test_images)
+    if test_images is None:
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] ERROR: NO TEST IMAGES FOUND.\n")
+        exit(1)
+
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: COMPARING MODELS ON " + str(len(test_images)) + " IMAGES\n")
+    accuracy_drop = compare_quantized_model(float_model_path, quantized_model_path, test_images, test_type_labels, options.batch_size, options.threads)
+
+    if accuracy_drop > options.max_accuracy_drop:
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] ERROR: ACCURACY DROP " + str(round(accuracy_drop, 5))
+                         + "% IS ABOVE THE ALLOWED BOUND OF " + str(options.max_accuracy_drop) + "%. USE THE FLOAT MODEL OR A LARGER CALIBRATION SET.\n")
+        exit(1)
+
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: QUANTIZED MODEL IS WITHIN THE ACCURACY BOUND. "
+                     "USE IT WITH: --static_quantized_model " + quantized_model_path + "\n")
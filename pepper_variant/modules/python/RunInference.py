@@ -1,11 +1,10 @@
 import sys
-import torch
 import time
 from datetime import datetime
 from pepper_variant.modules.python.ImageGenerationUI import ImageGenerationUtils
 from pepper_variant.modules.python.models.predict_distributed_cpu import predict_distributed_cpu
-from pepper_variant.modules.python.models.predict_distributed_cpu_fake import predict_distributed_cpu_fake
-from pepper_variant.modules.python.models.predict_distributed_gpu import predict_distributed_gpu
+from pepper_variant.modules.python.models.dataloader_predict_numpy import get_work_units
+from pepper_variant.modules.python.Options import InferenceOptions
 from os.path import isfile, join
 from os import listdir
 
@@ -22,6 +21,9 @@ def get_file_paths_from_directory(directory_path):
 
 
 def distributed_gpu(options, image_dir, output_dir):
+    # torch is only imported for GPU inference, CPU inference runs on onnxruntime alone
+    import torch
+    from pepper_variant.modules.python.models.predict_distributed_gpu import predict_distributed_gpu
     start_time = time.time()
 
     if options.device_ids is None:
@@ -95,25 +97,30 @@ def distributed_cpu(options, image_dir, output_dir):
     start_time = time.time()
     sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: DISTRIBUTED CPU SETUP.\n")
 
-    # chunk the inputs
+    # split the inputs into work units, callers pull them from a shared queue so no caller is left with the largest files
     input_files = get_file_paths_from_directory(image_dir)
+    work_units = get_work_units(input_files, InferenceOptions.SUMMARIES_PER_WORK_UNIT)
 
     # use 1/2 the available CPUs to call
     callers = max(1, int(options.threads))
+    if options.shared_session:
+        # in shared session mode callers only read images, the inference session uses all the threads
+        callers = max(1, int(options.threads / 4))
 
-    file_chunks = [[] for i in range(callers)]
-    for i in range(0, len(input_files)):
-        file_chunks[i % callers].append(input_files[i])
-
-    file_chunks = [x for x in file_chunks if x]
+    # a tuned profile sets the callers and threads per caller found to give the best throughput
+    if options.callers is not None:
+        callers = options.callers
 
-    callers = min(callers, len(file_chunks))
+    callers = max(1, min(callers, len(work_units)))
     # use uniform amount of CPUs per caller
     threads_per_caller = max(1, int(options.threads/callers))
+    if options.threads_per_caller is not None:
+        threads_per_caller = options.threads_per_caller
 
     sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: TOTAL CALLERS: " + str(callers) + "\n")
     sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: THREADS PER CALLER: " + str(threads_per_caller) + "\n")
-    predict_distributed_cpu(options, image_dir, file_chunks, output_dir, callers, threads_per_caller)
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: TOTAL WORK UNITS: " + str(len(work_units)) + "\n")
+    predict_distributed_cpu(options, image_dir, work_units, output_dir, callers, threads_per_caller)
     sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: PREDICTION FINISHED SUCCESSFULLY. \n")
 
     end_time = time.time()
@@ -127,6 +134,7 @@ def run_inference(options,
                   output_dir):
     output_dir = ImageGenerationUtils.handle_output_directory(output_dir)
     if options.dry:
+        from pepper_variant.modules.python.models.predict_distributed_cpu_fake import predict_distributed_cpu_fake
         predict_distributed_cpu_fake(image_dir, output_dir, options.batch_size, options.num_workers)
     elif options.gpu:
         distributed_gpu(options,
@@ -0,0 +1,283 @@
+import os
+import sys
+import time
+import json
+import shutil
+import platform
+from datetime import datetime
+from pepper_variant.modules.python.ImageGenerationUI import ImageGenerationUtils
+from pepper_variant.modules.python.RunInference import get_file_paths_from_directory, distributed_gpu
+from pepper_variant.modules.python.models.predict_distributed_cpu import prepare_cpu_inference, run_distributed_cpu
+from pepper_variant.modules.python.models.dataloader_predict_numpy import get_work_units
+from pepper_variant.modules.python.Options import InferenceOptions
+
+
+TUNE_PROFILE_NAME = "pepper_variant_tune_profile.json"
+TUNE_BATCH_SIZES = [128, 256, 512, 1024]
+TUNE_THREADS_PER_CALLER = [1, 2, 4, 8]
+TUNE_CALLERS_PER_GPU = [1, 2, 4]
+
+
+def sample_intervals(all_intervals, total_samples):
+    """
+    Pick intervals spread evenly over the input so the trials see a representative mix of regions.
+    :param all_intervals: All intervals of the input
+    :param total_samples: Number of intervals to pick
+    :return: Sampled intervals
+    """
+    if len(all_intervals) <= total_samples:
+        return list(all_intervals)
+    return [all_intervals[int(i * len(all_intervals) / total_samples)] for i in range(total_samples)]
+
+
+def report_trial(stage, configuration, throughput, unit):
+    configuration_string = " ".join(key.upper() + ": " + str(value) for key, value in configuration.items())
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: TUNE " + stage + " TRIAL " + configuration_string
+                     + " THROUGHPUT: " + str(round(throughput, 2)) + " " + unit + "\n")
+    sys.stderr.flush()
+
+
+def run_image_generation_trials(options, intervals, bed_list, tune_directory):
+    """
+    Time image generation of the sampled intervals with different numbers of processes.
+    :param options: Options for tuning
+    :param intervals: Sampled intervals
+    :param bed_list: List of intervals from bed file
+    :param tune_directory: Directory for trial outputs
+    :return: Best number of processes and the directory holding the images generated by that trial
+    """
+    total_bases = sum(interval_end - interval_start for _, interval_start, interval_end in intervals)
+    process_candidates = sorted(set([max(1, int(options.threads / 2)), options.threads, 2 * options.threads]))
+
+    best_processes = None
+    best_throughput = 0
+    best_image_directory = None
+    for total_processes in process_candidates:
+        image_directory = ImageGenerationUtils.handle_output_directory(tune_directory + "images_" + str(total_processes))
+        options.image_output_directory = image_directory
+
+        start_time = time.time()
+        ImageGenerationUtils.generate_images_for_intervals(options, intervals, bed_list, total_processes)
+        throughput = total_bases / max(1e-6, time.time() - start_time)
+        report_trial("IMAGE GENERATION", {'processes': total_processes}, throughput, "BASES/Sec")
+
+        if throughput > best_throughput:
+            if best_image_directory is not None:
+                shutil.rmtree(best_image_directory)
+            best_processes = total_processes
+            best_throughput = throughput
+            best_image_directory = image_directory
+        else:
+            shutil.rmtree(image_directory)
+
+    return best_processes, best_image_directory
+
+
+def get_sampled_work_units(image_directory):
+    """
+    Get the inference work units of the sampled images. Tuning stops if the sampled intervals have no candidates as
+    the inference trials would have nothing to time.
+    :param image_directory: Directory containing the sampled images
+    :return: Work units and total number of candidates in them
+    """
+    work_units = get_work_units(get_file_paths_from_directory(image_directory), InferenceOptions.SUMMARIES_PER_WORK_UNIT)
+    total_candidates = sum(work_unit[2] for work_unit in work_units)
+    if total_candidates == 0:
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] ERROR: NO CANDIDATES FOUND IN THE SAMPLED INTERVALS, "
+                         "RE-RUN TUNE WITH A LARGER --tune_intervals OR A DIFFERENT REGION.\n")
+        exit(1)
+    return work_units, total_candidates
+
+
+def time_cpu_inference(options, work_units, total_candidates, tune_directory, callers, threads_per_caller):
+    prediction_directory = ImageGenerationUtils.handle_output_directory(tune_directory + "predictions")
+    start_time = time.time()
+    run_distributed_cpu(options, work_units, prediction_directory, callers, threads_per_caller)
+    throughput = total_candidates / max(1e-6, time.time() - start_time)
+    shutil.rmtree(prediction_directory)
+    return throughput
+
+
+def time_gpu_inference(options, image_directory, total_candidates, tune_directory):
+    prediction_directory = ImageGenerationUtils.handle_output_directory(tune_directory + "predictions")
+    start_time = time.time()
+    distributed_gpu(options, image_directory, prediction_directory)
+    throughput = total_candidates / max(1e-6, time.time() - start_time)
+    shutil.rmtree(prediction_directory)
+    return throughput
+
+
+def run_cpu_inference_trials(options, image_directory, tune_directory):
+    """
+    Time CPU inference of the sampled images. The split of threads between callers is tuned first, then the batch
+    size is tuned for the best split.
+    :param options: Options for tuning
+    :param image_directory: Directory containing the sampled images
+    :param tune_directory: Directory for trial outputs
+    :return: Best callers, threads per caller and batch size
+    """
+    work_units, total_candidates = get_sampled_work_units(image_directory)
+    # a cold ONNX cache exports and optimizes the model, do it before the trials so only inference is timed
+    prepare_cpu_inference(options, tune_directory)
+
+    best_split = None
+    best_throughput = 0
+    for threads_per_caller in TUNE_THREADS_PER_CALLER:
+        if threads_per_caller > options.threads:
+            continue
+        callers = max(1, min(int(options.threads / threads_per_caller), len(work_units)))
+        throughput = time_cpu_inference(options, work_units, total_candidates, tune_directory, callers, threads_per_caller)
+        report_trial("INFERENCE", {'callers': callers, 'threads_per_caller': threads_per_caller, 'batch_size': options.batch_size},
+                     throughput, "CANDIDATES/Sec")
+        if throughput > best_throughput:
+            best_split = (callers, threads_per_caller)
+            best_throughput = throughput
+
+    if best_split is None:
+        # no trial measured any throughput, keep the split call_variant uses without a profile
+        callers = max(1, min(int(options.threads), len(work_units)))
+        best_split = (callers, max(1, int(options.threads / callers)))
+
+    best_batch_size = options.batch_size
+    callers, threads_per_caller = best_split
+    for batch_size in TUNE_BATCH_SIZES:
+        if batch_size == best_batch_size:
+            continue
+        options.batch_size = batch_size
+        throughput = time_cpu_inference(options, work_units, total_candidates, tune_directory, callers, threads_per_caller)
+        report_trial("INFERENCE", {'callers': callers, 'threads_per_caller': threads_per_caller, 'batch_size': batch_size},
+                     throughput, "CANDIDATES/Sec")
+        if throughput > best_throughput:
+            best_batch_size = batch_size
+            best_throughput = throughput
+
+    return callers, threads_per_caller, best_batch_size
+
+
+def run_gpu_inference_trials(options, image_directory, tune_directory):
+    """
+    Time GPU inference of the sampled images. Callers per GPU are tuned first, then the batch size.
+    :param options: Options for tuning
+    :param image_directory: Directory containing the sampled images
+    :param tune_directory: Directory for trial outputs
+    :return: Best callers per GPU and batch size
+    """
+    work_units, total_candidates = get_sampled_work_units(image_directory)
+
+    default_callers_per_gpu = options.callers_per_gpu
+    best_callers_per_gpu = None
+    best_throughput = 0
+    for callers_per_gpu in TUNE_CALLERS_PER_GPU:
+        options.callers_per_gpu = callers_per_gpu
+        throughput = time_gpu_inference(options, image_directory, total_candidates, tune_directory)
+        report_trial("GPU INFERENCE", {'callers_per_gpu': callers_per_gpu, 'batch_size': options.batch_size}, throughput, "CANDIDATES/Sec")
+        if throughput > best_throughput:
+            best_callers_per_gpu = callers_per_gpu
+            best_throughput = throughput
+
+    if best_callers_per_gpu is None:
+        # no trial measured any throughput, keep the callers per GPU given on the command line
+        best_callers_per_gpu = default_callers_per_gpu
+
+    options.callers_per_gpu = best_callers_per_gpu
+    best_batch_size = options.batch_size
+    for batch_size in TUNE_BATCH_SIZES + [2 * TUNE_BATCH_SIZES[-1]]:
+        if batch_size == best_batch_size:
+            continue
+        options.batch_size = batch_size
+        throughput = time_gpu_inference(options, image_directory, total_candidates, tune_directory)
+        report_trial("GPU INFERENCE", {'callers_per_gpu': best_callers_per_gpu, 'batch_size': batch_size}, throughput, "CANDIDATES/Sec")
+        if throughput > best_throughput:
+            best_batch_size = batch_size
+            best_throughput = throughput
+
+    return best_callers_per_gpu, best_batch_size
+
+
+def tune(options):
+    """
+    Run short timed trials of image generation and inference on intervals sampled from the input and save the
+    configuration with the best throughput as a profile call_variant can load with --tune_profile.
+    :param options: Options for tuning, same as call_variant
+    :return:
+    """
+    start_time = time.time()
+    if not os.path.isfile(options.model_path):
+        sys.stderr.write("ERROR: CAN NOT LOCATE MODEL FILE.\n")
+        exit(1)
+
+    if options.shared_session and not options.gpu:
+        # a shared session runs inference with all the threads in one session, the threads per caller trials would measure nothing
+        sys.stderr.write("ERROR: TUNE DOES NOT SUPPORT --shared_session, RE-RUN TUNE WITHOUT IT.\n")
+        exit(1)
+
+    output_dir = ImageGenerationUtils.handle_output_directory(options.output_dir)
+    timestr = time.strftime("%m%d%Y_%H%M%S")
+    tune_directory = ImageGenerationUtils.handle_output_directory(os.path.abspath(output_dir + "tune_" + str(timestr)))
+
+    chr_list, bed_list = ImageGenerationUtils.get_chromosome_list(options.region, options.fasta, options.bam, region_bed=options.region_bed)
+    all_intervals, total_bases = ImageGenerationUtils.get_all_intervals(options, chr_list, bed_list)
+
+    total_samples = options.tune_intervals if options.tune_intervals is not None else 2 * options.threads
+    intervals = sample_intervals(all_intervals, total_samples)
+    if len(intervals) == 0:
+        shutil.rmtree(tune_directory)
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] ERROR: NO INTERVALS FOUND TO TUNE ON.\n")
+        exit(1)
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: TUNING ON " + str(len(intervals)) + "/"
+                     + str(len(all_intervals)) + " INTERVALS\n")
+
+    profile = {'host': platform.node(),
+               'cpu_count': os.cpu_count(),
+               'threads': options.threads,
+               'gpu': options.gpu}
+
+    try:
+        image_generation_processes, image_directory = run_image_generation_trials(options, intervals, bed_list, tune_directory)
+        profile['image_generation_processes'] = image_generation_processes
+
+        if options.gpu:
+            callers_per_gpu, batch_size = run_gpu_inference_trials(options, image_directory, tune_directory)
+            profile['callers_per_gpu'] = callers_per_gpu
+        else:
+            callers, threads_per_caller, batch_size = run_cpu_inference_trials(options, image_directory, tune_directory)
+            profile['callers'] = callers
+            profile['threads_per_caller'] = threads_per_caller
+        profile['batch_size'] = batch_size
+    finally:
+        shutil.rmtree(tune_directory)
+
+    profile_path = output_dir + TUNE_PROFILE_NAME
+    with open(profile_path, 'w') as profile_file:
+        json.dump(profile, profile_file, indent=4)
+
+    end_time = time.time()
+    mins = int((end_time - start_time) / 60)
+    secs = int((end_time - start_time)) % 60
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: BEST CONFIGURATION: " + json.dumps(profile) + "\n")
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: PROFILE SAVED, USE IT WITH: --tune_profile " + profile_path + "\n")
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: TOTAL ELAPSED TIME FOR TUNING: " + str(mins) + " Min " + str(secs) + " Sec\n")
+
+
+def load_tune_profile(options):
+    """
+    Apply a profile generated by tune to a set of options.
+    :param options: Options of call_variant
+    :return:
+    """
+    with open(options.tune_profile, 'r') as profile_file:
+        profile = json.load(profile_file)
+
+    if profile['threads'] != options.threads or profile['cpu_count'] != os.cpu_count():
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] WARNING: TUNE PROFILE WAS GENERATED WITH "
+                         + str(profile['threads']) + " THREADS ON A HOST WITH " + str(profile['cpu_count']) + " CPUS.\n")
+
+    options.image_generation_processes = profile['image_generation_processes']
+    options.batch_size = profile['batch_size']
+    if 'callers' in profile:
+        options.callers = profile['callers']
+        options.threads_per_caller = profile['threads_per_caller']
+    if 'callers_per_gpu' in profile:
+        options.callers_per_gpu = profile['callers_per_gpu']
+
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: LOADED TUNE PROFILE: " + json.dumps(profile) + "\n")
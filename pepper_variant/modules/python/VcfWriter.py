@@ -1,7 +1,10 @@
 import pysam
-from pysam import VariantFile, VariantHeader
+from pysam import VariantHeader, BGZFile
 from pepper_variant.build import PEPPER_VARIANT
 import collections
+import concurrent.futures
+import os
+import sys
 import math
 import numpy as np
 Candidate = collections.namedtuple('Candidate', 'chromosome_name pos_start pos_end ref '
@@ -9,13 +12,109 @@ Candidate = collections.namedtuple('Candidate', 'chromosome_name pos_start pos_e
                                                 'allele_frequencies genotype qual gq predictions')
 
 
+VCF_FORMAT = "GT:AP:GQ:DP:AD:VAF:REP"
+# empty BGZF block that marks the end of a bgzipped file
+BGZF_EOF_BLOCK = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+def concatenate_bgzf_fragments(vcf_file_name, fragment_file_names):
+    """
+    Append bgzipped VCF fragments to a header-only bgzipped VCF at the BGZF block level, without decompressing them.
+    All files must be written with the same header. htslib flushes the header into its own blocks, so the records of
+    a fragment start at the block boundary right after the header.
+    :param vcf_file_name: Path to a bgzipped VCF that only contains the header, replaced by the concatenated VCF
+    :param fragment_file_names: Paths to the bgzipped VCF fragments in output order
+    :return:
+    """
+    with open(vcf_file_name, 'rb') as header_file:
+        header_blocks = header_file.read()
+    if header_blocks.endswith(BGZF_EOF_BLOCK):
+        header_blocks = header_blocks[:-len(BGZF_EOF_BLOCK)]
+
+    temporary_file_name = vcf_file_name + ".tmp"
+    with open(temporary_file_name, 'wb') as output_file:
+        output_file.write(header_blocks)
+        for fragment_file_name in fragment_file_names:
+            with open(fragment_file_name, 'rb') as fragment_file:
+                if fragment_file.read(len(header_blocks)) != header_blocks:
+                    raise ValueError("VCF FRAGMENT HEADER DOES NOT MATCH: " + fragment_file_name)
+
+                remaining_bytes = os.path.getsize(fragment_file_name) - len(header_blocks) - len(BGZF_EOF_BLOCK)
+                while remaining_bytes > 0:
+                    blocks = fragment_file.read(min(remaining_bytes, 1 << 20))
+                    output_file.write(blocks)
+                    remaining_bytes -= len(blocks)
+        output_file.write(BGZF_EOF_BLOCK)
+
+    os.replace(temporary_file_name, vcf_file_name)
+
+
+def index_vcf_file(vcf_file_name):
+    pysam.tabix_index(vcf_file_name, preset="vcf", force=True)
+    return vcf_file_name
+
+
+def index_vcf_files(vcf_file_names, threads):
+    """
+    Index bgzipped VCFs with tabix in parallel.
+    :param vcf_file_names: Paths to bgzipped VCFs
+    :param threads: Maximum number of processes
+    :return:
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, min(threads, len(vcf_file_names)))) as executor:
+        futures = [executor.submit(index_vcf_file, vcf_file_name) for vcf_file_name in vcf_file_names]
+        for fut in concurrent.futures.as_completed(futures):
+            if fut.exception() is not None:
+                sys.stderr.write("ERROR IN INDEXING VCF: " + str(fut.exception()) + "\n")
+            fut._result = None  # python issue 27144
+
+
+def format_vcf_floats(values):
+    # htslib keeps VCF floats in single precision and prints them with %g, format them the same way
+    return ",".join(["%g" % value for value in np.array(values, dtype=np.float32).tolist()])
+
+
+def format_vcf_record(contig, ref_start, alleles, qual, vcf_filter, genotype, non_alt_predictions, genotype_quality, depth,
+                      variant_allele_support, vafs, rep):
+    """
+    Format a VCF record with the GT:AP:GQ:DP:AD:VAF:REP format fields of a single sample as a line of text.
+    :param contig: Contig name
+    :param ref_start: Zero based start position of the record
+    :param alleles: Reference allele followed by the alternate alleles
+    :param qual: Quality of the record
+    :param vcf_filter: Filter of the record
+    :param genotype: Genotype as a list of allele indices
+    :param non_alt_predictions: Non-reference predictions of the alleles
+    :param genotype_quality: Genotype quality
+    :param depth: Depth at the site
+    :param variant_allele_support: Read support of each alternate allele
+    :param vafs: Variant allele fraction of each alternate allele
+    :param rep: 1 if the site is in a low complexity region, 0 otherwise
+    :return: Encoded VCF line
+    """
+    sample = ":".join(["/".join([str(allele_index) for allele_index in genotype]),
+                       format_vcf_floats(non_alt_predictions),
+                       format_vcf_floats([genotype_quality]),
+                       str(depth),
+                       ",".join([str(support) for support in variant_allele_support]),
+                       format_vcf_floats(vafs),
+                       rep])
+    vcf_line = "\t".join([contig, str(ref_start + 1), '.', alleles[0], ",".join(alleles[1:]), format_vcf_floats([qual]),
+                          vcf_filter, '.', VCF_FORMAT, sample])
+    return (vcf_line + "\n").encode()
+
+
 class VCFWriter:
-    def __init__(self, all_contigs, reference_file_path, sample_name, output_dir, filename_full, filename_pepper, filename_variant_calling):
-        self.fasta_handler = PEPPER_VARIANT.FASTA_handler(reference_file_path)
-        contigs = self.fasta_handler.get_chromosome_names()
-        # contigs = [x for x in contigs if x in all_contigs]
-        self.contigs = contigs
-        self.vcf_header = self.get_vcf_header(sample_name, contigs)
+    def __init__(self, all_contigs, reference_file_path, sample_name, output_dir, filename_full, filename_pepper, filename_variant_calling,
+                 vcf_header_text=None):
+        if vcf_header_text is None:
+            self.fasta_handler = PEPPER_VARIANT.FASTA_handler(reference_file_path)
+            contigs = self.fasta_handler.get_chromosome_names()
+            # contigs = [x for x in contigs if x in all_contigs]
+            self.contigs = contigs
+            vcf_header_text = str(self.get_vcf_header(sample_name, contigs))
+        # the header lists every reference contig, writers of VCF fragments reuse the header text built once
+        self.vcf_header_text = vcf_header_text
         self.output_dir = output_dir
 
         self.full_vcf_file_name = self.output_dir + filename_full + '.vcf.gz'
@@ -24,27 +123,34 @@ class VCFWriter:
         self.snp_variant_vcf_file_name = self.output_dir + filename_variant_calling + '_SNPs.vcf.gz'
         self.indel_variant_vcf_file_name = self.output_dir + filename_variant_calling + '_INDEL.vcf.gz'
 
-        self.vcf_file_full = VariantFile(self.full_vcf_file_name, 'w', header=self.vcf_header)
-        self.vcf_file_pepper = VariantFile(self.pepper_vcf_file_name, 'w', header=self.vcf_header)
-        self.vcf_file_variant_calling = VariantFile(self.variant_vcf_file_name, 'w', header=self.vcf_header)
-        self.vcf_file_variant_calling_snp = VariantFile(self.snp_variant_vcf_file_name, 'w', header=self.vcf_header)
-        self.vcf_file_variant_calling_indel = VariantFile(self.indel_variant_vcf_file_name, 'w', header=self.vcf_header)
-
-    def __del__(self):
-        # close the files
+        # records are formatted as text and written to BGZF directly, pysam is only used to build the header
+        self.vcf_file_full = self.open_vcf_file(self.full_vcf_file_name)
+        self.vcf_file_pepper = self.open_vcf_file(self.pepper_vcf_file_name)
+        self.vcf_file_variant_calling = self.open_vcf_file(self.variant_vcf_file_name)
+        self.vcf_file_variant_calling_snp = self.open_vcf_file(self.snp_variant_vcf_file_name)
+        self.vcf_file_variant_calling_indel = self.open_vcf_file(self.indel_variant_vcf_file_name)
+
+        self.vcf_file_names = [self.full_vcf_file_name,
+                               self.pepper_vcf_file_name,
+                               self.variant_vcf_file_name,
+                               self.snp_variant_vcf_file_name,
+                               self.indel_variant_vcf_file_name]
+
+    def open_vcf_file(self, vcf_file_name):
+        vcf_file = BGZFile(vcf_file_name, 'wb')
+        vcf_file.write(self.vcf_header_text.encode())
+        # end the header block so records of fragments can be concatenated at the block level
+        vcf_file.flush()
+        return vcf_file
+
+    def close(self):
+        # indexing is done explicitly with index_vcf_files once all fragments are concatenated
         self.vcf_file_full.close()
         self.vcf_file_pepper.close()
         self.vcf_file_variant_calling.close()
         self.vcf_file_variant_calling_snp.close()
         self.vcf_file_variant_calling_indel.close()
 
-        # index the files
-        pysam.tabix_index(self.full_vcf_file_name, preset="vcf", force=True)
-        pysam.tabix_index(self.pepper_vcf_file_name, preset="vcf", force=True)
-        pysam.tabix_index(self.variant_vcf_file_name, preset="vcf", force=True)
-        pysam.tabix_index(self.snp_variant_vcf_file_name, preset="vcf", force=True)
-        pysam.tabix_index(self.indel_variant_vcf_file_name, preset="vcf", force=True)
-
     def candidate_list_to_variant(self, candidates, options):
         candidates = sorted(candidates, key=lambda x: (x[5], x[8]), reverse=True)
         if len(candidates) > options.allowed_multiallelics:
@@ -137,13 +243,12 @@ class VCFWriter:
         # print(site_contig, site_ref_start, site_ref_end, site_ref_allele, site_alts, gt, site_depth, site_supports, gt_qual)
         return site_contig, site_ref_start, site_ref_end, site_ref_allele, site_alts, gt, site_depth, site_supports, gt_qual, site_non_alt_predictions, site_in_repeat
 
-    def write_vcf_records(self, variants_list, options):
+    def write_vcf_records(self, sorted_sites, options):
         total_variants, total_variants_pepper, total_variants_variant_calling, total_variants_variant_calling_snp, total_variants_variant_calling_indel = 0, 0, 0, 0, 0
 
         last_position = -1
-        for contig, position in sorted(variants_list):
-            all_candidates = variants_list[(contig, position)]
-
+        # sites are streamed in coordinate order as (contig, position, candidates)
+        for contig, position, all_candidates in sorted_sites:
             contig, ref_start, ref_end, ref_seq, alleles, genotype, depth, variant_allele_support, genotype_probability, non_alt_predictions, site_in_repeat = self.candidate_list_to_variant(all_candidates, options)
             # print("RETURNED", contig, ref_start, ref_end, ref_seq, alleles, genotype, depth, variant_allele_support, genotype_probability)
             if len(alleles) <= 0:
@@ -186,17 +291,11 @@ class VCFWriter:
 
             # always put things in all vcf
             if genotype == [0, 0]:
-                vcf_record = self.vcf_file_full.new_record(contig=str(contig), start=ref_start,
-                                                           stop=ref_end, id='.', qual=qual,
-                                                           filter='refCall', alleles=alleles, GT=genotype,
-                                                           AP=non_alt_predictions, GQ=alt_qual, DP=depth, AD=variant_allele_support, VAF=vafs,
-                                                           REP=rep)
+                vcf_record = format_vcf_record(str(contig), ref_start, alleles, qual, 'refCall', genotype,
+                                               non_alt_predictions, alt_qual, depth, variant_allele_support, vafs, rep)
             else:
-                vcf_record = self.vcf_file_full.new_record(contig=str(contig), start=ref_start,
-                                                           stop=ref_end, id='.', qual=qual,
-                                                           filter='PASS', alleles=alleles, GT=genotype,
-                                                           AP=non_alt_predictions, GQ=qual, DP=depth, AD=variant_allele_support, VAF=vafs,
-                                                           REP=rep)
+                vcf_record = format_vcf_record(str(contig), ref_start, alleles, qual, 'PASS', genotype,
+                                               non_alt_predictions, qual, depth, variant_allele_support, vafs, rep)
 
             self.vcf_file_full.write(vcf_record)
             total_variants += 1
@@ -1,5 +1,7 @@
 import torch
+import torch.onnx
 from pepper_variant.modules.python.models.simple_model import TransducerGRU
+from pepper_variant.modules.python.Options import ImageSizeOptions, InferenceOptions
 
 
 class ModelHandler:
@@ -43,6 +45,18 @@ class ModelHandler:
 
         return transducer_model, hidden_size, gru_layers, epochs
 
+    @staticmethod
+    def export_to_onnx(transducer_model, image_features, onnx_path):
+        x = torch.zeros(1, ImageSizeOptions.CANDIDATE_WINDOW_SIZE + 1, image_features)
+        torch.onnx.export(transducer_model, x,
+                          onnx_path,
+                          opset_version=InferenceOptions.ONNX_OPSET_VERSION,
+                          do_constant_folding=True,
+                          input_names=['image'],
+                          output_names=['output_type'],
+                          dynamic_axes={'image': {0: 'batch_size'},
+                                        'output_type': {0: 'batch_size'}})
+
     @staticmethod
     def load_simple_optimizer(transducer_optimizer, checkpoint_path, gpu_mode):
         if gpu_mode:
@@ -0,0 +1,164 @@
+import math
+import time
+import numpy as np
+from pepper_variant.modules.python.Options import ImageSizeOptions, CascadeOptions
+
+
+def softmax(x):
+    exp_x = np.exp(x - np.max(x, axis=1, keepdims=True))
+    return exp_x / np.sum(exp_x, axis=1, keepdims=True)
+
+
+class CascadeClassifier(object):
+    """
+    First stage of the confidence cascade. A softmax regression over the flattened candidate image settles the
+    candidates it is confident about, all other candidates are sent to the full network. Confidence thresholds are
+    calibrated per predicted genotype on held-out images.
+    """
+    def __init__(self, feature_mean, feature_scale, weights, bias, thresholds):
+        self.feature_mean = feature_mean
+        self.feature_scale = feature_scale
+        self.weights = weights
+        self.bias = bias
+        self.thresholds = thresholds
+
+    @staticmethod
+    def load(model_path):
+        with np.load(model_path) as cascade_file:
+            return CascadeClassifier(cascade_file['feature_mean'],
+                                     cascade_file['feature_scale'],
+                                     cascade_file['weights'],
+                                     cascade_file['bias'],
+                                     cascade_file['thresholds'])
+
+    def save(self, model_path):
+        with open(model_path, 'wb') as cascade_file:
+            np.savez(cascade_file,
+                     feature_mean=self.feature_mean,
+                     feature_scale=self.feature_scale,
+                     weights=self.weights,
+                     bias=self.bias,
+                     thresholds=self.thresholds)
+
+    @property
+    def total_features(self):
+        return self.weights.shape[0]
+
+    def get_features(self, images):
+        features = images.reshape(images.shape[0], -1).astype(np.float32)
+        return (features - self.feature_mean) / self.feature_scale
+
+    def predict_proba(self, images):
+        return softmax(self.get_features(images) @ self.weights + self.bias).astype(np.float32)
+
+    def get_settled(self, probabilities):
+        predicted_labels = np.argmax(probabilities, axis=1)
+        confidence = probabilities[np.arange(len(probabilities)), predicted_labels]
+        return confidence >= self.thresholds[predicted_labels]
+
+
+def train_cascade_classifier(images, type_labels):
+    """
+    Fit the softmax regression of the first stage. Thresholds are left at infinity until calibrated.
+    :param images: Training images
+    :param type_labels: Truth genotype labels of the images
+    :return: A CascadeClassifier
+    """
+    features = images.reshape(images.shape[0], -1).astype(np.float32)
+    feature_mean = features.mean(axis=0)
+    feature_scale = features.std(axis=0) + 1e-6
+    features = (features - feature_mean) / feature_scale
+
+    weights = np.zeros((features.shape[1], ImageSizeOptions.TOTAL_TYPE_LABELS), dtype=np.float32)
+    bias = np.zeros(ImageSizeOptions.TOTAL_TYPE_LABELS, dtype=np.float32)
+
+    for epoch in range(CascadeOptions.EPOCHS):
+        permutation = np.random.permutation(len(features))
+        for batch_start in range(0, len(features), CascadeOptions.BATCH_SIZE):
+            batch_indices = permutation[batch_start:batch_start + CascadeOptions.BATCH_SIZE]
+            batch_features = features[batch_indices]
+
+            # gradient of the cross entropy loss
+            gradient = softmax(batch_features @ weights + bias)
+            gradient[np.arange(len(batch_indices)), type_labels[batch_indices]] -= 1
+            gradient /= len(batch_indices)
+
+            weights -= CascadeOptions.LEARNING_RATE * (batch_features.T @ gradient + CascadeOptions.L2_PENALTY * weights)
+            bias -= CascadeOptions.LEARNING_RATE * gradient.sum(axis=0)
+
+    thresholds = np.full(ImageSizeOptions.TOTAL_TYPE_LABELS, np.inf, dtype=np.float32)
+    return CascadeClassifier(feature_mean, feature_scale, weights, bias, thresholds)
+
+
+def calibrate_cascade_thresholds(cascade, images, type_labels, max_error_rate):
+    """
+    Set the lowest confidence threshold per predicted genotype that keeps the error rate of settled candidates within
+    the bound on held-out images. A genotype is only settled if enough images are seen to observe at least one error
+    at the bound, otherwise all candidates of that genotype go to the full network.
+    :param cascade: A trained CascadeClassifier
+    :param images: Held-out images
+    :param type_labels: Truth genotype labels of the images
+    :param max_error_rate: Maximum allowed error rate among settled candidates
+    :return:
+    """
+    probabilities = cascade.predict_proba(images)
+    predicted_labels = np.argmax(probabilities, axis=1)
+    confidence = np.max(probabilities, axis=1)
+    min_support = int(math.ceil(1.0 / max_error_rate))
+
+    for label in range(ImageSizeOptions.TOTAL_TYPE_LABELS):
+        label_indices = np.where(predicted_labels == label)[0]
+        order = label_indices[np.argsort(-confidence[label_indices])]
+        errors = np.cumsum(type_labels[order] != label)
+        error_rates = errors / np.arange(1, len(order) + 1)
+
+        acceptable = np.where(error_rates <= max_error_rate)[0]
+        acceptable = acceptable[acceptable + 1 >= min_support]
+        if len(acceptable) == 0:
+            cascade.thresholds[label] = np.inf
+        else:
+            cascade.thresholds[label] = confidence[order[acceptable[-1]]]
+
+
+def predict_with_cascade(cascade, ort_session, input_name, images):
+    """
+    Predict genotypes of a batch, only images the first stage is not confident about are sent to the network.
+    :param cascade: A calibrated CascadeClassifier or None
+    :param ort_session: ONNX session of the full network
+    :param input_name: Name of the input of the session
+    :param images: Batch of images in the input type of the session
+    :return: Genotype probabilities and number of images settled by the first stage
+    """
+    if cascade is None:
+        return ort_session.run(None, {input_name: images})[0], 0
+
+    probabilities = cascade.predict_proba(images)
+    settled = cascade.get_settled(probabilities)
+    unsettled = np.logical_not(settled)
+
+    if np.any(unsettled):
+        probabilities[unsettled] = ort_session.run(None, {input_name: np.ascontiguousarray(images[unsettled])})[0]
+
+    return probabilities, int(np.sum(settled))
+
+
+def evaluate_cascade(cascade, ort_session, input_name, images, batch_size):
+    """
+    Run the cascade on a set of images.
+    :param cascade: A calibrated CascadeClassifier
+    :param ort_session: ONNX session of the full network
+    :param input_name: Name of the input of the session
+    :param images: Images to evaluate on
+    :param batch_size: Batch size for inference
+    :return: Predicted labels, number of images settled by the first stage and time spent on inference
+    """
+    predicted_labels = []
+    total_settled = 0
+    start_time = time.time()
+    for batch_start in range(0, len(images), batch_size):
+        output_type, settled = predict_with_cascade(cascade, ort_session, input_name, images[batch_start:batch_start + batch_size])
+        predicted_labels.append(np.argmax(output_type, axis=1))
+        total_settled += settled
+    inference_time = time.time() - start_time
+
+    return np.concatenate(predicted_labels), total_settled, inference_time
@@ -1,5 +1,6 @@
 from os.path import isfile, join
 from os import listdir
+import os
 from torch.utils.data import Dataset
 import torchvision.transforms as transforms
 import h5py
@@ -136,21 +137,39 @@ class SequenceDatasetHP(Dataset):
                     sys.stderr.write("WARN: NO IMAGES FOUND IN FILE: " + hdf5_file_path + "\n")
 
         self.all_images = file_image_pair
+        # opened lazily in each dataloader worker and kept open across items
+        self.hdf5_files = {}
+        self.hdf5_files_pid = None
+
+    def get_hdf5_file(self, hdf5_filepath):
+        if self.hdf5_files_pid != os.getpid():
+            # handles inherited through a fork share file state with the parent, never reuse them
+            self.hdf5_files = {}
+            self.hdf5_files_pid = os.getpid()
+        if hdf5_filepath not in self.hdf5_files:
+            self.hdf5_files[hdf5_filepath] = h5py.File(hdf5_filepath, 'r')
+        return self.hdf5_files[hdf5_filepath]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['hdf5_files'] = {}
+        state['hdf5_files_pid'] = None
+        return state
 
     def __getitem__(self, index):
         # load the image
         hdf5_filepath, image_name = self.all_images[index]
 
-        with h5py.File(hdf5_filepath, 'r') as hdf5_file:
-            image_hp1 = hdf5_file['summaries'][image_name]['image_hp1'][()]
-            image_hp2 = hdf5_file['summaries'][image_name]['image_hp2'][()]
+        summary = self.get_hdf5_file(hdf5_filepath)['summaries'][image_name]
+        image_hp1 = summary['image_hp1'][()]
+        image_hp2 = summary['image_hp2'][()]
 
-            position = hdf5_file['summaries'][image_name]['position'][()]
-            index = hdf5_file['summaries'][image_name]['index'][()]
-            contig = hdf5_file['summaries'][image_name]['contig'][()]
-            chunk_id = hdf5_file['summaries'][image_name]['chunk_id'][()]
-            contig_start = hdf5_file['summaries'][image_name]['region_start'][()]
-            contig_end = hdf5_file['summaries'][image_name]['region_end'][()]
+        position = summary['position'][()]
+        index = summary['index'][()]
+        contig = summary['contig'][()]
+        chunk_id = summary['chunk_id'][()]
+        contig_start = summary['region_start'][()]
+        contig_end = summary['region_end'][()]
 
         return contig, contig_start, contig_end, chunk_id, image_hp1, image_hp2, position, index
 
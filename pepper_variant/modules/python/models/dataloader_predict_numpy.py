@@ -0,0 +1,132 @@
+import threading
+import queue
+import h5py
+import numpy as np
+
+
+def get_all_summary_names(input_file):
+    summary_names = []
+    with h5py.File(input_file, 'r') as hdf5_file:
+        if 'summaries' in hdf5_file:
+            summary_names = list(hdf5_file['summaries'].keys())
+
+    return summary_names
+
+
+def get_work_units(input_files, summaries_per_unit):
+    """
+    Split image files into work units of a few summaries each. Units are ordered from largest to smallest so callers
+    finish the long units first and the short ones fill the gaps at the end.
+    :param input_files: Image files
+    :param summaries_per_unit: Maximum number of summaries in a work unit
+    :return: A list of (file path, summary names, total images) work units
+    """
+    work_units = []
+    for input_file in input_files:
+        with h5py.File(input_file, 'r') as hdf5_file:
+            if 'summaries' not in hdf5_file:
+                continue
+            summary_names = list(hdf5_file['summaries'].keys())
+            for i in range(0, len(summary_names), summaries_per_unit):
+                unit_summary_names = summary_names[i:i + summaries_per_unit]
+                # only the dataset shape is read here, not the images
+                total_images = sum(hdf5_file['summaries'][summary_name]['images'].shape[0] for summary_name in unit_summary_names)
+                work_units.append((input_file, unit_summary_names, total_images))
+
+    work_units.sort(key=lambda work_unit: work_unit[2], reverse=True)
+    return work_units
+
+
+class SequenceBatchReader(object):
+    """
+    Torch-free batch reader of candidate images used by CPU inference. Batches never span two summaries and images
+    are returned in the int8 format they are stored in.
+    Arguments:
+        A HDF5 file path, names of the summaries to read and a batch size
+    """
+    def __init__(self, input_file, summary_names, batch_size):
+        self.input_file = input_file
+        self.summary_names = summary_names
+        self.batch_size = batch_size
+
+    def __iter__(self):
+        with h5py.File(self.input_file, 'r') as hdf5_file:
+            if 'summaries' not in hdf5_file:
+                return
+
+            for summary_name in self.summary_names:
+                summary = hdf5_file['summaries'][summary_name]
+                contigs = summary['contigs'][()]
+                positions = summary['positions'][()]
+                depths = summary['depths'][()]
+                candidates = summary['candidates'][()]
+                candidate_frequencies = summary['candidate_frequency'][()]
+                images = summary['images'][()]
+
+                for batch_start in range(0, len(contigs), self.batch_size):
+                    batch_end = min(len(contigs), batch_start + self.batch_size)
+                    yield [contig.decode('UTF-8') for contig in contigs[batch_start:batch_end]], \
+                        list(positions[batch_start:batch_end]), \
+                        list(depths[batch_start:batch_end]), \
+                        list(candidates[batch_start:batch_end]), \
+                        list(candidate_frequencies[batch_start:batch_end]), \
+                        images[batch_start:batch_end]
+
+
+class PrefetchBatchReader(object):
+    """
+    Reads batches of an iterable in a background thread so HDF5 reads overlap with inference. Images are copied in
+    their stored int8 format into a fixed set of preallocated buffers, the model casts them to float inside the graph.
+    A buffer yielded to the caller is only reused after the caller asks for the next batch.
+    Arguments:
+        An iterable of batches in the SequenceBatchReader format, shape of a single image, a batch size and the
+        number of batches to read ahead
+    """
+    def __init__(self, batches, image_shape, batch_size, prefetch_batches):
+        self.batches = batches
+        self.image_shape = image_shape
+        self.batch_size = batch_size
+        self.prefetch_batches = max(1, prefetch_batches)
+
+    def read_batches(self, buffers, free_buffers, filled_buffers, stop_reading):
+        try:
+            for contigs, positions, depths, candidates, candidate_frequencies, images in self.batches:
+                buffer_id = free_buffers.get()
+                if stop_reading.is_set():
+                    return
+                np.copyto(buffers[buffer_id][:len(images)], images)
+                filled_buffers.put((buffer_id, len(images), contigs, positions, depths, candidates, candidate_frequencies))
+        except Exception as e:
+            filled_buffers.put(e)
+        finally:
+            filled_buffers.put(None)
+
+    def __iter__(self):
+        # one buffer is held by the caller while the rest are being filled
+        total_buffers = self.prefetch_batches + 1
+        buffers = [np.empty((self.batch_size,) + self.image_shape, dtype=np.int8) for _ in range(total_buffers)]
+        free_buffers = queue.Queue()
+        filled_buffers = queue.Queue()
+        stop_reading = threading.Event()
+        for buffer_id in range(total_buffers):
+            free_buffers.put(buffer_id)
+
+        reader_thread = threading.Thread(target=self.read_batches, args=(buffers, free_buffers, filled_buffers, stop_reading), daemon=True)
+        reader_thread.start()
+
+        try:
+            while True:
+                batch = filled_buffers.get()
+                if batch is None:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+
+                buffer_id, batch_length, contigs, positions, depths, candidates, candidate_frequencies = batch
+                yield contigs, positions, depths, candidates, candidate_frequencies, buffers[buffer_id][:batch_length]
+                free_buffers.put(buffer_id)
+        finally:
+            # unblock the reader if the caller stopped early
+            stop_reading.set()
+            free_buffers.put(None)
+            reader_thread.join()
@@ -0,0 +1,176 @@
+import os
+import sys
+import hashlib
+import onnxruntime
+from datetime import datetime
+from pepper_variant.modules.python.Options import ImageSizeOptions, InferenceOptions
+
+
+def get_file_checksum(file_path):
+    """
+    Calculate the sha256 checksum of a file.
+    :param file_path: Path to a file
+    :return: Hex digest of the file content
+    """
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as file_handle:
+        for block in iter(lambda: file_handle.read(1 << 20), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def get_cache_directory(model_path, output_filepath):
+    """
+    Return the cache directory for ONNX models. The cache lives next to the model so it can be reused across runs,
+    if that location is not writable (i.e. read-only containers) the output directory is used instead.
+    :param model_path: Path to the PyTorch model
+    :param output_filepath: Path to output directory
+    :return: Path to the cache directory
+    """
+    model_directory = os.path.dirname(os.path.abspath(model_path))
+    if os.access(model_directory, os.W_OK):
+        cache_directory = os.path.join(model_directory, InferenceOptions.ONNX_CACHE_DIRECTORY)
+    else:
+        cache_directory = os.path.join(output_filepath, InferenceOptions.ONNX_CACHE_DIRECTORY)
+
+    os.makedirs(cache_directory, exist_ok=True)
+    return cache_directory
+
+
+def get_temporary_path(file_path):
+    # temporary files are kept in the same directory so os.replace stays atomic
+    return file_path + ".tmp." + str(os.getpid())
+
+
+def export_model_to_cache(model_path, image_features, onnx_path):
+    """
+    Export a PyTorch checkpoint to ONNX and move it atomically to the cache.
+    :param model_path: Path to the PyTorch model
+    :param image_features: Number of features in an image
+    :param onnx_path: Path of the cached ONNX model
+    :return:
+    """
+    # torch is only needed when the cache is cold
+    from pepper_variant.modules.python.models.ModelHander import ModelHandler
+
+    transducer_model, hidden_size, gru_layers, prev_ite = \
+        ModelHandler.load_simple_model_for_training(model_path,
+                                                    image_features=image_features,
+                                                    num_classes=ImageSizeOptions.TOTAL_LABELS,
+                                                    num_type_classes=ImageSizeOptions.TOTAL_TYPE_LABELS)
+    transducer_model.eval()
+
+    temporary_path = get_temporary_path(onnx_path)
+    ModelHandler.export_to_onnx(transducer_model, image_features, temporary_path)
+    os.replace(temporary_path, onnx_path)
+
+
+def quantize_model_to_cache(onnx_path, quantized_path):
+    """
+    Dynamically quantize an ONNX model and move it atomically to the cache.
+    :param onnx_path: Path to the float ONNX model
+    :param quantized_path: Path of the cached quantized model
+    :return:
+    """
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    temporary_path = get_temporary_path(quantized_path)
+    quantize_dynamic(onnx_path, temporary_path, weight_type=QuantType.QUInt8)
+    os.replace(temporary_path, quantized_path)
+
+
+def optimize_model_to_cache(onnx_path, optimized_path):
+    """
+    Run ORT graph optimizations once and serialize the optimized graph to the cache. Only the hardware independent
+    optimizations are serialized, layout optimizations depend on the CPU and are applied when a session loads the model.
+    :param onnx_path: Path to an ONNX model
+    :param optimized_path: Path of the cached optimized model
+    :return:
+    """
+    temporary_path = get_temporary_path(optimized_path)
+    sess_options = onnxruntime.SessionOptions()
+    sess_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    sess_options.optimized_model_filepath = temporary_path
+    onnxruntime.InferenceSession(onnx_path, sess_options=sess_options)
+    os.replace(temporary_path, optimized_path)
+
+
+def add_input_cast_to_cache(onnx_path, int8_input_path):
+    """
+    Change the image input of an ONNX model to int8 and cast it to float inside the graph, so images can be passed to
+    the session in the format they are stored in. Move the model atomically to the cache.
+    :param onnx_path: Path to an ONNX model with a float image input
+    :param int8_input_path: Path of the cached model with an int8 image input
+    :return:
+    """
+    import onnx
+    from onnx import helper, TensorProto
+
+    model = onnx.load(onnx_path)
+    image_input = model.graph.input[0]
+    float_image_name = image_input.name + "_float"
+
+    for node in model.graph.node:
+        for i, input_name in enumerate(node.input):
+            if input_name == image_input.name:
+                node.input[i] = float_image_name
+
+    cast_node = helper.make_node('Cast', [image_input.name], [float_image_name], name=image_input.name + "_cast", to=TensorProto.FLOAT)
+    model.graph.node.insert(0, cast_node)
+    image_input.type.tensor_type.elem_type = TensorProto.INT8
+
+    temporary_path = get_temporary_path(int8_input_path)
+    onnx.save(model, temporary_path)
+    os.replace(temporary_path, int8_input_path)
+
+
+def prepare_onnx_model(options, image_features, output_filepath):
+    """
+    Return an ORT-optimized ONNX model for inference. Models are cached by the checksum of the source model, the opset
+    version, the quantization mode and the onnxruntime version, so an updated model is never served from a stale cache.
+    :param options: Options set for prediction
+    :param image_features: Number of features in an image
+    :param output_filepath: Path to output directory
+    :return: Path to the optimized ONNX model
+    """
+    cache_directory = get_cache_directory(options.model_path, output_filepath)
+    model_key = get_file_checksum(options.model_path)[:16] + "_opset" + str(InferenceOptions.ONNX_OPSET_VERSION)
+
+    onnx_path = os.path.join(cache_directory, "pepper_model_" + model_key + ".onnx")
+
+    if options.static_quantized_model is not None:
+        # the static model is already an ONNX graph, the PyTorch checkpoint is not exported
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: USING STATIC QUANTIZED MODEL: " + str(options.static_quantized_model) + "\n")
+        source_path = options.static_quantized_model
+        source_key = get_file_checksum(options.static_quantized_model)[:16] + "_static"
+    elif options.quantized:
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: MODEL QUANTIZATION ENABLED.\n")
+        source_path = os.path.join(cache_directory, "pepper_model_" + model_key + "_dynamic.onnx")
+        source_key = model_key + "_dynamic"
+        if not os.path.isfile(source_path):
+            if not os.path.isfile(onnx_path):
+                sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: SAVING MODEL TO ONNX CACHE: " + onnx_path + "\n")
+                export_model_to_cache(options.model_path, image_features, onnx_path)
+            quantize_model_to_cache(onnx_path, source_path)
+            sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: QUANTIZED MODEL SAVED.\n")
+    else:
+        source_path = onnx_path
+        source_key = model_key + "_float"
+        if not os.path.isfile(onnx_path):
+            sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: SAVING MODEL TO ONNX CACHE: " + onnx_path + "\n")
+            export_model_to_cache(options.model_path, image_features, onnx_path)
+
+    # images are stored as int8, casting inside the graph avoids expanding every batch to float32 before inference
+    int8_input_path = os.path.join(cache_directory, "pepper_model_" + source_key + "_int8input.onnx")
+    if not os.path.isfile(int8_input_path):
+        add_input_cast_to_cache(source_path, int8_input_path)
+    source_path = int8_input_path
+    source_key = source_key + "_int8input"
+
+    # the fusions of the optimized graph depend on the onnxruntime version that produced them
+    optimized_path = os.path.join(cache_directory, "pepper_model_" + source_key + "_ort" + onnxruntime.__version__ + "_extended.optimized.onnx")
+    if not os.path.isfile(optimized_path):
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: SAVING OPTIMIZED GRAPH: " + optimized_path + "\n")
+        optimize_model_to_cache(source_path, optimized_path)
+
+    return optimized_path
@@ -1,38 +1,44 @@
-import sys
 import os
-import torch
+import sys
 import time
-import torch.onnx
-import torch.nn as nn
 import onnxruntime
 from datetime import datetime
 import concurrent.futures
-from torch.utils.data import DataLoader
+import multiprocessing
+import queue
 import numpy as np
-from numpy import argmax
-import h5py
 
-from pepper_variant.modules.python.models.dataloader_predict import SequenceDataset
-from pepper_variant.modules.python.models.ModelHander import ModelHandler
-from pepper_variant.modules.python.Options import ImageSizeOptions, ImageSizeOptionsHP, TrainOptions
+from pepper_variant.modules.python.models.dataloader_predict_numpy import SequenceBatchReader, PrefetchBatchReader
+from pepper_variant.modules.python.models.onnx_cache import prepare_onnx_model
+from pepper_variant.modules.python.models.cascade import CascadeClassifier, predict_with_cascade
+from pepper_variant.modules.python.Options import ImageSizeOptions, ImageSizeOptionsHP, InferenceOptions
 from pepper_variant.modules.python.DataStorePredict import DataStore
+from pepper_variant.modules.python.CpuAffinity import get_placement, pin_worker
 
 
-def get_all_summary_names(input_file):
-    summary_names = []
-    with h5py.File(input_file, 'r') as hdf5_file:
-        if 'summaries' in hdf5_file:
-            summary_names = list(hdf5_file['summaries'].keys())
-
-    return summary_names
-
+def read_work_unit_batches(work_queue, batch_size):
+    """
+    Generate batches of work units pulled from the shared work queue until it is empty.
+    :param work_queue: Queue of (file path, summary names, total images) work units shared by all callers
+    :param batch_size: Batch size
+    :return: Batches in the SequenceBatchReader format
+    """
+    while True:
+        try:
+            input_file, summary_names, total_images = work_queue.get_nowait()
+        except queue.Empty:
+            return
 
-def chunks(file_list, n):
-    for i in range(0, len(file_list), n):
-        yield file_list[i:i + n]
+        batch_reader = SequenceBatchReader(input_file, summary_names, batch_size)
+        for batch in batch_reader:
+            yield batch
 
 
-def predict(options, input_filepath, file_chunks, output_filepath, threads, thread_id):
+def predict(options, work_queue, caller_progress, output_filepath, threads, worker_cpus, thread_id):
+    start_time = time.time()
+    if pin_worker(worker_cpus, thread_id) is not None:
+        # size the session thread pool to the CPUs this caller is pinned to
+        threads = len(worker_cpus)
     # create output file
     output_filename = output_filepath + "pepper_prediction_" + str(thread_id) + ".hdf"
     prediction_data_file = DataStore(output_filename, mode='w')
@@ -45,172 +51,312 @@ def predict(options, input_filepath, file_chunks, output_filepath, threads, thre
     sess_options = onnxruntime.SessionOptions()
     # sess_options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
     sess_options.inter_op_num_threads = 1
-    sess_options.intra_op_num_threads = 1
+    sess_options.intra_op_num_threads = threads
     sess_options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+    # the cached model is already optimized up to extended level, only the layout optimizations for this CPU are left
     sess_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
 
-    if options.quantized:
-        ort_session = onnxruntime.InferenceSession(options.quantized_model, sess_options=sess_options)
-    else:
-        ort_session = onnxruntime.InferenceSession(options.model_path + ".onnx", sess_options=sess_options)
-
-    torch.set_num_threads(1)
+    ort_session = onnxruntime.InferenceSession(options.onnx_model_path, sess_options=sess_options)
+    input_name = ort_session.get_inputs()[0].name
 
     if thread_id == 0:
         sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] " + "INFO: STARTING INFERENCE." + "\n")
         sys.stderr.flush()
 
-    batch_completed = 0
-    for input_file in file_chunks:
-        summary_names = get_all_summary_names(input_file)
-        if thread_id == 0:
-            sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] " +
-                             "INFO: TOTAL SUMMARIES: " + str(len(summary_names)) + ".\n")
-            sys.stderr.flush()
-        chunked_summary_names = list(chunks(summary_names, 1))
-
-        for summary_index, summary_names in enumerate(chunked_summary_names):
-            # data loader
-            input_data = SequenceDataset([input_filepath], input_file, summary_names)
-            data_loader = DataLoader(input_data,
-                                     batch_size=options.batch_size,
-                                     shuffle=False,
-                                     num_workers=options.num_workers,
-                                     collate_fn=SequenceDataset.my_collate)
-
-            with torch.no_grad():
-                for contigs, positions, depths, candidates, candidate_frequencies, images in data_loader:
-                    sys.stderr.flush()
-                    # run inference on onnx mode, which takes numpy inputs
-                    ort_inputs = {ort_session.get_inputs()[0].name: images.cpu().numpy()}
-                    # the return value comes as a list
-                    output_type = ort_session.run(None, ort_inputs)
-                    output_type = output_type[0]
-
-                    prediction_data_file.write_prediction(batch_completed, contigs, positions, depths, candidates, candidate_frequencies, output_type)
-
-                    batch_completed += 1
-
-            if thread_id == 0:
-                sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] " +
-                                 "INFO: SUMMARY PROCESSED " + str(summary_index + 1) + "/" + str(len(chunked_summary_names)) + ".\n")
-                sys.stderr.flush()
+    if options.use_hp_info:
+        image_features = ImageSizeOptionsHP.IMAGE_HEIGHT
+    else:
+        image_features = ImageSizeOptions.IMAGE_HEIGHT
+    image_shape = (ImageSizeOptions.CANDIDATE_WINDOW_SIZE + 1, image_features)
 
-    return thread_id
+    # batches are read in a background thread while the session runs the current batch
+    batch_reader = PrefetchBatchReader(read_work_unit_batches(work_queue, options.batch_size),
+                                       image_shape,
+                                       options.batch_size,
+                                       InferenceOptions.PREFETCH_BATCHES)
 
+    cascade = None
+    if options.cascade_model is not None:
+        cascade = CascadeClassifier.load(options.cascade_model)
 
-def predict_pytorch(input_filepath, file_chunks, output_filepath, model_path, batch_size, num_workers, threads):
-    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] " + "INFO: SETTING THREADS TO: " + str(threads) + ".\n")
-    torch.set_num_threads(threads)
-    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] " + "INFO: INTER OP-THREAD SET TO: " + str(torch.get_num_threads()) + ".\n")
-    sys.stderr.flush()
+    batch_completed = 0
+    total_candidates = 0
+    total_settled = 0
+    for contigs, positions, depths, candidates, candidate_frequencies, images in batch_reader:
+        # run inference on onnx mode, which takes numpy inputs, candidates settled by the cascade skip the network
+        output_type, settled = predict_with_cascade(cascade, ort_session, input_name, images)
+
+        prediction_data_file.write_prediction(batch_completed, contigs, positions, depths, candidates, candidate_frequencies, output_type)
+
+        batch_completed += 1
+        total_candidates += len(images)
+        total_settled += settled
+        caller_progress[thread_id] = total_candidates
+
+    if cascade is not None:
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] " + "INFO: CALLER " + str(thread_id) +
+                         " CANDIDATES SETTLED BY CASCADE " + str(total_settled) + "/" + str(total_candidates) + ".\n")
+        sys.stderr.flush()
 
-    transducer_model, hidden_size, gru_layers, prev_ite = \
-        ModelHandler.load_simple_model_for_training(model_path,
-                                                    image_features=ImageSizeOptions.IMAGE_HEIGHT,
-                                                    num_classes=ImageSizeOptions.TOTAL_LABELS,
-                                                    num_type_classes=ImageSizeOptions.TOTAL_TYPE_LABELS)
-    transducer_model.eval()
-    # create output file
-    output_filename = output_filepath + "pepper_prediction" + ".hdf"
-    prediction_data_file = DataStore(output_filename, mode='w')
+    return thread_id, total_candidates, time.time() - start_time
+
+
+def read_batches_to_shared_memory(options, work_queue, slot_names, image_shape, free_slots, filled_slots, stop_readers, reader_id):
+    """
+    Read image batches of work units from the shared work queue into shared memory slots owned by the shared inference
+    session. A reader finishes by posting (None, reader id, error) to the filled slots, error is None on success.
+    :param options: Options set for prediction
+    :param work_queue: Queue of work units shared by all readers
+    :param slot_names: Names of the shared memory blocks used as batch slots
+    :param image_shape: Shape of a single image
+    :param free_slots: Queue of slot ids that can be filled
+    :param filled_slots: Queue of filled slot ids with the batch metadata
+    :param stop_readers: Event set by the session when it stops, readers exit instead of waiting for a free slot
+    :param reader_id: Id of this reader
+    :return: Reader id
+    """
+    from multiprocessing import shared_memory
+    slots = [shared_memory.SharedMemory(name=slot_name) for slot_name in slot_names]
+    slot_images = [np.ndarray((options.batch_size,) + image_shape, dtype=np.int8, buffer=slot.buf) for slot in slots]
+
+    error = None
+    try:
+        for contigs, positions, depths, candidates, candidate_frequencies, images in read_work_unit_batches(work_queue, options.batch_size):
+            slot_id = None
+            while slot_id is None:
+                if stop_readers.is_set():
+                    return reader_id
+                try:
+                    slot_id = free_slots.get(timeout=1)
+                except queue.Empty:
+                    continue
+            # images stay int8, the model casts them to float inside the graph
+            slot_images[slot_id][:len(images)] = images
+            filled_slots.put((slot_id, len(images), contigs, positions, depths, candidates, candidate_frequencies))
+    except Exception as e:
+        error = str(e)
+    finally:
+        # always notify the session that this reader is done, otherwise the session waits forever
+        filled_slots.put((None, reader_id, error))
+        for slot in slots:
+            slot.close()
+
+    return reader_id
+
+
+def predict_shared_session(options, work_queue, output_filepath, total_readers, threads):
+    """
+    Run inference with one multi-threaded ONNX session fed by lightweight reader processes through shared memory.
+    Memory usage of this mode does not depend on the number of threads as the model is loaded only once.
+    :param options: Options set for prediction
+    :param work_queue: Queue of work units shared by all readers
+    :param output_filepath: Path to output directory
+    :param total_readers: Number of reader processes
+    :param threads: Number of threads used by the inference session
+    :return: True if every reader finished successfully, the partial output is removed otherwise
+    """
+    from multiprocessing import shared_memory
+    if options.use_hp_info:
+        image_features = ImageSizeOptionsHP.IMAGE_HEIGHT
+    else:
+        image_features = ImageSizeOptions.IMAGE_HEIGHT
 
-    # data loader
-    input_data = SequenceDataset(input_filepath)
-    data_loader = DataLoader(input_data,
-                             batch_size=batch_size,
-                             shuffle=False,
-                             num_workers=0,
-                             collate_fn=SequenceDataset.my_collate)
+    image_shape = (ImageSizeOptions.CANDIDATE_WINDOW_SIZE + 1, image_features)
+    slot_size = options.batch_size * int(np.prod(image_shape)) * np.dtype(np.int8).itemsize
 
-    transducer_model.eval()
+    # two slots per reader so a reader can fill a batch while the session runs the last one
+    total_slots = 2 * total_readers
+    slots = [shared_memory.SharedMemory(create=True, size=slot_size) for _ in range(total_slots)]
+    slot_images = [np.ndarray((options.batch_size,) + image_shape, dtype=np.int8, buffer=slot.buf) for slot in slots]
 
-    batch_completed = 0
-    total_batches = len(data_loader)
+    free_slots = multiprocessing.Queue()
+    filled_slots = multiprocessing.Queue()
+    stop_readers = multiprocessing.Event()
+    for slot_id in range(total_slots):
+        free_slots.put(slot_id)
 
-    with torch.no_grad():
-        for contigs, positions, depths, candidates, candidate_frequencies, images in data_loader:
-            sys.stderr.flush()
-            images = images.type(torch.FloatTensor)
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: SHARED SESSION MODE, READERS: "
+                     + str(total_readers) + " SESSION THREADS: " + str(threads) + ".\n")
+    sys.stderr.flush()
 
-            # run inference
-            output_type = transducer_model(images, False)
+    readers = [multiprocessing.Process(target=read_batches_to_shared_memory,
+                                       args=(options, work_queue, [slot.name for slot in slots], image_shape,
+                                             free_slots, filled_slots, stop_readers, reader_id))
+               for reader_id in range(0, total_readers)]
+    for reader in readers:
+        reader.start()
 
-            output_type = output_type.detach().cpu().numpy()
-            # output_type = output_type.detach().cpu().numpy()
+    output_filename = output_filepath + "pepper_prediction_shared.hdf"
+    prediction_data_file = None
+    batch_completed = 0
+    total_settled = 0
+    finished_readers = 0
+    failed = False
+    try:
+        # session options
+        sess_options = onnxruntime.SessionOptions()
+        sess_options.inter_op_num_threads = 1
+        sess_options.intra_op_num_threads = threads
+        sess_options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        # the cached model is already optimized up to extended level, only the layout optimizations for this CPU are left
+        sess_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        ort_session = onnxruntime.InferenceSession(options.onnx_model_path, sess_options=sess_options)
+        input_name = ort_session.get_inputs()[0].name
+
+        prediction_data_file = DataStore(output_filename, mode='w')
+
+        cascade = None
+        if options.cascade_model is not None:
+            cascade = CascadeClassifier.load(options.cascade_model)
+
+        while finished_readers < total_readers:
+            try:
+                batch = filled_slots.get(timeout=1)
+            except queue.Empty:
+                if not any(reader.is_alive() for reader in readers) and filled_slots.empty():
+                    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] ERROR: ALL READERS EXITED BEFORE FINISHING.\n")
+                    failed = True
+                    break
+                continue
+
+            if batch[0] is None:
+                _, reader_id, error = batch
+                if error is not None:
+                    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] ERROR: READER " + str(reader_id) + ": " + error + "\n")
+                    failed = True
+                    break
+                finished_readers += 1
+                continue
+
+            slot_id, batch_length, contigs, positions, depths, candidates, candidate_frequencies = batch
+            output_type, settled = predict_with_cascade(cascade, ort_session, input_name, slot_images[slot_id][:batch_length])
+            total_settled += settled
+            # the output is a copy so the slot can be handed back before writing
+            free_slots.put(slot_id)
 
             prediction_data_file.write_prediction(batch_completed, contigs, positions, depths, candidates, candidate_frequencies, output_type)
             batch_completed += 1
 
-            if batch_completed % 100 == 0 and batch_completed != 0:
-                sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] " + "INFO: BATCHES PROCESSED " + str(batch_completed) + "/" + str(total_batches) + ".\n")
+            if batch_completed % 100 == 0:
+                sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] " +
+                                 "INFO: BATCHES PROCESSED " + str(batch_completed) + ".\n")
                 sys.stderr.flush()
+    except Exception:
+        failed = True
+        raise
+    finally:
+        # readers waiting for a free slot exit on the stop event, readers that do not exit in time are terminated
+        stop_readers.set()
+        for reader in readers:
+            reader.join(timeout=InferenceOptions.READER_EXIT_TIMEOUT)
+            if reader.is_alive():
+                reader.terminate()
+                reader.join()
+        for slot in slots:
+            slot.close()
+            slot.unlink()
+        if prediction_data_file is not None:
+            prediction_data_file.file_handler.close()
+            if failed:
+                # a partial prediction file must never be picked up by find_candidates
+                os.remove(output_filename)
+
+    if failed:
+        return False
+
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] " +
+                     "INFO: TOTAL BATCHES PROCESSED " + str(batch_completed) + ".\n")
+    if cascade is not None:
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] " +
+                         "INFO: CANDIDATES SETTLED BY CASCADE " + str(total_settled) + ".\n")
+    sys.stderr.flush()
+    return True
 
 
-def predict_distributed_cpu(options, filepath, file_chunks, output_filepath, total_callers, threads_per_caller):
+def prepare_cpu_inference(options, output_filepath):
     """
-    Create a prediction table/dictionary of an images set using a trained model.
+    Check the cascade model and prepare the ONNX model used by the callers, options.onnx_model_path is set to it.
     :param options: Options set for prediction
-    :param filepath: Path to image files to predict on
-    :param file_chunks: Path to chunked files
-    :param output_filepath: Path to output directory
-    :param total_callers: Number of callers to start
-    :param threads_per_caller: Number of threads per caller.
-    :return: Prediction dictionary
+    :param output_filepath: Path to output directory, used for the ONNX cache if the model directory is not writable
+    :return:
     """
-    # predict_pytorch(filepath, file_chunks[0],  output_filepath, model_path, batch_size, num_workers, threads_per_caller)
     if options.use_hp_info:
         image_features = ImageSizeOptionsHP.IMAGE_HEIGHT
     else:
         image_features = ImageSizeOptions.IMAGE_HEIGHT
 
-    transducer_model, hidden_size, gru_layers, prev_ite = \
-        ModelHandler.load_simple_model_for_training(options.model_path,
-                                                    image_features=image_features,
-                                                    num_classes=ImageSizeOptions.TOTAL_LABELS,
-                                                    num_type_classes=ImageSizeOptions.TOTAL_TYPE_LABELS)
-    transducer_model.eval()
+    if options.cascade_model is not None:
+        cascade = CascadeClassifier.load(options.cascade_model)
+        if cascade.total_features != (ImageSizeOptions.CANDIDATE_WINDOW_SIZE + 1) * image_features:
+            sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] ERROR: CASCADE MODEL DOES NOT MATCH THE IMAGE SIZE.\n")
+            exit(1)
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: CASCADE ENABLED: " + options.cascade_model + "\n")
 
     sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: MODEL LOADING TO ONNX\n")
-    x = torch.zeros(1, ImageSizeOptions.CANDIDATE_WINDOW_SIZE + 1, image_features)
-
-    if not os.path.isfile(options.model_path + ".onnx"):
-        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: SAVING MODEL TO ONNX\n")
-        torch.onnx.export(transducer_model, x,
-                          options.model_path + ".onnx",
-                          opset_version=11,
-                          do_constant_folding=True,
-                          input_names=['image'],
-                          output_names=['output_type'],
-                          dynamic_axes={'image': {0: 'batch_size'},
-                                        'output_type': {0: 'batch_size'}})
-
-    if options.quantized:
-        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: MODEL QUANTIZATION ENABLED. \n")
-        from onnxruntime.quantization import quantize_dynamic, QuantType
-        quantize_dynamic(options.model_path + ".onnx", output_filepath + "pepper_model.quantized.onnx", weight_type=QuantType.QUInt8)
-        options.quantized_model = output_filepath + "pepper_model.quantized.onnx"
-        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: QUANTIZED MODEL SAVED.\n")
-    start_time = time.time()
+    options.onnx_model_path = prepare_onnx_model(options, image_features, output_filepath)
 
-    # file_chunks = None
-    # thread_id = 0
-    # predict(filepath, file_chunks, output_filepath, model_path, batch_size, num_workers, threads_per_caller, thread_id)
-
-    with concurrent.futures.ProcessPoolExecutor(max_workers=total_callers) as executor:
-        futures = [executor.submit(predict, options, filepath, file_chunks[thread_id], output_filepath, threads_per_caller, thread_id)
-                   for thread_id in range(0, total_callers)]
-
-        for fut in concurrent.futures.as_completed(futures):
-            if fut.exception() is None:
-                # get the results
-                thread_id = fut.result()
-                if thread_id == 0:
-                    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: THREAD "
-                                     + str(thread_id) + " FINISHED SUCCESSFULLY.\n")
-            else:
-                sys.stderr.write("ERROR: " + str(fut.exception()) + "\n")
-            fut._result = None  # python issue 27144
+
+def run_distributed_cpu(options, work_units, output_filepath, total_callers, threads_per_caller):
+    """
+    Run the callers on the work units with the ONNX model set up by prepare_cpu_inference.
+    :param options: Options set for prediction
+    :param work_units: Work units of (file path, summary names, total images) shared by all callers
+    :param output_filepath: Path to output directory
+    :param total_callers: Number of callers to start
+    :param threads_per_caller: Number of threads per caller.
+    :return:
+    """
+    start_time = time.time()
+    total_images = sum(work_unit[2] for work_unit in work_units)
+
+    with multiprocessing.Manager() as manager:
+        # all work units are queued before the callers start, so an empty queue means all work is handed out
+        work_queue = manager.Queue()
+        for work_unit in work_units:
+            work_queue.put(work_unit)
+
+        if options.shared_session:
+            if not predict_shared_session(options, work_queue, output_filepath, total_callers, options.threads):
+                sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] ERROR: SHARED SESSION INFERENCE FAILED.\n")
+                exit(1)
+        else:
+            caller_progress = manager.list([0] * total_callers)
+            caller_times = []
+            worker_cpu_sets = get_placement(options, total_callers)
+
+            with concurrent.futures.ProcessPoolExecutor(max_workers=total_callers) as executor:
+                futures = [executor.submit(predict, options, work_queue, caller_progress, output_filepath, threads_per_caller,
+                                           worker_cpu_sets[thread_id], thread_id)
+                           for thread_id in range(0, total_callers)]
+
+                pending_futures = set(futures)
+                while pending_futures:
+                    finished_futures, pending_futures = concurrent.futures.wait(pending_futures,
+                                                                                timeout=InferenceOptions.PROGRESS_REPORT_INTERVAL,
+                                                                                return_when=concurrent.futures.FIRST_COMPLETED)
+                    for fut in finished_futures:
+                        if fut.exception() is None:
+                            # get the results
+                            thread_id, total_candidates, caller_time = fut.result()
+                            caller_times.append(caller_time)
+                            sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: CALLER " + str(thread_id)
+                                             + " FINISHED SUCCESSFULLY, CANDIDATES: " + str(total_candidates)
+                                             + " TIME: " + str(int(caller_time)) + " Sec.\n")
+                        else:
+                            sys.stderr.write("ERROR: " + str(fut.exception()) + "\n")
+                        fut._result = None  # python issue 27144
+
+                    if not finished_futures:
+                        progress = list(caller_progress)
+                        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: CANDIDATES PROCESSED: "
+                                         + str(sum(progress)) + "/" + str(total_images) + ", PER CALLER: "
+                                         + " ".join(str(candidates) for candidates in progress) + "\n")
+                        sys.stderr.flush()
+
+            if caller_times:
+                sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: CALLER TIME SPREAD: "
+                                 + str(int(min(caller_times))) + " - " + str(int(max(caller_times))) + " Sec\n")
 
     end_time = time.time()
     mins = int((end_time - start_time) / 60)
@@ -218,3 +364,17 @@ def predict_distributed_cpu(options, filepath, file_chunks, output_filepath, tot
     sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: FINISHED PREDICTION\n")
     sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: ELAPSED TIME: " + str(mins) + " Min " + str(secs) + " Sec\n")
 
+
+def predict_distributed_cpu(options, filepath, work_units, output_filepath, total_callers, threads_per_caller):
+    """
+    Create a prediction table/dictionary of an images set using a trained model.
+    :param options: Options set for prediction
+    :param filepath: Path to image files to predict on
+    :param work_units: Work units of (file path, summary names, total images) shared by all callers
+    :param output_filepath: Path to output directory
+    :param total_callers: Number of callers to start
+    :param threads_per_caller: Number of threads per caller.
+    :return: Prediction dictionary
+    """
+    prepare_cpu_inference(options, output_filepath)
+    run_distributed_cpu(options, work_units, output_filepath, total_callers, threads_per_caller)
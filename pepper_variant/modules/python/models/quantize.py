@@ -0,0 +1,204 @@
+import sys
+import time
+import h5py
+import numpy as np
+import onnxruntime
+from datetime import datetime
+from os.path import isfile, join
+from os import listdir
+from onnxruntime.quantization import CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType, quantize_static
+from pepper_variant.modules.python.Options import ImageSizeOptions
+
+
+def get_file_paths_from_directory(directory_path):
+    """
+    Returns all paths of files given a directory path
+    :param directory_path: Path to the directory
+    :return: A list of paths of files
+    """
+    file_paths = [join(directory_path, file) for file in listdir(directory_path) if isfile(join(directory_path, file))
+                  and file[-4:] == 'hdf5']
+    return file_paths
+
+
+def load_labeled_images(image_directory, max_images):
+    """
+    Load a limited number of labeled images from a training image directory.
+    :param image_directory: Directory containing training images generated with make_train_images
+    :param max_images: Maximum number of images to load
+    :return: Images and their type labels
+    """
+    all_images = []
+    all_type_labels = []
+    total_images = 0
+
+    for input_file in sorted(get_file_paths_from_directory(image_directory)):
+        with h5py.File(input_file, 'r') as hdf5_file:
+            if 'summaries' not in hdf5_file:
+                continue
+            for summary_name in sorted(hdf5_file['summaries'].keys()):
+                if total_images >= max_images:
+                    break
+                if 'type_label' not in hdf5_file['summaries'][summary_name]:
+                    continue
+                images_needed = max_images - total_images
+                images = hdf5_file['summaries'][summary_name]['images'][:images_needed]
+                type_labels = hdf5_file['summaries'][summary_name]['type_label'][:images_needed]
+                all_images.append(images)
+                all_type_labels.append(type_labels)
+                total_images += len(images)
+        if total_images >= max_images:
+            break
+
+    if total_images == 0:
+        return None, None
+
+    return np.concatenate(all_images).astype(np.float32), np.concatenate(all_type_labels).astype(np.int64)
+
+
+class ImageCalibrationDataReader(CalibrationDataReader):
+    """
+    Feeds representative images to the ONNX static quantization calibrator in batches.
+    """
+    def __init__(self, images, input_name, batch_size):
+        self.images = images
+        self.input_name = input_name
+        self.batch_size = batch_size
+        self.current_index = 0
+
+    def get_next(self):
+        if self.current_index >= len(self.images):
+            return None
+        batch = self.images[self.current_index:self.current_index + self.batch_size]
+        self.current_index += self.batch_size
+        return {self.input_name: batch}
+
+    def rewind(self):
+        self.current_index = 0
+
+
+def quantize_model_static(float_model_path, quantized_model_path, calibration_images, batch_size, calibration_method):
+    """
+    Quantize weights and activations of an ONNX model to INT8 using a calibration set.
+    :param float_model_path: Path to the float ONNX model
+    :param quantized_model_path: Path where the quantized model will be saved
+    :param calibration_images: Representative images used for calibration
+    :param batch_size: Batch size used during calibration
+    :param calibration_method: One of minmax, entropy or percentile
+    :return:
+    """
+    calibration_methods = {'minmax': CalibrationMethod.MinMax,
+                           'entropy': CalibrationMethod.Entropy,
+                           'percentile': CalibrationMethod.Percentile}
+
+    float_session = onnxruntime.InferenceSession(float_model_path)
+    input_name = float_session.get_inputs()[0].name
+    data_reader = ImageCalibrationDataReader(calibration_images, input_name, batch_size)
+
+    quantize_static(float_model_path,
+                    quantized_model_path,
+                    data_reader,
+                    quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8,
+                    weight_type=QuantType.QInt8,
+                    calibrate_method=calibration_methods[calibration_method])
+
+
+def evaluate_onnx_model(model_path, images, type_labels, batch_size, threads):
+    """
+    Run an ONNX model on a set of labeled images.
+    :param model_path: Path to an ONNX model
+    :param images: Images to evaluate on
+    :param type_labels: Truth genotype labels of the images
+    :param batch_size: Batch size for inference
+    :param threads: Number of threads for the session
+    :return: Predicted labels, confusion matrix and time spent on inference
+    """
+    sess_options = onnxruntime.SessionOptions()
+    sess_options.intra_op_num_threads = threads
+    sess_options.inter_op_num_threads = 1
+    sess_options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+    sess_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    ort_session = onnxruntime.InferenceSession(model_path, sess_options=sess_options)
+    input_name = ort_session.get_inputs()[0].name
+
+    predicted_labels = []
+    start_time = time.time()
+    for batch_start in range(0, len(images), batch_size):
+        output_type = ort_session.run(None, {input_name: images[batch_start:batch_start + batch_size]})[0]
+        predicted_labels.append(np.argmax(output_type, axis=1))
+    inference_time = time.time() - start_time
+
+    predicted_labels = np.concatenate(predicted_labels)
+    confusion_matrix = np.zeros((ImageSizeOptions.TOTAL_TYPE_LABELS, ImageSizeOptions.TOTAL_TYPE_LABELS), dtype=np.int64)
+    np.add.at(confusion_matrix, (type_labels, predicted_labels), 1)
+
+    return predicted_labels, confusion_matrix, inference_time
+
+
+def get_variant_level_stats(confusion_matrix):
+    """
+    Calculate genotype accuracy and variant-level precision/recall from a confusion matrix. A variant is any
+    image with a non HOM-REF label, it is recalled if it is predicted to be non HOM-REF.
+    :param confusion_matrix: Confusion matrix with truth labels on rows
+    :return: Accuracy, variant precision and variant recall in percentage
+    """
+    total = max(1, confusion_matrix.sum())
+    accuracy = (100.0 * np.trace(confusion_matrix)) / total
+
+    true_variants = confusion_matrix[1:, 1:].sum()
+    predicted_variants = max(1, confusion_matrix[:, 1:].sum())
+    truth_variants = max(1, confusion_matrix[1:, :].sum())
+    precision = (100.0 * true_variants) / predicted_variants
+    recall = (100.0 * true_variants) / truth_variants
+
+    return accuracy, precision, recall
+
+
+def print_confusion_matrix(name, confusion_matrix):
+    sys.stderr.write(name + " Confusion Matrix:" + "\n")
+    sys.stderr.write("            ")
+    for label in ImageSizeOptions.decoded_labels:
+        sys.stderr.write(str(label) + '    ')
+    sys.stderr.write("\n")
+
+    for i, row in enumerate(confusion_matrix):
+        sys.stderr.write(str(ImageSizeOptions.decoded_labels[i]) + '   ')
+        for j, val in enumerate(row):
+            sys.stderr.write("{0:9d}".format(val) + '  ')
+        sys.stderr.write("\n")
+    sys.stderr.flush()
+
+
+def compare_quantized_model(float_model_path, quantized_model_path, images, type_labels, batch_size, threads):
+    """
+    Report how a quantized model differs from the float model on a labeled image set.
+    :param float_model_path: Path to the float ONNX model
+    :param quantized_model_path: Path to the quantized ONNX model
+    :param images: Images to evaluate on
+    :param type_labels: Truth genotype labels of the images
+    :param batch_size: Batch size for inference
+    :param threads: Number of threads for the session
+    :return: Difference in accuracy between the float and the quantized model
+    """
+    float_predictions, float_confusion_matrix, float_time = evaluate_onnx_model(float_model_path, images, type_labels, batch_size, threads)
+    quantized_predictions, quantized_confusion_matrix, quantized_time = evaluate_onnx_model(quantized_model_path, images, type_labels, batch_size, threads)
+
+    print_confusion_matrix("FLOAT MODEL", float_confusion_matrix)
+    print_confusion_matrix("QUANTIZED MODEL", quantized_confusion_matrix)
+    print_confusion_matrix("DIFFERENCE (QUANTIZED - FLOAT)", quantized_confusion_matrix - float_confusion_matrix)
+
+    float_accuracy, float_precision, float_recall = get_variant_level_stats(float_confusion_matrix)
+    quantized_accuracy, quantized_precision, quantized_recall = get_variant_level_stats(quantized_confusion_matrix)
+    agreement = (100.0 * np.sum(float_predictions == quantized_predictions)) / max(1, len(float_predictions))
+
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: FLOAT MODEL ACCURACY: " + str(round(float_accuracy, 5))
+                     + " VARIANT PRECISION: " + str(round(float_precision, 5)) + " VARIANT RECALL: " + str(round(float_recall, 5))
+                     + " INFERENCE TIME: " + str(round(float_time, 2)) + " Sec\n")
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: QUANTIZED MODEL ACCURACY: " + str(round(quantized_accuracy, 5))
+                     + " VARIANT PRECISION: " + str(round(quantized_precision, 5)) + " VARIANT RECALL: " + str(round(quantized_recall, 5))
+                     + " INFERENCE TIME: " + str(round(quantized_time, 2)) + " Sec\n")
+    sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: PREDICTION AGREEMENT BETWEEN MODELS: " + str(round(agreement, 5)) + "%\n")
+    sys.stderr.flush()
+
+    return float_accuracy - quantized_accuracy
@@ -1,5 +1,6 @@
 import argparse
 import sys
+import platform
 from datetime import datetime
 from pepper.version import __version__
 from pepper_variant.modules.argparse.CallVariantsArguments import add_call_variant_arguments
@@ -7,12 +8,14 @@ from pepper_variant.modules.argparse.MakeImagesArguments import add_make_images_
 from pepper_variant.modules.argparse.RunInferenceArguments import add_run_inference_arguments
 from pepper_variant.modules.argparse.FindCandidatesArguments import add_find_candidates_arguments
 from pepper_variant.modules.argparse.MergeVariantsArguments import add_merge_variants_arguments
+from pepper_variant.modules.argparse.TuneArguments import add_tune_arguments
 from pepper_variant.modules.argparse.SetParameters import set_parameters
 from pepper_variant.modules.python.ImageGenerationUI import ImageGenerationUtils
 from pepper_variant.modules.python.RunInference import run_inference
 from pepper_variant.modules.python.FindCandidates import process_candidates
 from pepper_variant.modules.python.CallVariant import call_variant
 from pepper_variant.modules.python.MergeVariants import merge_vcf_records
+from pepper_variant.modules.python.TuneModule import tune
 
 
 def main():
@@ -54,6 +57,11 @@ def main():
     parser_merge_variants = subparsers.add_parser('merge_variants', help="Merge SNP variants from PEPPER and DeepVariant.")
     add_merge_variants_arguments(parser_merge_variants)
 
+    parser_tune = subparsers.add_parser('tune', help="Find the number of processes, callers, threads per caller and batch size\n"
+                                                     "with the best throughput on a sample of the input and save them as a\n"
+                                                     "profile call_variant can load. Takes the same arguments as call_variant.")
+    add_tune_arguments(parser_tune)
+
     options, unparsed = parser.parse_known_args()
 
     # Following parameters are only used during training, so turning them off by default.
@@ -61,14 +69,25 @@ def main():
     options.truth_vcf = None
     options.random_draw_probability = 1.0
 
-    if options.sub_command in ['call_variant', 'make_images', 'find_candidates']:
+    if options.sub_command in ['call_variant', 'tune', 'make_images', 'find_candidates']:
         options = set_parameters(options)
 
+    if options.sub_command in ['call_variant', 'tune', 'run_inference'] and options.shared_session and sys.version_info < (3, 8):
+        # the shared session passes batches through multiprocessing.shared_memory, added in python 3.8
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] ERROR: --shared_session REQUIRES PYTHON 3.8 OR NEWER, FOUND "
+                         + platform.python_version() + ".\n")
+        exit(1)
+
     if options.sub_command == 'call_variant':
         sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: CALL VARIANT MODULE SELECTED\n")
         options.dry = False
         call_variant(options)
 
+    elif options.sub_command == 'tune':
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: TUNE MODULE SELECTED\n")
+        options.dry = False
+        tune(options)
+
     elif options.sub_command == 'make_images':
         sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: MAKE IMAGE MODULE SELECTED.\n")
         options.image_output_directory = options.output_dir
@@ -5,6 +5,8 @@ from pepper_variant.modules.argparse.SetParameters import set_parameters
 from pepper_variant.modules.python.ImageGenerationUI import ImageGenerationUtils
 from pepper_variant.modules.python.TrainModule import train_pepper_model
 from pepper_variant.modules.python.TestModule import do_test
+from pepper_variant.modules.python.QuantizeModule import do_quantize
+from pepper_variant.modules.python.CascadeModule import do_train_cascade
 from datetime import datetime
 from pepper_variant.modules.argparse.MakeImagesArguments import add_make_images_arguments
 from pepper.version import __version__
@@ -231,6 +233,156 @@ def add_test_model_arguments(parser):
     return parser
 
 
+def add_quantize_model_arguments(parser):
+    parser.add_argument(
+        "--model_path",
+        type=str,
+        required=True,
+        help="Path of the model to quantize."
+    )
+    parser.add_argument(
+        "--calibration_image_dir",
+        type=str,
+        required=True,
+        help="Directory containing a small set of training images used for calibration."
+    )
+    parser.add_argument(
+        "--test_image_dir",
+        type=str,
+        required=True,
+        help="Directory containing training images used to compare the quantized model with the float model."
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        required=True,
+        help="Directory to save the quantized model."
+    )
+    parser.add_argument(
+        "--calibration_images",
+        type=int,
+        required=False,
+        default=5000,
+        help="Number of images used for calibration. Default is 5000."
+    )
+    parser.add_argument(
+        "--test_images",
+        type=int,
+        required=False,
+        default=100000,
+        help="Maximum number of images used for comparison. Default is 100000."
+    )
+    parser.add_argument(
+        "--calibration_method",
+        type=str,
+        required=False,
+        default='minmax',
+        choices=['minmax', 'entropy', 'percentile'],
+        help="Method used to calibrate activation ranges. Default is minmax."
+    )
+    parser.add_argument(
+        "--max_accuracy_drop",
+        type=float,
+        required=False,
+        default=0.1,
+        help="Maximum allowed drop in accuracy (in percentage) of the quantized model. Default is 0.1."
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        required=False,
+        default=512,
+        help="Batch size for calibration and comparison, default is 512."
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        type=int,
+        required=False,
+        default=1,
+        help="Number of threads used for comparison. Default is 1."
+    )
+    parser.add_argument(
+        "-hp",
+        "--use_hp_info",
+        default=False,
+        action='store_true',
+        help="If set then haplotype-aware mode will be enabled."
+    )
+    return parser
+
+
+def add_train_cascade_arguments(parser):
+    parser.add_argument(
+        "--model_path",
+        type=str,
+        required=True,
+        help="Path of the full model the cascade is measured against."
+    )
+    parser.add_argument(
+        "--train_image_dir",
+        type=str,
+        required=True,
+        help="Directory containing training images used to train and calibrate the first stage."
+    )
+    parser.add_argument(
+        "--test_image_dir",
+        type=str,
+        required=True,
+        help="Directory containing held-out training images used to compare the cascade with the full model."
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        required=True,
+        help="Directory to save the cascade model."
+    )
+    parser.add_argument(
+        "--train_images",
+        type=int,
+        required=False,
+        default=500000,
+        help="Maximum number of images used to train and calibrate the first stage. Default is 500000."
+    )
+    parser.add_argument(
+        "--test_images",
+        type=int,
+        required=False,
+        default=100000,
+        help="Maximum number of images used for comparison. Default is 100000."
+    )
+    parser.add_argument(
+        "--max_error_rate",
+        type=float,
+        required=False,
+        default=0.001,
+        help="Maximum allowed error rate among candidates settled by the first stage, must be between 0 and 1. Default is 0.001."
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        required=False,
+        default=512,
+        help="Batch size for comparison, default is 512."
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        type=int,
+        required=False,
+        default=1,
+        help="Number of threads used for comparison. Default is 1."
+    )
+    parser.add_argument(
+        "-hp",
+        "--use_hp_info",
+        default=False,
+        action='store_true',
+        help="If set then haplotype-aware mode will be enabled."
+    )
+    return parser
+
+
 def add_run_hyperband_arguments(parser):
     parser.add_argument(
         "--train_image_dir",
@@ -294,7 +446,9 @@ def main():
                                                  "1) make_train_images: Generate training samples.\n"
                                                  "2) train_model: Train a model using train and test files\n"
                                                  "3) test_model: Test a model on a set of training samples.\n"
-                                                 "4) run_hyperband: Hyper-parameter tuning [in development].\n",
+                                                 "4) quantize_model: Quantize a model to INT8 using a calibration set.\n"
+                                                 "5) train_cascade: Train a first-stage classifier that settles easy candidates.\n"
+                                                 "6) run_hyperband: Hyper-parameter tuning [in development].\n",
                                      formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument(
         "--version",
@@ -315,6 +469,12 @@ def main():
     parser_test_model = subparsers.add_parser('test_model', help="Test a pre-trained model.")
     add_test_model_arguments(parser_test_model)
 
+    parser_quantize_model = subparsers.add_parser('quantize_model', help="Quantize a model to INT8 for CPU inference.")
+    add_quantize_model_arguments(parser_quantize_model)
+
+    parser_train_cascade = subparsers.add_parser('train_cascade', help="Train and measure a confidence cascade for CPU inference.")
+    add_train_cascade_arguments(parser_train_cascade)
+
     # parser_test_model = subparsers.add_parser('run_hyperband', help="Run hyperband to find best set of parameters.")
     # add_test_model_arguments(parser_test_model)
 
@@ -344,6 +504,14 @@ def main():
                 options.num_workers,
                 options.model_path)
 
+    elif options.sub_command == 'quantize_model':
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: QUANTIZE MODEL MODULE SELECTED\n")
+        do_quantize(options)
+
+    elif options.sub_command == 'train_cascade':
+        sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: TRAIN CASCADE MODULE SELECTED\n")
+        do_train_cascade(options)
+
     elif options.sub_command == 'torch_stat':
         sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: TORCH VERSION: " + str(torch.__version__) + "\n\n")
         sys.stderr.write("[" + str(datetime.now().strftime('%m-%d-%Y %H:%M:%S')) + "] INFO: PARALLEL CONFIG:\n")
@@ -0,0 +1,85 @@
+import sys
+import copy
+import types
+import random
+import itertools
+import unittest
+
+try:
+    import pepper.build
+except ImportError:
+    # the conflict resolution is pure python, the compiled extension is only needed to summarize alignments
+    sys.modules['pepper.build'] = types.SimpleNamespace(PEPPER=None)
+
+from pepper.modules.python.AlignmentSummarizer import AlignmentSummarizer
+
+
+class AllPairsAlignmentSummarizer(AlignmentSummarizer):
+    @staticmethod
+    def get_candidate_region_pairs(regions):
+        return list(itertools.combinations(range(len(regions)), 2))
+
+
+def make_summarizer(summarizer_class, region_start, region_end):
+    summarizer = summarizer_class.__new__(summarizer_class)
+    summarizer.region_start_position = region_start
+    summarizer.region_end_position = region_end
+    return summarizer
+
+
+class TestRemoveConflictingRegions(unittest.TestCase):
+    def assert_same_as_all_pairs(self, regions, region_start=0, region_end=1000, min_length=0):
+        expected = make_summarizer(AllPairsAlignmentSummarizer, region_start, region_end)\
+            .remove_conflicting_regions(copy.deepcopy(regions), min_length=min_length)
+        observed = make_summarizer(AlignmentSummarizer, region_start, region_end)\
+            .remove_conflicting_regions(copy.deepcopy(regions), min_length=min_length)
+        self.assertEqual(observed, expected)
+
+    def test_overlapping_regions(self):
+        self.assert_same_as_all_pairs([[0, 100, 'a', True], [90, 200, 'b', True], [50, 60, 'c', True],
+                                       [150, 400, 'd', True], [10, 110, 'e', True]])
+
+    def test_zero_length_regions(self):
+        self.assert_same_as_all_pairs([[50, 50, 'a', True], [0, 100, 'b', True], [100, 100, 'c', True],
+                                       [0, 0, 'd', True], [50, 50, 'e', True]])
+
+    def test_touching_regions(self):
+        self.assert_same_as_all_pairs([[0, 100, 'a', True], [100, 200, 'b', True], [200, 300, 'c', True],
+                                       [300, 300, 'd', True], [150, 200, 'e', True]])
+
+    def test_inverted_regions(self):
+        self.assert_same_as_all_pairs([[0, 100, 'a', True], [120, 80, 'b', True], [90, 150, 'c', True],
+                                       [300, 10, 'd', True]])
+
+    def test_random_regions(self):
+        random_generator = random.Random(1)
+        for _ in range(2000):
+            regions = []
+            for index in range(random_generator.randint(0, 20)):
+                start = random_generator.randint(0, 200)
+                length = random_generator.choice([0, 1, random_generator.randint(0, 50), random_generator.randint(0, 300)])
+                if random_generator.random() < 0.02:
+                    length = -random_generator.randint(1, 10)
+                regions.append([start, start + length, index, True])
+            self.assert_same_as_all_pairs(regions,
+                                          region_start=random_generator.randint(0, 50),
+                                          region_end=random_generator.randint(100, 600),
+                                          min_length=random_generator.choice([0, 1, 10]))
+
+
+class TestGetCandidateRegionPairs(unittest.TestCase):
+    def test_intersecting_pairs_in_combination_order(self):
+        regions = [[0, 100, 'a', True], [100, 200, 'b', True], [201, 300, 'c', True], [50, 50, 'd', True],
+                   [150, 250, 'e', True]]
+        expected = [(i, j) for i, j in itertools.combinations(range(len(regions)), 2)
+                    if max(regions[i][0], regions[j][0]) <= min(regions[i][1], regions[j][1])]
+        self.assertEqual(AlignmentSummarizer.get_candidate_region_pairs(regions), expected)
+
+    def test_inverted_regions_compare_all_pairs(self):
+        regions = [[0, 100, 'a', True], [300, 200, 'b', True], [500, 600, 'c', True]]
+        self.assertEqual(AlignmentSummarizer.get_candidate_region_pairs(regions),
+                         list(itertools.combinations(range(len(regions)), 2)))
+
+
+if __name__ == '__main__':
+    unittest.main()
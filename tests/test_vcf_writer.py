@@ -0,0 +1,100 @@
+import os
+import sys
+import types
+import shutil
+import tempfile
+import unittest
+import pysam
+
+try:
+    import pepper_variant.build
+except ImportError:
+    # records are formatted in pure python, the compiled extension is only needed to read the reference
+    sys.modules['pepper_variant.build'] = types.SimpleNamespace(PEPPER_VARIANT=None)
+
+from pepper_variant.modules.python.VcfWriter import VCFWriter, format_vcf_record
+
+
+CONTIG_LENGTHS = {'chr1': 1000, 'chr2': 500}
+SAMPLE_NAME = 'Sample'
+
+# contig, ref_start, alleles, qual, filter, genotype, non_alt_predictions, genotype_quality, depth, allele support, vafs, rep
+RECORDS = [
+    ('chr1', 9, ('A', 'G'), 37, 'PASS', [0, 1], [0.998], 37, 20, [9], [0.45], "0"),
+    ('chr1', 99, ('ACGT', 'A', 'ACGTT'), 12, 'PASS', [1, 2], [0.7, 0.65], 12, 31, [14, 12], [0.452, 0.387], "1"),
+    ('chr1', 199, ('C', 'T'), 3, 'refCall', [0, 0], [0.123456], 4, 8, [1], [0.125], "0"),
+    ('chr1', 299, ('G', 'GA'), 23.456789, 'lowQUAL', [1, 1], [0.3333333], 7.1, 12, [11], [0.917], "1"),
+    ('chr2', 0, ('T', 'C', 'G', 'TA'), 61.0, 'PASS', [1, 3], [0.95, 0.0001, 0.875], 0.5, 40, [20, 0, 19], [0.5, 0.0, 0.475], "0"),
+]
+
+
+def get_vcf_header():
+    vcf_writer = VCFWriter.__new__(VCFWriter)
+    vcf_writer.fasta_handler = types.SimpleNamespace(get_chromosome_names=lambda: list(CONTIG_LENGTHS.keys()),
+                                                     get_chromosome_sequence_length=lambda contig: CONTIG_LENGTHS[contig])
+    return vcf_writer.get_vcf_header(SAMPLE_NAME, list(CONTIG_LENGTHS.keys()))
+
+
+class TestFormatVcfRecord(unittest.TestCase):
+    def setUp(self):
+        self.output_directory = tempfile.mkdtemp()
+        self.vcf_header = get_vcf_header()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_directory)
+
+    def get_pysam_records(self):
+        # records built the way VCFWriter built them before they were formatted as text
+        vcf_file_name = os.path.join(self.output_directory, "pysam.vcf")
+        vcf_file = pysam.VariantFile(vcf_file_name, 'w', header=self.vcf_header)
+        records = []
+        for contig, ref_start, alleles, qual, vcf_filter, genotype, non_alt_predictions, genotype_quality, depth, support, vafs, rep in RECORDS:
+            records.append(vcf_file.new_record(contig=contig, start=ref_start, stop=ref_start + len(alleles[0]), id='.', qual=qual,
+                                               filter=vcf_filter, alleles=alleles, GT=genotype, AP=non_alt_predictions,
+                                               GQ=genotype_quality, DP=depth, AD=support, VAF=vafs, REP=rep))
+        return vcf_file_name, vcf_file, records
+
+    def read_pysam_records(self):
+        vcf_file_name, vcf_file, records = self.get_pysam_records()
+        for record in records:
+            vcf_file.write(record)
+        vcf_file.close()
+
+        with pysam.VariantFile(vcf_file_name) as vcf_file:
+            return list(vcf_file.fetch())
+
+    def get_formatted_records(self):
+        vcf_file_name = os.path.join(self.output_directory, "formatted.vcf")
+        with open(vcf_file_name, 'wb') as vcf_file:
+            vcf_file.write(str(self.vcf_header).encode())
+            for record in RECORDS:
+                vcf_file.write(format_vcf_record(*record))
+
+        with pysam.VariantFile(vcf_file_name) as vcf_file:
+            return list(vcf_file.fetch())
+
+    def test_lines_match_pysam_records(self):
+        vcf_file_name, vcf_file, pysam_records = self.get_pysam_records()
+        for record, pysam_record in zip(RECORDS, pysam_records):
+            self.assertEqual(format_vcf_record(*record).decode(), str(pysam_record))
+        vcf_file.close()
+
+    def test_parsed_records_match_pysam_records(self):
+        formatted_records = self.get_formatted_records()
+        pysam_records = self.read_pysam_records()
+        self.assertEqual(len(formatted_records), len(pysam_records))
+
+        for formatted_record, pysam_record in zip(formatted_records, pysam_records):
+            self.assertEqual(formatted_record.contig, pysam_record.contig)
+            self.assertEqual(formatted_record.start, pysam_record.start)
+            self.assertEqual(formatted_record.stop, pysam_record.stop)
+            self.assertEqual(formatted_record.alleles, pysam_record.alleles)
+            self.assertEqual(str(formatted_record), str(pysam_record))
+            self.assertEqual(formatted_record.qual, pysam_record.qual)
+            self.assertEqual(list(formatted_record.filter.keys()), list(pysam_record.filter.keys()))
+            for key in ('GT', 'AP', 'GQ', 'DP', 'AD', 'VAF', 'REP'):
+                self.assertEqual(formatted_record.samples[SAMPLE_NAME][key], pysam_record.samples[SAMPLE_NAME][key], key)
+
+
+if __name__ == '__main__':
+    unittest.main()